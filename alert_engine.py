@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Streaming fever alerts for many patients, evaluated as arrays.
+
+Every patient (patch id, or camera track) gets a row; all state is kept
+in numpy arrays indexed by row: the last readings (a small ring buffer
+per patient), the active flag of every rule and the time of the last
+alert. Each tick takes the readings that arrived as arrays and evaluates
+all rules on those rows at once:
+
+    ThresholdRule     reading >= threshold
+    RateOfRiseRule    rise over the minimum of the last `window` seconds >= rise, from `minimum`
+                      on (a patch warming up after it is applied rises too)
+    SustainedRule     reading >= threshold without interruption for `duration` seconds
+
+Every rule has hysteresis: once active it stays active until its own
+clear condition holds (e.g. 0.3 °C below the threshold), so a reading
+oscillating around 37.5 does not raise an alert per sample. An alert is
+raised on the inactive -> active edge of a (patient, rule) pair and is
+suppressed if the same pair raised one less than `cooldown` seconds ago.
+Alerts go to the sinks: any object with emit(alerts), e.g. PrintSink or
+CsvSink below.
+
+    engine = AlertEngine(default_rules(), sinks=[PrintSink(), CsvSink('alerts.csv')])
+    engine.update(patch_ids, temperatures, time.time())
+"""
+
+import abc
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+ALERT_COLUMNS = ['time', 'patient', 'rule', 'state', 'value']
+
+
+class Rule(abc.ABC):
+    """
+    Base class: evaluate() returns the trigger and clear conditions of the given rows
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.state = {}
+
+    def grow(self, capacity):
+        """
+        Resize the per-patient state arrays
+        :return:
+        """
+        for key, (array, fill) in list(self.state.items()):
+            grown = np.full(capacity, fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            self.state[key] = (grown, fill)
+
+    def array(self, key):
+        return self.state[key][0]
+
+    @abc.abstractmethod
+    def evaluate(self, engine, rows, values, now, active):
+        """
+        :return: (trigger, clear) boolean arrays of the rows
+        """
+
+
+class ThresholdRule(Rule):
+
+    def __init__(self, name='fever', threshold=37.5, clear_below=None):
+        super().__init__(name)
+        self.threshold = threshold
+        self.clear_below = threshold - 0.3 if clear_below is None else clear_below
+
+    def evaluate(self, engine, rows, values, now, active):
+        return values >= self.threshold, values < self.clear_below
+
+
+class RateOfRiseRule(Rule):
+
+    def __init__(self, name='rising', rise=1.0, window=1800.0, clear_rise=None, minimum=37.0):
+        """
+        :param rise: °C above the minimum of the window
+        :param window: seconds, limited by the engine history length
+        :param minimum: °C the reading must reach, so the warm-up of a new patch does not alert
+        """
+        super().__init__(name)
+        self.rise = rise
+        self.window = window
+        self.clear_rise = rise / 2 if clear_rise is None else clear_rise
+        self.minimum = minimum
+
+    def evaluate(self, engine, rows, values, now, active):
+        times = engine.history_t[rows]
+        recent = np.where(times >= now - self.window, engine.history_v[rows], np.inf)
+        # no history yet in the window: inf, no rise
+        rise = values - recent.min(axis=1)
+        return (rise >= self.rise) & (values >= self.minimum), (rise < self.clear_rise) | (values < self.minimum - 0.3)
+
+
+class SustainedRule(Rule):
+
+    def __init__(self, name='sustained fever', threshold=37.5, duration=600.0, clear_below=None):
+        super().__init__(name)
+        self.threshold = threshold
+        self.duration = duration
+        self.clear_below = threshold - 0.3 if clear_below is None else clear_below
+        self.state['since'] = (np.zeros(0), np.nan)
+
+    def evaluate(self, engine, rows, values, now, active):
+        since = self.array('since')
+        above = values >= self.threshold
+        start = since[rows]
+        start = np.where(above & np.isnan(start), now, start)
+        start = np.where(above, start, np.nan)
+        since[rows] = start
+        with np.errstate(invalid='ignore'):
+            held = now - start >= self.duration
+        return held, values < self.clear_below
+
+
+def default_rules(threshold=37.5):
+    return [ThresholdRule('fever', threshold),
+            SustainedRule('sustained fever', threshold, duration=600.0),
+            RateOfRiseRule('rising', rise=1.0, window=1800.0)]
+
+
+class PrintSink:
+
+    def emit(self, alerts):
+        for alert in alerts:
+            print("[{}] {} {} {}: {:.2f} °C".format(time.strftime('%H:%M:%S', time.localtime(alert['time'])),
+                                                   alert['patient'], alert['rule'], alert['state'], alert['value']))
+
+
+class CsvSink:
+    """
+    Append the alerts to a CSV file
+    """
+
+    def __init__(self, csv_filename):
+        self.csv_filename = csv_filename
+        if not os.path.isfile(csv_filename):
+            with open(csv_filename, 'w', newline='') as fh:
+                csv.writer(fh).writerow(ALERT_COLUMNS)
+
+    def emit(self, alerts):
+        if not alerts:
+            return
+        with open(self.csv_filename, 'a', newline='') as fh:
+            writer = csv.writer(fh)
+            for alert in alerts:
+                writer.writerow([alert[c] for c in ALERT_COLUMNS])
+
+
+class AlertEngine:
+
+    def __init__(self, rules=None, sinks=(), cooldown=900.0, history=16, history_interval=120.0, capacity=1024,
+                 notify_clear=False):
+        """
+        :param rules: list of Rule, default_rules() if None
+        :param sinks: objects with emit(list of alert dicts)
+        :param cooldown: seconds during which a (patient, rule) pair does not alert again
+        :param history: readings kept per patient for the rate rules, at least history_interval seconds apart
+            (the defaults cover 32 minutes)
+        :param notify_clear: also emit an alert when a rule clears
+        """
+        self.rules = default_rules() if rules is None else list(rules)
+        self.sinks = list(sinks)
+        self.cooldown = cooldown
+        self.notify_clear = notify_clear
+
+        self.ids = []
+        self.rows = {}
+        self.n = 0
+        self.capacity = 0
+        self.history = history
+        self.history_interval = history_interval
+        self.history_t = np.zeros((0, history))
+        self.history_v = np.zeros((0, history), dtype=np.float32)
+        self.position = np.zeros(0, dtype=np.int64)
+        self.active = np.zeros((len(self.rules), 0), dtype=bool)
+        self.last_alert = np.zeros((len(self.rules), 0))
+        self._grow(capacity)
+
+        self.ticks = 0
+        self.readings = 0
+        self.raised = 0
+        self.suppressed = 0
+        self.seconds = 0.0
+
+    def _grow(self, capacity):
+        old = self.capacity
+        if capacity <= old:
+            return
+        history_t = np.full((capacity, self.history), -np.inf)
+        history_v = np.full((capacity, self.history), np.inf, dtype=np.float32)
+        history_t[:old], history_v[:old] = self.history_t, self.history_v
+        position = np.zeros(capacity, dtype=np.int64)
+        position[:old] = self.position
+        active = np.zeros((len(self.rules), capacity), dtype=bool)
+        active[:, :old] = self.active
+        last_alert = np.full((len(self.rules), capacity), -np.inf)
+        last_alert[:, :old] = self.last_alert
+        self.history_t, self.history_v, self.position = history_t, history_v, position
+        self.active, self.last_alert = active, last_alert
+        for rule in self.rules:
+            rule.grow(capacity)
+        self.capacity = capacity
+
+    def register(self, ids):
+        """
+        Rows of the patients, new ones are added
+        :return: int64 array
+        """
+        rows = np.empty(len(ids), dtype=np.int64)
+        for i, patient in enumerate(ids):
+            row = self.rows.get(patient)
+            if row is None:
+                row = self.rows[patient] = self.n
+                self.ids.append(patient)
+                self.n += 1
+            rows[i] = row
+        if self.n > self.capacity:
+            self._grow(max(self.n, 2 * self.capacity))
+        return rows
+
+    def update(self, ids, values, timestamp=None):
+        """
+        Feed the readings of one tick
+        :param ids: patient ids (patch ids, 'camera:<track>', ...)
+        :param values: temperatures, NaN for no reading
+        :return: list of the alerts emitted
+        """
+        return self.update_rows(self.register(ids), values, timestamp)
+
+    def update_rows(self, rows, values, timestamp=None):
+        """
+        update() with rows from register(), for sources that keep them
+        :return: list of the alerts emitted
+        """
+        start = time.perf_counter()
+        now = time.time() if timestamp is None else float(timestamp)
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        keep = ~np.isnan(values)
+        rows, values = rows[keep], values[keep]
+        # last reading wins if a patient reports twice in the same tick
+        rows, last = np.unique(rows[::-1], return_index=True)
+        values = values[::-1][last]
+
+        # one history sample per interval per patient
+        slot = self.position[rows]
+        due = now - self.history_t[rows, (slot - 1) % self.history] >= self.history_interval
+        written, slot = rows[due], slot[due]
+        self.history_t[written, slot] = now
+        self.history_v[written, slot] = values[due]
+        self.position[written] = (slot + 1) % self.history
+
+        alerts = []
+        for r, rule in enumerate(self.rules):
+            active = self.active[r, rows]
+            trigger, clear = rule.evaluate(self, rows, values, now, active)
+            new_active = np.where(active, ~clear, trigger)
+            self.active[r, rows] = new_active
+
+            raised = new_active & ~active
+            if raised.any():
+                fresh = raised & (now - self.last_alert[r, rows] >= self.cooldown)
+                self.suppressed += int(raised.sum() - fresh.sum())
+                self.last_alert[r, rows[fresh]] = now
+                alerts.extend(self._alerts(rule, rows[fresh], values[fresh], now, 'raised'))
+            if self.notify_clear:
+                cleared = active & ~new_active
+                alerts.extend(self._alerts(rule, rows[cleared], values[cleared], now, 'cleared'))
+
+        self.raised += sum(1 for a in alerts if a['state'] == 'raised')
+        self.ticks += 1
+        self.readings += len(rows)
+        self.seconds += time.perf_counter() - start
+        if alerts:
+            for sink in self.sinks:
+                sink.emit(alerts)
+        return alerts
+
+    def _alerts(self, rule, rows, values, now, state):
+        return [{'time': now, 'patient': self.ids[row], 'rule': rule.name, 'state': state, 'value': float(value)}
+                for row, value in zip(rows.tolist(), values.tolist())]
+
+    def in_alert(self, rule=None):
+        """
+        Patients with an active rule (any rule if None)
+        :return: list of ids
+        """
+        if rule is None:
+            mask = self.active[:, :self.n].any(axis=0)
+        else:
+            mask = self.active[[r.name for r in self.rules].index(rule), :self.n]
+        return [self.ids[i] for i in np.flatnonzero(mask)]
+
+    def stats(self):
+        return {
+            'patients': self.n,
+            'ticks': self.ticks,
+            'readings': self.readings,
+            'raised': self.raised,
+            'suppressed': self.suppressed,
+            'ms_per_tick': self.seconds / self.ticks * 1000 if self.ticks else float('nan'),
+        }
+
+
+def feed_frame(engine, df, column='temperatureProcessed', id_column='patchId', tick='1min'):
+    """
+    Replay export-like rows (steadytemp_store query, merged series) through the engine, one tick per time bucket
+    :return: list of all the alerts
+    """
+    import pandas as pd
+
+    if 'valid' in df.columns:
+        df = df[df['valid']]
+    df = df.sort_values('time')
+    rows = engine.register(df[id_column].astype(str).tolist())
+    values = df[column].to_numpy(dtype=np.float32)
+    buckets = pd.to_datetime(df['time'], utc=True).dt.floor(tick)
+    seconds = (buckets - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+    seconds = seconds.to_numpy()
+    edges = np.flatnonzero(np.diff(seconds)) + 1
+    alerts = []
+    for sel in np.split(np.arange(len(seconds)), edges):
+        if len(sel):
+            alerts.extend(engine.update_rows(rows[sel], values[sel], float(seconds[sel[0]])))
+    return alerts
+
+
+def synthetic_load(patients=10000, ticks=360, period=10.0, fever_fraction=0.02, seed=0):
+    """
+    Stream of readings: every patient reports each tick, a few develop a fever
+    :return: generator of (timestamp, values)
+    """
+    rng = np.random.default_rng(seed)
+    base = rng.normal(36.6, 0.3, patients).astype(np.float32)
+    onset = np.full(patients, np.inf)
+    sick = rng.random(patients) < fever_fraction
+    onset[sick] = rng.uniform(0, ticks * period, sick.sum())
+    start = time.time()
+    for i in range(ticks):
+        t = i * period
+        fever = np.clip((t - onset) / 1200.0, 0, 1) * 2.0
+        values = base + fever + rng.normal(0, 0.05, patients).astype(np.float32)
+        # a few patches miss a reading
+        values[rng.random(patients) < 0.05] = np.nan
+        yield start + t, values.astype(np.float32)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fever alert rules over patch and camera readings')
+    parser.add_argument('--load', type=int, default=None, help='Run a synthetic stream of this many patients')
+    parser.add_argument('--ticks', type=int, default=360, help='Ticks of the synthetic stream (10 s apart)')
+    parser.add_argument('--store', type=str, default=None, help='Replay a steadytemp_store.py store')
+    parser.add_argument('--csv', type=str, nargs='*', default=None, help='Replay SteadyTemp CSV exports')
+    parser.add_argument('--threshold', type=float, default=37.5, help='Fever threshold')
+    parser.add_argument('--out', type=str, default=None, help='Also write the alerts to this CSV')
+    args = parser.parse_args()
+
+    sinks = [CsvSink(args.out)] if args.out else []
+    if args.load:
+        engine = AlertEngine(default_rules(args.threshold), sinks=sinks, capacity=args.load)
+        rows = engine.register(['patient{:05d}'.format(i) for i in range(args.load)])
+        for timestamp, values in synthetic_load(args.load, args.ticks):
+            engine.update_rows(rows, values, timestamp)
+    else:
+        engine = AlertEngine(default_rules(args.threshold), sinks=sinks + [PrintSink()])
+        if args.store:
+            from steadytemp_store import SteadyTempStore
+            feed_frame(engine, SteadyTempStore(args.store).query())
+        for csv_filename in args.csv or []:
+            from steadytemp_store import read_export
+            feed_frame(engine, read_export(csv_filename))
+    print(engine.stats())
@@ -0,0 +1,55 @@
+"""
+Alert rules over a synthetic stream of 10k patients, per tick.
+"""
+
+import pytest
+
+from alert_engine import AlertEngine, ThresholdRule, default_rules, synthetic_load
+
+PATIENTS = 10000
+TICKS = 120
+
+
+@pytest.fixture(scope='module')
+def stream():
+    return list(synthetic_load(PATIENTS, TICKS))
+
+
+def bench_alert_engine_stream(benchmark, stream):
+    def run():
+        engine = AlertEngine(default_rules(), capacity=PATIENTS)
+        rows = engine.register(['patient{:05d}'.format(i) for i in range(PATIENTS)])
+        for timestamp, values in stream:
+            engine.update_rows(rows, values, timestamp)
+        return engine
+
+    engine = benchmark.pedantic(run, rounds=3, iterations=1)
+    benchmark.extra_info['ms_per_tick'] = engine.stats()['ms_per_tick']
+    assert engine.raised > 0
+
+
+def bench_alert_engine_threshold_ids(benchmark, stream):
+    # update() with ids, the path of sources that do not keep the rows
+    ids = ['patient{:05d}'.format(i) for i in range(PATIENTS)]
+    engine = AlertEngine([ThresholdRule()], capacity=PATIENTS)
+    ticks = iter(stream * 10)
+    benchmark(lambda: engine.update(ids, *next(ticks)[::-1]))
+
+
+def bench_per_patient_loop_threshold(benchmark, stream):
+    # the same threshold + hysteresis rule written per patient, for comparison
+    def run():
+        active = {}
+        raised = 0
+        for timestamp, values in stream:
+            for i, value in enumerate(values.tolist()):
+                if value != value:
+                    continue
+                was = active.get(i, False)
+                now = value >= 37.2 if was else value >= 37.5
+                if now and not was:
+                    raised += 1
+                active[i] = now
+        return raised
+
+    assert benchmark.pedantic(run, rounds=3, iterations=1) > 0
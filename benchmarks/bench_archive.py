@@ -0,0 +1,59 @@
+"""
+Frame archive: appending from the live loop and random access by index and time.
+"""
+
+import numpy as np
+import pytest
+
+from conftest import RESOLUTIONS, synthetic_raw
+from frame_archive import FrameArchive
+from rawframe import Calibration
+
+FRAMES = 256
+
+
+def noisy_frames(shape, n, seed=0):
+    rng = np.random.default_rng(seed)
+    scene = synthetic_raw(shape).astype(np.int32)
+    return [np.clip(scene + rng.normal(0, 3, shape), 0, 65535).astype(np.uint16) for _ in range(n)]
+
+
+@pytest.fixture(scope='module')
+def archive(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('archive')
+    with FrameArchive(str(folder)) as archive:
+        for i, raw in enumerate(noisy_frames(RESOLUTIONS['qvga'], FRAMES)):
+            archive.append(raw, 1000.0 + i, Calibration(E=0.98))
+    return FrameArchive(str(folder))
+
+
+@pytest.mark.parametrize('resolution', list(RESOLUTIONS))
+def bench_archive_append(benchmark, tmp_path, resolution):
+    frames = noisy_frames(RESOLUTIONS[resolution], 64)
+
+    def append_all():
+        with FrameArchive(str(tmp_path / resolution)) as archive:
+            start = archive._last_timestamp() or 0.0
+            for i, raw in enumerate(frames):
+                archive.append(raw, start + i + 1)
+        return archive
+
+    archive = benchmark.pedantic(append_all, rounds=3, iterations=1)
+    assert archive.stats()['ratio'] > 1.5
+
+
+def bench_archive_random_frame(benchmark, archive):
+    rng = np.random.default_rng(0)
+    # every read decodes its chunk
+    archive = FrameArchive(archive.folder, cache_chunks=0)
+
+    def read():
+        return archive.frame(int(rng.integers(0, FRAMES)))
+
+    timestamp, frame = benchmark(read)
+    assert frame.shape == RESOLUTIONS['qvga']
+
+
+def bench_archive_time_range(benchmark, archive):
+    frames = benchmark(lambda: [f for _, f in archive.range(1100.0, 1164.0)])
+    assert len(frames) == 64
@@ -0,0 +1,32 @@
+"""
+Decoding of replayed patch advertisements.
+"""
+
+import numpy as np
+import pytest
+
+from ble_decode import decode_temperature, decode_temperatures
+
+ADVERTISEMENTS = 100000
+
+
+@pytest.fixture(scope='module')
+def payloads():
+    """
+    Service data as the patch sends it: int16 LE hundredths of a degree plus a few trailing bytes
+    :return:
+    """
+    rng = np.random.default_rng(0)
+    raw = (rng.normal(6150, 50, ADVERTISEMENTS)).astype('<i2')
+    tail = rng.integers(0, 256, (ADVERTISEMENTS, 6), dtype=np.uint8)
+    return [r.tobytes() + t.tobytes() for r, t in zip(raw, tail)]
+
+
+def bench_decode_temperature_loop(benchmark, payloads):
+    temps = benchmark(lambda: [decode_temperature(p, offset=-25) for p in payloads])
+    assert 35 < np.mean(temps) < 38
+
+
+def bench_decode_temperatures_vectorized(benchmark, payloads):
+    temps = benchmark(decode_temperatures, payloads, -25)
+    assert 35 < temps.mean() < 38
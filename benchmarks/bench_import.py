@@ -0,0 +1,54 @@
+"""
+Start-up cost of the command line entry points, measured with python -X importtime.
+
+Each entry point has a budget for its cumulative import time and a list of
+heavy packages it must not pull in at import (they are imported by the code
+paths that need them).
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+# module: (cumulative import budget in ms, packages that must stay unimported)
+ENTRY_POINTS = {
+    'flir': (100, ['requests', 'matplotlib', 'numpy', 'flir_image_extractor']),
+    'flir_image_extractor': (400, ['matplotlib']),
+    'main': (400, ['matplotlib', 'requests']),
+    'lab': (1000, ['matplotlib', 'IPython', 'pandas', 'scipy', 'requests']),
+}
+
+
+def import_profile(module):
+    """
+    Import a module in a fresh interpreter
+    :return: (cumulative import time of the module in ms, set of the imported module names)
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT, MPLBACKEND='Agg')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    imported = set()
+    cumulative = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        imported.add(name.strip())
+        if name.strip() == module and not name[1:].startswith(' '):
+            cumulative = int(cumulative_us) / 1000.0
+    return cumulative, imported
+
+
+@pytest.mark.parametrize('module', list(ENTRY_POINTS))
+def bench_import_time(benchmark, module):
+    budget_ms, forbidden = ENTRY_POINTS[module]
+    cumulative, imported = benchmark.pedantic(import_profile, args=(module,), rounds=3, iterations=1)
+    benchmark.extra_info['import_ms'] = cumulative
+
+    leaked = sorted(p for p in forbidden if p in imported)
+    assert not leaked, "{} imports {} at start-up".format(module, ', '.join(leaked))
+    assert cumulative <= budget_ms, "{} takes {:.0f} ms to import (budget {} ms)".format(module, cumulative, budget_ms)
@@ -0,0 +1,71 @@
+"""
+Live temperature plot: decimation and refresh with hours of multi-patch history.
+"""
+
+import numpy as np
+import pytest
+
+from decimating_plot import DecimatingPlot, lttb, minmax_decimate, to_datenum
+
+PATCHES = 4
+# 6 hours at 1 Hz per patch
+READINGS = 6 * 3600
+
+
+@pytest.fixture(scope='module')
+def history():
+    rng = np.random.default_rng(0)
+    times = to_datenum(1.7e9) + np.arange(READINGS) / 86400.0
+    values = [(36.5 + np.cumsum(rng.normal(0, 0.01, READINGS))).astype(np.float32) for _ in range(PATCHES)]
+    return times, values
+
+
+@pytest.mark.parametrize('method', ['minmax', 'lttb'])
+def bench_decimate(benchmark, history, method):
+    times, values = history
+    if method == 'lttb':
+        t, v = benchmark(lttb, times, values[0], 2000)
+    else:
+        t, v = benchmark(minmax_decimate, times, values[0], 1000)
+    assert len(t) <= 2000
+
+
+def _figure():
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(10, 4), dpi=100)
+    return fig, ax
+
+
+def bench_refresh_decimated(benchmark, history):
+    import matplotlib.pyplot as plt
+    times, values = history
+    fig, ax = _figure()
+    plot = DecimatingPlot(ax)
+    for p, v in enumerate(values):
+        plot.extend(p, times, v)
+
+    def refresh():
+        # one new reading per patch, as every second in last_temp.py
+        for series in plot.series.values():
+            series.append(series.t[series.n - 1] + 1 / 86400.0, 36.5)
+        plot.refresh()
+
+    benchmark(refresh)
+    assert plot.drawn_points < PATCHES * 2 * ax.get_window_extent().width + PATCHES
+    plt.close(fig)
+
+
+def bench_refresh_replot(benchmark, history):
+    # what live_time_stamp.py did: clear the axes and plot everything again
+    import matplotlib.pyplot as plt
+    times, values = history
+    fig, ax = _figure()
+
+    def replot():
+        ax.clear()
+        for v in values:
+            ax.plot(times, v)
+        fig.canvas.draw()
+
+    benchmark.pedantic(replot, rounds=5, iterations=1)
+    plt.close(fig)
@@ -0,0 +1,61 @@
+"""
+Dashboard range queries over four weeks of 10 s readings: rollup tiers vs resampling the raw rows.
+"""
+
+import pandas as pd
+import pytest
+
+from query_service import QueryService, synthetic_history
+
+DAYS = 28
+POINTS = 500
+
+
+@pytest.fixture(scope='module')
+def history():
+    return synthetic_history(patches=4, days=DAYS)
+
+
+@pytest.fixture(scope='module')
+def service(history):
+    service = QueryService()
+    service.rollups.add_frame(history, 'temperatureProcessed', 'patch')
+    return service
+
+
+def bench_rollup_query(benchmark, service):
+    params = {'series': 'patch:patch0', 'points': str(POINTS)}
+
+    def query():
+        service.cache.clear()
+        return service.handle('/rollup', params)
+
+    status, body = benchmark(query)
+    assert status == 200
+
+
+def bench_rollup_query_cached(benchmark, service):
+    params = {'series': 'patch:patch1', 'points': str(POINTS)}
+    service.handle('/rollup', params)
+    status, _ = benchmark(service.handle, '/rollup', params)
+    assert status == 200
+
+
+def bench_resample_raw(benchmark, history):
+    raw = history[history['patchId'] == 'patch0'].set_index('time')['temperatureProcessed']
+    step = '{}s'.format(DAYS * 86400 // POINTS)
+    result = benchmark(lambda: raw.resample(step).agg(['count', 'mean', 'min', 'max']))
+    assert len(result) > 0
+
+
+def bench_rollup_append_minute(benchmark, history):
+    # one minute of new readings of every patch, at the end of the history
+    service = QueryService()
+    service.rollups.add_frame(history, 'temperatureProcessed', 'patch')
+    tail = history.groupby('patchId').tail(6).copy()
+
+    def append():
+        tail['time'] = tail['time'] + pd.Timedelta(minutes=1)
+        return service.rollups.add_frame(tail, 'temperatureProcessed', 'patch')
+
+    assert benchmark(append) == len(tail)
@@ -0,0 +1,43 @@
+"""
+Parameter sweep over archived raw frames: count histograms vs converting every pixel per parameter set.
+"""
+
+import numpy as np
+import pytest
+
+from bench_archive import noisy_frames
+from conftest import RESOLUTIONS
+from frame_archive import FrameArchive
+from rawframe import Calibration
+from recalibrate import apply, parameter_grid, sweep
+
+FRAMES = 64
+SETS = parameter_grid({'E': [0.95, 0.97, 0.98], 'OD': [0.5, 1.0, 1.5, 2.0]})
+
+
+@pytest.fixture(scope='module')
+def archive_folder(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp('recalibrate'))
+    with FrameArchive(folder) as archive:
+        for i, raw in enumerate(noisy_frames(RESOLUTIONS['qvga'], FRAMES)):
+            archive.append(raw, 1000.0 + i, Calibration(E=0.95))
+    return folder
+
+
+def bench_sweep_histogram(benchmark, archive_folder):
+    df = benchmark.pedantic(sweep, args=(archive_folder, SETS), kwargs={'workers': 1}, rounds=3, iterations=1)
+    assert len(df) == FRAMES * len(SETS)
+
+
+def bench_sweep_per_pixel(benchmark, archive_folder):
+    def run():
+        rows = []
+        for _, frame in FrameArchive(archive_folder).range():
+            for overrides in SETS:
+                temperatures = frame.with_calibration(apply(frame.calibration, overrides)).temperatures
+                rows.append((temperatures.min(), temperatures.max(), temperatures.mean(),
+                             np.quantile(temperatures, 0.5), np.quantile(temperatures, 0.95)))
+        return rows
+
+    rows = benchmark.pedantic(run, rounds=3, iterations=1)
+    assert len(rows) == FRAMES * len(SETS)
@@ -0,0 +1,56 @@
+"""
+Raw -> temperature conversion and the FlirImageExtractor outputs.
+"""
+
+import numpy as np
+import pytest
+
+from conftest import RESOLUTIONS
+from flir_image_extractor import FlirImageExtractor
+
+# the per-pixel paths take seconds on the larger frames, keep the round count fixed
+ROUNDS = 3
+
+
+def bench_raw2temp_scalar(benchmark):
+    result = benchmark(FlirImageExtractor.raw2temp, 18000, E=0.95)
+    assert 20 < result < 40
+
+
+@pytest.mark.parametrize('resolution', list(RESOLUTIONS))
+@pytest.mark.parametrize('fix_endian', [True, False], ids=['endian_fix', 'no_endian_fix'])
+def bench_extract_thermal_image(benchmark, extractor, resolution, fix_endian):
+    fie = extractor(resolution, fix_endian)
+    thermal = benchmark.pedantic(fie.extract_thermal_image, rounds=ROUNDS, iterations=1)
+    assert thermal.shape == RESOLUTIONS[resolution]
+
+
+@pytest.mark.parametrize('resolution', list(RESOLUTIONS))
+def bench_raw_frame_temperatures(benchmark, extractor, resolution):
+    fie = extractor(resolution)
+    frame = fie.extract_raw_frame()
+
+    def materialize():
+        frame.drop_temperatures()
+        return frame.temperatures
+
+    thermal = benchmark(materialize)
+    assert thermal.dtype == np.float32
+
+
+@pytest.mark.parametrize('resolution', list(RESOLUTIONS))
+def bench_export_thermal_to_csv(benchmark, extractor, tmp_path, resolution):
+    fie = extractor(resolution)
+    fie.process_image(fie.flir_img_filename)
+    csv_filename = str(tmp_path / 'thermal.csv')
+    benchmark.pedantic(fie.export_thermal_to_csv, args=(csv_filename,), rounds=ROUNDS, iterations=1)
+
+    with open(csv_filename) as fh:
+        assert sum(1 for _ in fh) == fie.get_thermal_np().size + 1
+
+
+@pytest.mark.parametrize('resolution', list(RESOLUTIONS))
+def bench_save_images(benchmark, extractor, resolution):
+    fie = extractor(resolution)
+    fie.process_image(fie.flir_img_filename)
+    benchmark.pedantic(fie.save_images, rounds=ROUNDS, iterations=1)
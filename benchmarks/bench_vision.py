@@ -0,0 +1,76 @@
+"""
+Face detection, hotspot index and per-face forehead statistics of the lab.py pipeline.
+"""
+
+import os
+import shutil
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import RESOLUTIONS, ROOT, synthetic_raw
+
+DETECT_RESOLUTIONS = {
+    'qvga': (320, 240),
+    'vga': (640, 480),
+    'hd': (1280, 960),
+}
+
+
+@pytest.fixture(scope='module')
+def visual_image():
+    img = cv2.imread(os.path.join(ROOT, 'image.jpg'))
+    assert img is not None
+    return img
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    import lab
+    from registration import Registration
+    from replay import ReplayFlir
+
+    shutil.copy(os.path.join(ROOT, 'image.jpg'), str(tmp_path / 'image.jpg'))
+    monkeypatch.chdir(tmp_path)
+    return lab.FlirThermalProcessor(camera_url='replay://', exiftool_path='exiftool',
+                                    registration=Registration.from_scale(8), flir=ReplayFlir(str(tmp_path)))
+
+
+def _grid_faces(count, width=640, height=480, size=56):
+    cols = width // 64
+    return np.array([((i % cols) * 64 + 4, (i // cols) * 64 + 4, size, size) for i in range(count)])
+
+
+@pytest.mark.parametrize('resolution', list(DETECT_RESOLUTIONS))
+def bench_haar_detect(benchmark, processor, visual_image, resolution):
+    frame = cv2.resize(visual_image, DETECT_RESOLUTIONS[resolution], interpolation=cv2.INTER_AREA)
+    benchmark(processor.detect_faces, frame)
+
+
+@pytest.mark.parametrize('faces', [1, 10, 50])
+def bench_get_face_temperatures(benchmark, processor, faces):
+    thermal = np.random.default_rng(0).normal(30, 2, (60, 80))
+    boxes = _grid_faces(faces)
+    stats = benchmark(processor.get_face_temperatures, boxes, thermal)
+    assert len(stats) == faces
+
+
+def bench_haar_detect_hotspot_regions(benchmark, processor, visual_image):
+    from hotspot_index import HotspotIndex
+
+    thermal = np.load(os.path.join(ROOT, 'thermal_map.npy'))
+    regions = HotspotIndex(thermal).visual_regions(processor.registration, k=3)
+    faces = benchmark(processor.detect_faces, visual_image, regions)
+    assert len(faces) >= 1
+
+
+@pytest.mark.parametrize('resolution', list(RESOLUTIONS))
+def bench_hotspot_index(benchmark, resolution):
+    from hotspot_index import SKIN_RANGE, HotspotIndex
+    from rawframe import Calibration, RawFrame
+
+    thermal = RawFrame(synthetic_raw(RESOLUTIONS[resolution]), Calibration(E=0.98)).temperatures
+    spots = benchmark(lambda: HotspotIndex(thermal).hotspots(k=3))
+    # overlapping synthetic blobs can go above the skin range, the index leaves those tiles out
+    assert spots and SKIN_RANGE[0] <= spots[0]['max'] <= SKIN_RANGE[1]
@@ -0,0 +1,123 @@
+"""
+Fixtures for the benchmark suite: synthetic AX8-like frames and an exiftool stand-in.
+
+Run from the repository root, headless, without exiftool, camera or BLE:
+
+    python -m pytest benchmarks                                   # run
+    python -m pytest benchmarks --benchmark-save=baseline         # store a new baseline
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:25%
+
+Results are stored in benchmarks/.benchmarks (see pytest.ini), which is not
+versioned: timings are machine-specific, save a baseline on the machine you
+compare on.
+"""
+
+import io
+import json
+import os
+import sys
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import numpy as np
+import pytest
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import flir_image_extractor
+
+# (rows, cols) of the raw thermal frame
+RESOLUTIONS = {
+    'ax8': (60, 80),
+    'qvga': (240, 320),
+    'vga': (480, 640),
+}
+
+# what exiftool reports for an AX8 JPEG, strings as exiftool prints them
+AX8_META = {
+    'Emissivity': 0.95,
+    'SubjectDistance': '1.00 m',
+    'AtmosphericTemperature': '20.0 C',
+    'ReflectedApparentTemperature': '20.0 C',
+    'IRWindowTemperature': '20.0 C',
+    'IRWindowTransmission': 1,
+    'RelativeHumidity': '50.0 %',
+    'PlanckR1': 21106.77,
+    'PlanckB': 1501,
+    'PlanckF': 1,
+    'PlanckO': -7340,
+    'PlanckR2': 0.012545258,
+    'RawThermalImageType': 'PNG',
+}
+
+
+def synthetic_raw(shape, seed=0):
+    """
+    uint16 raw counts: ~20 °C background with a few ~35 °C blobs (faces)
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = shape
+    frame = rng.normal(17500, 40, shape)
+    ys, xs = np.mgrid[0:rows, 0:cols]
+    for _ in range(4):
+        cy, cx = rng.uniform(0, rows), rng.uniform(0, cols)
+        r = min(rows, cols) / 8
+        frame += 2900 * np.exp(-((ys - cy) ** 2 + (xs - cx) ** 2) / (2 * r * r))
+    return np.clip(frame, 0, 65535).astype(np.uint16)
+
+
+def _png_bytes(array):
+    buf = io.BytesIO()
+    Image.fromarray(array).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+@pytest.fixture
+def fake_exiftool(monkeypatch):
+    """
+    Replace the exiftool calls of FlirImageExtractor with in-memory answers
+    :return: function(raw uint16 frame, rgb frame, swapped) installing the frame to serve
+    """
+    served = {}
+
+    def check_output(cmd, *args, **kwargs):
+        if '-RawThermalImage' in cmd:
+            return _png_bytes(served['stored'])
+        if '-EmbeddedImage' in cmd or '-ThumbnailImage' in cmd:
+            return served['rgb_jpeg']
+        return json.dumps([AX8_META]).encode()
+
+    def install(raw, rgb=None, swapped=True):
+        if rgb is None:
+            rgb = np.zeros(raw.shape + (3,), dtype=np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(rgb).save(buf, format='JPEG')
+        # the AX8 stores the PNG with swapped bytes, fix_endian undoes it
+        served['stored'] = raw.byteswap() if swapped else raw
+        served['rgb_jpeg'] = buf.getvalue()
+
+    monkeypatch.setattr(flir_image_extractor.subprocess, 'check_output', check_output)
+    return install
+
+
+@pytest.fixture
+def extractor(tmp_path, fake_exiftool):
+    """
+    FlirImageExtractor pointing at a placeholder file in tmp_path
+    :return: function(resolution name, fix_endian) -> extractor ready for extract_thermal_image
+    """
+    def make(resolution, fix_endian=True):
+        raw = synthetic_raw(RESOLUTIONS[resolution])
+        fake_exiftool(raw, swapped=fix_endian)
+        image = tmp_path / 'frame_{}.jpg'.format(resolution)
+        image.write_bytes(b'')
+        fie = flir_image_extractor.FlirImageExtractor()
+        fie.flir_img_filename = str(image)
+        fie.fix_endian = fix_endian
+        return fie
+
+    return make
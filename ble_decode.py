@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Decoding of the temperature carried in the patch BLE advertisements.
+
+The first two bytes of the service data are a little-endian signed
+integer in hundredths of a degree. The scanner scripts differ only in the
+calibration offset (last_temp.py subtracts 25).
+"""
+
+import numpy as np
+
+
+def decode_temperature(data, offset=0.0):
+    """
+    Temperature of one advertisement payload
+    :return: °C, None if the payload is too short
+    """
+    if len(data) >= 2:
+        temp_raw = int.from_bytes(data[0:2], byteorder="little", signed=True)
+        return temp_raw / 100.0 + offset
+    return None
+
+
+def decode_temperatures(payloads, offset=0.0):
+    """
+    Temperatures of many payloads at once (e.g. a replayed capture)
+    :return: float64 array, NaN for payloads shorter than 2 bytes
+    """
+    lengths = np.fromiter(map(len, payloads), dtype=np.intp, count=len(payloads))
+    valid = lengths >= 2
+    if valid.all():
+        heads = b''.join([p[0:2] for p in payloads])
+    else:
+        heads = b''.join([p[0:2] if ok else b'\x00\x00' for p, ok in zip(payloads, valid)])
+    temps = np.frombuffer(heads, dtype='<i2') / 100.0 + offset
+    temps[~valid] = np.nan
+    return temps
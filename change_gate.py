@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Change detection gate: skip extraction, detection and rendering of frames where nothing changed.
+
+Each frame is reduced to a small grid signature (block means of the
+grayscale visual image and of the thermal preview) and compared with a
+running background model per cell: exponential moving mean and variance.
+A cell has changed when it is more than `sigma` standard deviations
+away from its mean (and more than `rel_delta` of the background range, so
+a perfectly still scene does not trigger on one gray level). The frame is
+processed when at least `min_cells` cells changed in either channel.
+
+The thermal preview of an AX8 JPEG is its rendered IR image, decoded at
+1/8 scale by libjpeg without exiftool; a recorded temperature map
+(.npy, see replay.py) is used as is. With temperatures, `warm_threshold`
+restricts the thermal channel to cells reaching skin temperature, so a
+door or a cooling radiator does not count.
+
+Someone standing still must keep being measured: while any cell is
+skin-warm, in the temperature map given to check() or in the one of the
+last processed frame (record_temperatures), every frame is processed
+and the background is not touched. Otherwise it learns from skipped
+frames, leaving out their few changed cells, with differences clipped in
+the variance update so one outlier does not widen the band it is tested
+against (the threshold would grow until the subject is inside). A lasting
+change with nothing warm in view (a moved chair) is learned at alpha/10
+while its frames are processed, and stops triggering after a while.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from hotspot_index import SKIN_RANGE
+
+# standard deviations a difference is clipped to in the variance update
+VARIANCE_CLIP = 2.5
+
+
+def block_reduce(image, grid, ufunc=np.add):
+    """
+    Reduce an image to a grid of blocks (sizes need not divide) with np.add or np.maximum
+    :param grid: (rows, cols) of the result
+    :return: float32 array of shape grid, the block sums/maxima
+    """
+    image = np.asarray(image)
+    if image.ndim == 3:
+        image = image.mean(axis=2, dtype=np.float32)
+    rows, cols = grid
+    row_edges = np.linspace(0, image.shape[0], rows + 1).astype(int)[:-1]
+    col_edges = np.linspace(0, image.shape[1], cols + 1).astype(int)[:-1]
+    reduced = ufunc.reduceat(image.astype(np.float32, copy=False), row_edges, axis=0)
+    return ufunc.reduceat(reduced, col_edges, axis=1)
+
+
+def signature(image, grid=(12, 16)):
+    """
+    Block means of an image (color images are averaged to gray first)
+    :return: float32 array of shape grid
+    """
+    image = np.asarray(image)
+    rows, cols = grid
+    row_size = np.diff(np.linspace(0, image.shape[0], rows + 1).astype(int))
+    col_size = np.diff(np.linspace(0, image.shape[1], cols + 1).astype(int))
+    return block_reduce(image, grid) / np.outer(row_size, col_size).astype(np.float32)
+
+
+def load_preview(path):
+    """
+    Cheap thermal preview of a snapshot: .npy temperature maps as is, JPEGs decoded at 1/8 in grayscale
+    :return: array, None if the file can't be read
+    """
+    with open(path, 'rb') as fh:
+        if fh.read(6) == b'\x93NUMPY':
+            return np.load(path)
+    import cv2
+    return cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+
+class BackgroundModel:
+    """
+    Running mean/variance of a grid signature
+    """
+
+    def __init__(self, alpha=0.05, sigma=4.0, rel_delta=0.05):
+        self.alpha = alpha
+        self.sigma = sigma
+        self.rel_delta = rel_delta
+        self.mean = None
+        self.var = None
+        self.count = 0
+
+    @property
+    def averaging(self):
+        """
+        :return: True while the model is still a plain average of its first frames
+        """
+        return 1.0 / (self.count + 1) > self.alpha
+
+    def changed(self, sig):
+        """
+        :return: boolean mask of the cells away from the background (all False until the model has data)
+        """
+        if self.mean is None or self.mean.shape != sig.shape:
+            return np.zeros(sig.shape, dtype=bool)
+        floor = self.rel_delta * float(self.mean.max() - self.mean.min())
+        return np.abs(sig - self.mean) > np.maximum(self.sigma * np.sqrt(self.var), floor)
+
+    def update(self, sig, alpha=None, keep=None):
+        """
+        Learn a signature into the background
+        :param alpha: learning rate, the model's if None
+        :param keep: boolean mask of the cells left as they are
+        :return:
+        """
+        if self.mean is None or self.mean.shape != sig.shape:
+            self.mean = sig.astype(np.float32)
+            self.var = np.zeros_like(self.mean)
+            self.count = 1
+            return
+        delta = sig - self.mean
+        if alpha is None and self.averaging:
+            # first frames: plain average, so the variance is not stuck near zero
+            alpha = 1.0 / (self.count + 1)
+            clipped = delta
+        else:
+            alpha = self.alpha if alpha is None else alpha
+            limit = VARIANCE_CLIP * np.sqrt(self.var)
+            clipped = np.clip(delta, -limit, limit)
+        rate = np.where(keep, 0.0, alpha).astype(np.float32) if keep is not None else alpha
+        self.mean += rate * delta
+        self.var = (1 - rate) * (self.var + rate * clipped * clipped)
+        self.count += 1
+
+
+class ChangeGate:
+
+    def __init__(self, grid=(12, 16), sigma=4.0, rel_delta=0.05, min_cells=2, alpha=0.05, warmup=5, refresh=0,
+                 warm_threshold=SKIN_RANGE[0]):
+        """
+        :param grid: signature size (rows, cols)
+        :param min_cells: changed cells needed to process a frame
+        :param warmup: frames always processed while the background is learned
+        :param refresh: process at least one frame every `refresh` frames, 0 to never force
+        :param warm_threshold: °C; with temperature maps, only thermal changes in cells this warm count,
+                               and frames are processed while a cell is this warm. None to ignore temperatures
+        """
+        self.grid = grid
+        self.min_cells = min_cells
+        self.warmup = warmup
+        self.refresh = refresh
+        self.warm_threshold = warm_threshold
+        # skin-warm cells of the last temperature map, None while no temperatures are known
+        self.warm = None
+        self.models = {'visual': BackgroundModel(alpha, sigma, rel_delta),
+                       'thermal': BackgroundModel(alpha, sigma, rel_delta)}
+
+        self.frames = 0
+        self.processed = 0
+        self.skipped = 0
+        self.since_processed = 0
+        self.gate_seconds = 0.0
+        self.process_seconds = 0.0
+        self.timed = 0
+        self.last_changed = {}
+
+    def _warm_cells(self, temperatures):
+        return block_reduce(temperatures, self.grid, np.maximum) >= self.warm_threshold
+
+    def record_temperatures(self, temperatures):
+        """
+        Temperature map of a processed frame: while a cell is skin-warm, the next frames are processed
+        :return:
+        """
+        if self.warm_threshold is not None:
+            self.warm = self._warm_cells(temperatures)
+
+    def check(self, visual=None, thermal=None):
+        """
+        Compare a frame with the background and update it
+        :param visual: BGR/gray image
+        :param thermal: thermal preview (load_preview) or temperature map
+        :return: True if the frame must be processed
+        """
+        start = time.perf_counter()
+        changed_cells = 0
+        self.last_changed = {}
+        signatures = {}
+        for name, image in (('visual', visual), ('thermal', thermal)):
+            if image is None:
+                continue
+            sig = signatures[name] = signature(image, self.grid)
+            changed = self.models[name].changed(sig)
+            if name == 'thermal' and self.warm_threshold is not None and np.issubdtype(np.asarray(image).dtype, np.floating):
+                self.warm = self._warm_cells(image)
+                changed &= self.warm
+            self.last_changed[name] = changed
+            changed_cells = max(changed_cells, int(changed.sum()))
+
+        warm = self.warm is not None and bool(self.warm.any())
+        learning = self.frames < self.warmup
+        process = (changed_cells >= self.min_cells or warm or learning or
+                   (self.refresh > 0 and self.since_processed + 1 >= self.refresh))
+
+        # a static frame teaches the background but its few changed cells; nothing is learned where someone
+        # warm is in view, a lasting change with no one in view (known from temperatures) only slowly
+        for name, sig in signatures.items():
+            model = self.models[name]
+            if not process:
+                model.update(sig, keep=self.last_changed[name])
+            elif warm:
+                if learning:
+                    model.update(sig, keep=self.warm)
+            elif learning or model.averaging:
+                model.update(sig)
+            elif self.warm is not None:
+                model.update(sig, model.alpha / 10)
+
+        self.frames += 1
+        if process:
+            self.processed += 1
+            self.since_processed = 0
+        else:
+            self.skipped += 1
+            self.since_processed += 1
+        self.gate_seconds += time.perf_counter() - start
+        return process
+
+    def record_processing(self, seconds):
+        """
+        Time spent on a processed frame, to estimate what the skipped ones saved
+        :return:
+        """
+        self.process_seconds += seconds
+        self.timed += 1
+
+    def stats(self):
+        mean_process = self.process_seconds / self.timed if self.timed else float('nan')
+        mean_gate = self.gate_seconds / self.frames if self.frames else float('nan')
+        return {
+            'frames': self.frames,
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'skip_rate': self.skipped / self.frames if self.frames else 0.0,
+            'gate_ms': mean_gate * 1000,
+            'process_ms': mean_process * 1000,
+            # a skipped frame still pays the gate
+            'saved_seconds': self.skipped * (mean_process - mean_gate) if self.timed else 0.0,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return ("Gate: {frames} frames, {processed} processed, {skipped} skipped ({rate:.0%}), "
+                "{gate_ms:.2f} ms/frame gate vs {process_ms:.1f} ms processing, ~{saved_seconds:.1f} s saved").format(
+            rate=s['skip_rate'], **s)
+
+
+def simulate(frames=300, seed=0):
+    """
+    Empty corridor (sensor noise, slow drift) with a warm person now and then walking in, standing still and leaving
+    :return: ChangeGate after the run, frames with someone in view, frames with someone in view that were skipped
+    """
+    rng = np.random.default_rng(seed)
+    gate = ChangeGate()
+    ys, xs = np.mgrid[0:60, 0:80]
+    visits = set()
+    missed = set()
+    for i in range(frames):
+        thermal = 21.0 + 0.002 * i + rng.normal(0, 0.05, (60, 80))
+        visual = np.full((480, 640), 90.0) + rng.normal(0, 2, (480, 640))
+        if i % 100 >= 40:
+            # walks in over 10 frames, stands still for 40, walks out over 10
+            step = i % 100 - 40
+            cx = 5 + 3.5 * min(step, 10) + 3.5 * max(step - 50, 0)
+            person = np.exp(-((xs - cx) ** 2 + (ys - 25) ** 2) / 50.0)
+            thermal += 13.0 * person
+            visual[100:400, int(cx * 8) - 40:int(cx * 8) + 40] = 180
+            visits.add(i)
+        if gate.check(visual.astype(np.uint8), thermal.astype(np.float32)):
+            gate.record_processing(0.25)
+        elif i in visits:
+            missed.add(i)
+    return gate, visits, missed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Change detection gate over recorded or simulated frames')
+    parser.add_argument('--folder', type=str, default=None, help='Recorded frames (see replay.py), simulated if empty')
+    parser.add_argument('--frames', type=int, default=300, help='Simulated frames')
+    parser.add_argument('--sigma', type=float, default=4.0, help='Standard deviations for a changed cell')
+    args = parser.parse_args()
+
+    if args.folder:
+        import cv2
+        from replay import Recording
+
+        recording = Recording(args.folder, loop=False)
+        gate = ChangeGate(sigma=args.sigma)
+        while True:
+            visual_path, thermal_path = recording.next('visual'), recording.next('ir')
+            if visual_path is None or thermal_path is None:
+                break
+            gate.check(cv2.imread(visual_path), load_preview(thermal_path))
+    else:
+        gate, visits, missed = simulate(args.frames)
+        print("{} frames with someone in view, {} of them skipped".format(len(visits), len(missed)))
+    print(gate.summary())
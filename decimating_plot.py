@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Live plot of long temperature histories, decimated to the width of the axes.
+
+A series keeps its whole history in growing numpy arrays (times as
+matplotlib date numbers, so the date axis is handled by matplotlib's own
+locator/formatter instead of one tick label per point). On refresh(),
+only the series that received data are decimated to about two points per
+horizontal pixel of the visible window and pushed with Line2D.set_data;
+axis limits are touched only when they change, and the canvas is redrawn
+with draw_idle(). Rendering cost stays bounded by the pixel width, not by
+hours of 1 Hz readings from several patches.
+
+    minmax_decimate   min and max of each bin, keeps every spike (default)
+    lttb              Largest-Triangle-Three-Buckets, smoother for trends
+
+    plot = DecimatingPlot(window=3600)
+    plot.append(patch_id, datetime.now(), temperature)   # from the BLE callback
+    plot.refresh()                                       # once a second
+"""
+
+import argparse
+from datetime import datetime
+
+import numpy as np
+import matplotlib.dates as mdates
+
+
+def minmax_decimate(x, y, bins):
+    """
+    Keep the minimum and maximum of `bins` equal-count bins, in time order
+    :return: (x, y) with at most 2 * bins points
+    """
+    n = len(y)
+    if n <= 2 * bins:
+        return x, y
+    size = -(-n // bins)
+    bins = -(-n // size)
+    padded = np.empty(bins * size, dtype=y.dtype)
+    padded[:n] = y
+    # repeat the last value, the padding never wins over a real point of the last bin
+    padded[n:] = y[-1]
+    blocks = padded.reshape(bins, size)
+    offsets = np.arange(bins) * size
+    lo = np.minimum(offsets + blocks.argmin(axis=1), n - 1)
+    hi = np.minimum(offsets + blocks.argmax(axis=1), n - 1)
+    idx = np.stack([np.minimum(lo, hi), np.maximum(lo, hi)], axis=1).ravel()
+    return x[idx], y[idx]
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling (Steinarsson 2013)
+    :return: (x, y) with n_out points, first and last kept
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return x, y
+    xf = np.asarray(x, dtype=np.float64)
+    yf = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # mean of every bucket, for the third vertex of the triangles
+    sums_x = np.add.reduceat(xf[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(yf[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    mean_x, mean_y = sums_x / counts, sums_y / counts
+
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        start, stop = edges[b], edges[b + 1]
+        cx, cy = (mean_x[b + 1], mean_y[b + 1]) if b + 1 < len(mean_x) else (xf[-1], yf[-1])
+        ax_, ay = xf[a], yf[a]
+        # twice the triangle area, for the whole bucket at once
+        area = np.abs((ax_ - cx) * (yf[start:stop] - ay) - (ax_ - xf[start:stop]) * (cy - ay))
+        a = start + int(area.argmax())
+        idx[b + 1] = a
+    return x[idx], y[idx]
+
+
+def to_datenum(t):
+    """
+    datetime, numpy datetime64 or unix seconds -> matplotlib date number
+    :return: float
+    """
+    if isinstance(t, (int, float)):
+        t = datetime.fromtimestamp(t)
+    return float(mdates.date2num(t))
+
+
+class Series:
+    """
+    Growing (time, value) arrays with amortized appends
+    """
+
+    def __init__(self, capacity=1024):
+        self.t = np.empty(capacity, dtype=np.float64)
+        self.v = np.empty(capacity, dtype=np.float32)
+        self.n = 0
+        self.dirty = False
+        self.line = None
+
+    def append(self, t, v):
+        if self.n == len(self.t):
+            self.t = np.concatenate([self.t, np.empty_like(self.t)])
+            self.v = np.concatenate([self.v, np.empty_like(self.v)])
+        self.t[self.n] = t
+        self.v[self.n] = v
+        self.n += 1
+        self.dirty = True
+
+    def extend(self, t, v):
+        t = np.asarray(t, dtype=np.float64)
+        need = self.n + len(t)
+        if need > len(self.t):
+            size = max(need, 2 * len(self.t))
+            self.t = np.concatenate([self.t[:self.n], np.empty(size - self.n)])
+            self.v = np.concatenate([self.v[:self.n], np.empty(size - self.n, dtype=np.float32)])
+        self.t[self.n:need] = t
+        self.v[self.n:need] = v
+        self.n = need
+        self.dirty = True
+
+    def view(self, start=None):
+        """
+        :return: (t, v) of the points from date number `start`, no copy
+        """
+        first = 0 if start is None else int(np.searchsorted(self.t[:self.n], start))
+        return self.t[first:self.n], self.v[first:self.n]
+
+
+class DecimatingPlot:
+
+    def __init__(self, ax=None, window=None, method='minmax', points_per_pixel=2, ylim=None,
+                 title="Temperatura in tempo reale", ylabel="°C"):
+        """
+        :param ax: matplotlib axes, a new figure if None
+        :param window: seconds shown, the whole history if None
+        :param method: 'minmax' or 'lttb'
+        :param ylim: fixed (min, max), follows the data with a margin if None
+        """
+        if ax is None:
+            import matplotlib.pyplot as plt
+            _, ax = plt.subplots()
+        if method not in ('minmax', 'lttb'):
+            raise ValueError("Unknown decimation: {}".format(method))
+        self.ax = ax
+        self.window = window
+        self.method = method
+        self.points_per_pixel = points_per_pixel
+        self.fixed_ylim = ylim
+        self.series = {}
+        self.drawn_points = 0
+
+        locator = mdates.AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+        ax.set_title(title)
+        ax.set_ylabel(ylabel)
+        if ylim is not None:
+            ax.set_ylim(*ylim)
+        self._xlim = None
+        self._ylim = tuple(ylim) if ylim is not None else None
+
+    def _series(self, name):
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = Series()
+            series.line, = self.ax.plot([], [], label=str(name))
+            if len(self.series) > 1:
+                self.ax.legend(loc='upper left')
+        return series
+
+    def append(self, name, t, value):
+        """
+        Add a reading; t is a datetime or unix seconds
+        :return:
+        """
+        self._series(name).append(to_datenum(t), value)
+
+    def extend(self, name, times, values):
+        """
+        Add many readings, times as matplotlib date numbers
+        :return:
+        """
+        self._series(name).extend(times, values)
+
+    def decimate(self, t, v, pixels):
+        bins = max(int(pixels * self.points_per_pixel) // 2, 1)
+        if self.method == 'lttb':
+            return lttb(t, v, 2 * bins)
+        return minmax_decimate(t, v, bins)
+
+    def refresh(self):
+        """
+        Push the new data of the changed series and redraw
+        :return: True if something was redrawn
+        """
+        if not any(s.dirty for s in self.series.values()):
+            return False
+        last = max(s.t[s.n - 1] for s in self.series.values() if s.n)
+        start = last - self.window / 86400.0 if self.window else None
+        pixels = max(self.ax.get_window_extent().width, 100)
+
+        lo, hi = np.inf, -np.inf
+        first = last
+        self.drawn_points = 0
+        for series in self.series.values():
+            t, v = series.view(start)
+            if not len(t):
+                continue
+            first = min(first, t[0])
+            lo, hi = min(lo, float(np.nanmin(v))), max(hi, float(np.nanmax(v)))
+            if series.dirty or self.window:
+                dt, dv = self.decimate(t, v, pixels)
+                series.line.set_data(dt, dv)
+                series.dirty = False
+            self.drawn_points += len(series.line.get_xdata())
+
+        xlim = (first, last if last > first else first + 1 / 86400.0)
+        if xlim != self._xlim:
+            self.ax.set_xlim(*xlim)
+            self._xlim = xlim
+        if self.fixed_ylim is None and np.isfinite(lo):
+            # grow in 0.5 °C steps, so the limits do not change on every reading
+            ylim = (np.floor(lo * 2 - 1) / 2, np.ceil(hi * 2 + 1) / 2)
+            if ylim != self._ylim:
+                self.ax.set_ylim(*ylim)
+                self._ylim = ylim
+
+        canvas = self.ax.figure.canvas
+        canvas.draw_idle()
+        canvas.flush_events()
+        return True
+
+
+def demo(patches=4, hours=6.0, rate=1.0, method='minmax', refreshes=20):
+    """
+    Render hours of synthetic multi-patch readings, off screen
+    :return: dict with points, drawn points and seconds per refresh
+    """
+    import time
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    rng = np.random.default_rng(0)
+    n = int(hours * 3600 * rate)
+    start = to_datenum(time.time() - hours * 3600)
+    times = start + np.arange(n) / rate / 86400.0
+
+    fig, ax = plt.subplots(figsize=(10, 4), dpi=100)
+    plot = DecimatingPlot(ax, method=method)
+    for p in range(patches):
+        values = 36.5 + np.cumsum(rng.normal(0, 0.01, n)) + rng.normal(0, 0.05, n)
+        plot.extend('patch {}'.format(p), times, values.astype(np.float32))
+    plot.refresh()
+    fig.canvas.draw()
+
+    elapsed = 0.0
+    for i in range(refreshes):
+        t = times[-1] + (i + 1) / rate / 86400.0
+        for name in plot.series:
+            plot.series[name].append(t, 36.5)
+        begin = time.perf_counter()
+        # draw_idle() draws right away on Agg
+        plot.refresh()
+        elapsed += time.perf_counter() - begin
+    plt.close(fig)
+    return {'points': patches * n, 'drawn': plot.drawn_points, 'seconds_per_refresh': elapsed / refreshes}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render time of the decimating plot on synthetic patch data')
+    parser.add_argument('--patches', type=int, default=4, help='Simulated patches')
+    parser.add_argument('--hours', type=float, default=6.0, help='Hours of 1 Hz readings per patch')
+    parser.add_argument('--method', type=str, default='minmax', choices=['minmax', 'lttb'], help='Decimation')
+    args = parser.parse_args()
+
+    result = demo(args.patches, args.hours, method=args.method)
+    print("{points} points, {drawn} drawn, {ms:.1f} ms per refresh".format(
+        ms=result['seconds_per_refresh'] * 1000, **result))
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Export the temperature CNN to CPU-friendly forms and compare them.
+
+TorchScript (traced and frozen) and ONNX exports are written to an output
+directory, the TorchScript one also with dynamic int8 quantization of the Linear layers
+(the 1024x128 fc layer holds most of the weights). The accuracy check runs
+every variant on labels.csv/roi_images against the eager model, the latency
+benchmark tries several torch thread counts, and the start-up benchmark
+times a fresh interpreter loading each artifact.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from torch import nn
+
+from temperature_cnn import (DEFAULT_CHECKPOINT, INPUT_SIZE, TemperatureEstimator, load_model,
+                             load_roi_image)
+
+
+def quantize(model):
+    """
+    Dynamic int8 quantization of the Linear layers
+    :return: quantized copy of the model
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def export_torchscript(model, ts_filename):
+    """
+    Trace, freeze and save the model
+    :return: the frozen ScriptModule
+    """
+    example = torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE))
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.freeze(traced.eval())
+    frozen.save(ts_filename)
+    return frozen
+
+
+def export_onnx(model, onnx_filename):
+    """
+    Export to ONNX with a dynamic batch dimension
+    :return:
+    """
+    example = torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE))
+    torch.onnx.export(model, example, onnx_filename, input_names=['roi'], output_names=['temperature'],
+                      dynamic_axes={'roi': {0: 'batch'}, 'temperature': {0: 'batch'}}, dynamo=False)
+
+
+class OnnxEstimator:
+    """
+    Same predict interface as TemperatureEstimator, running on onnxruntime
+    """
+
+    def __init__(self, onnx_filename, num_threads=None):
+        import onnxruntime
+
+        self.onnx_filename = onnx_filename
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(onnx_filename, options, providers=['CPUExecutionProvider'])
+
+    def predict(self, rois, bgr=True):
+        from temperature_cnn import preprocess_roi
+
+        batch = np.empty((len(rois), 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        for i, roi in enumerate(rois):
+            preprocess_roi(roi, batch[i], bgr=bgr)
+        return self.session.run(None, {'roi': batch})[0][:, 0]
+
+
+def export_all(checkpoint, out_dir, onnx=True):
+    """
+    Write the scripted, quantized scripted and (if possible) ONNX artifacts
+    :return: dict {variant: filename}
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    prefix = os.path.join(out_dir, os.path.splitext(os.path.basename(checkpoint))[0])
+    model = load_model(checkpoint)
+
+    artifacts = {}
+    export_torchscript(model, prefix + '.ts')
+    artifacts['scripted'] = prefix + '.ts'
+    export_torchscript(quantize(model), prefix + '_int8.ts')
+    artifacts['scripted int8'] = prefix + '_int8.ts'
+
+    if onnx:
+        try:
+            export_onnx(model, prefix + '.onnx')
+            artifacts['onnx'] = prefix + '.onnx'
+        except Exception as e:
+            print("ONNX export skipped: {}".format(e))
+    return artifacts
+
+
+def build_variants(checkpoint, artifacts, num_threads=None):
+    model = load_model(checkpoint)
+    variants = {
+        'eager': TemperatureEstimator(model=model, num_threads=num_threads),
+        'eager int8': TemperatureEstimator(model=quantize(model), num_threads=num_threads),
+    }
+    for name, filename in artifacts.items():
+        if filename.endswith('.onnx'):
+            try:
+                variants[name] = OnnxEstimator(filename, num_threads=num_threads)
+            except ImportError:
+                print("onnxruntime not installed, {} not evaluated".format(name))
+        else:
+            variants[name] = TemperatureEstimator(model=torch.jit.load(filename), num_threads=num_threads)
+    return variants
+
+
+def accuracy_check(variants, labels_filename, images_dir):
+    """
+    Compare every variant with the eager model and with the labels
+    :return: DataFrame with max deviation from eager and MAE against the labels
+    """
+    labels = pd.read_csv(labels_filename)
+    images = [load_roi_image(os.path.join(images_dir, p)) for p in labels['image_path']]
+    expected = labels['temperature'].to_numpy(dtype=np.float32)
+
+    reference = variants['eager'].predict(images, bgr=False)
+    rows = []
+    for name, estimator in variants.items():
+        predicted = estimator.predict(images, bgr=False)
+        rows.append({
+            'variant': name,
+            'max_dev_from_eager': float(np.max(np.abs(predicted - reference))),
+            'mae_vs_labels': float(np.mean(np.abs(predicted - expected))),
+        })
+    return pd.DataFrame(rows)
+
+
+def latency_benchmark(variants, rois, thread_counts, repeat=5):
+    """
+    Best wall time of a batched prediction per variant and thread count
+    :return: DataFrame
+    """
+    rows = []
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        for name, estimator in variants.items():
+            if isinstance(estimator, OnnxEstimator):
+                estimator = OnnxEstimator(estimator.onnx_filename, num_threads=threads)
+            estimator.predict(rois[:1], bgr=False)
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                estimator.predict(rois, bgr=False)
+                best = min(best, time.perf_counter() - start)
+            rows.append({'variant': name, 'threads': threads, 'batch_ms': best * 1000,
+                         'rois_per_s': len(rois) / best})
+    return pd.DataFrame(rows)
+
+
+STARTUP_SNIPPETS = {
+    'eager': "import temperature_cnn; temperature_cnn.load_model({path!r})",
+    'scripted': "import torch; torch.jit.load({path!r})",
+    'onnx': "import onnxruntime; onnxruntime.InferenceSession({path!r}, providers=['CPUExecutionProvider'])",
+}
+
+
+def startup_benchmark(checkpoint, artifacts, repeat=3):
+    """
+    Wall time of a fresh interpreter importing the runtime and loading the model
+    :return: dict {variant: seconds}
+    """
+    jobs = {'eager': checkpoint}
+    jobs.update(artifacts)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    results = {}
+    for name, path in jobs.items():
+        kind = 'onnx' if path.endswith('.onnx') else ('scripted' if path.endswith('.ts') else 'eager')
+        code = STARTUP_SNIPPETS[kind].format(path=os.path.abspath(path))
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            done = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True)
+            best = min(best, time.perf_counter() - start)
+        if done.returncode == 0:
+            results[name] = best
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the temperature CNN to TorchScript/ONNX and benchmark it')
+    parser.add_argument('-m', '--model', type=str, default=DEFAULT_CHECKPOINT, help='Checkpoint file')
+    parser.add_argument('-o', '--output', type=str, default='exported', help='Output directory')
+    parser.add_argument('-l', '--labels', type=str, default='labels.csv', help='CSV with image_path,temperature')
+    parser.add_argument('-d', '--images', type=str, default='roi_images', help='Folder of the ROI images')
+    parser.add_argument('--no-onnx', action='store_true', help='Skip the ONNX export')
+    parser.add_argument('--batch', type=int, default=64, help='ROIs per batch in the latency benchmark')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4], help='Thread counts to try')
+    parser.add_argument('--startup', action='store_true', help='Also time the start-up of each variant')
+    args = parser.parse_args()
+
+    artifacts = export_all(args.model, args.output, onnx=not args.no_onnx)
+    for name, filename in artifacts.items():
+        print("{:<14} {}".format(name, filename))
+
+    variants = build_variants(args.model, artifacts)
+    print(accuracy_check(variants, args.labels, args.images).to_string(index=False))
+
+    labels = pd.read_csv(args.labels)
+    images = [load_roi_image(os.path.join(args.images, p)) for p in labels['image_path']]
+    rois = [images[i % len(images)] for i in range(args.batch)]
+    print(latency_benchmark(variants, rois, args.threads).to_string(index=False))
+
+    if args.startup:
+        for name, seconds in startup_benchmark(args.model, artifacts).items():
+            print("start-up {:<14} {:6.2f} s".format(name, seconds))
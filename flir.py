@@ -3,30 +3,42 @@
 # Interface to FLIR AX8 camera
 
 
-import requests
 import argparse
+import os
 import time
 import datetime
 from time import strftime
 
-import flir_image_extractor
-
-parser = argparse.ArgumentParser(description='Functionality to control/read data from the FLIR AX8 camera.')
-# online camera , switch mode , -- means the type of shot 
-parser.add_argument('--url', action="store", help="the url of the camera, including http://", required=True)
-parser.add_argument('--type', action="store", help="the type of image", choices = ['msx','ir','visual'])
-parser.add_argument('--snap', action="store", help="take a snapshot with the given filename")
-parser.add_argument('--interval', action="store", type=float, help="tries to take snapshots at given interval")
-parser.add_argument('--csv', action="store", help="take a snapshot and export to csv-file")
-parser.add_argument('--plot', action="store_true", help="shows the images")
-parser.add_argument('--range', action="store", type=float, nargs=2, help="temperature range")
-parser.add_argument('--autorange', action="store_true", help="use auto scale")
-parser.add_argument('--nooverlay', action="store_true", help="hide the overlay")
-parser.add_argument('--light', action="store", help="activate the torchlight", choices = ['on','off'])
-parser.add_argument('--debug', action="store_true", help="prints extra debug information")
+# requests and flir_image_extractor are imported where they are used, a --snap run should not pay for matplotlib
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Functionality to control/read data from the FLIR AX8 camera.')
+    # online camera , switch mode , -- means the type of shot 
+    parser.add_argument('--url', action="store", help="the url of the camera, including http://", required=True)
+    parser.add_argument('--type', action="store", help="the type of image", choices = ['msx','ir','visual'])
+    parser.add_argument('--snap', action="store", help="take a snapshot with the given filename")
+    parser.add_argument('--interval', action="store", type=float, help="tries to take snapshots at given interval")
+    parser.add_argument('--csv', action="store", help="take a snapshot and export to csv-file")
+    parser.add_argument('--archive', action="store", help="with --interval, append the raw frames to this archive folder (frame_archive.py) and delete the jpg")
+    parser.add_argument('--plot', action="store_true", help="shows the images")
+    parser.add_argument('--range', action="store", type=float, nargs=2, help="temperature range")
+    parser.add_argument('--autorange', action="store_true", help="use auto scale")
+    parser.add_argument('--nooverlay', action="store_true", help="hide the overlay")
+    parser.add_argument('--light', action="store", help="activate the torchlight", choices = ['on','off'])
+    parser.add_argument('--debug', action="store_true", help="prints extra debug information")
+    return parser
 
 debug = False
-session = requests.Session()
+_session = None
+
+
+def get_session():
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
 
 
 def CtoK(temp):
@@ -37,7 +49,7 @@ class Flir:
         self.baseURL = baseURL
 
     def setResource(self,resource,value):
-        message = session.post(self.baseURL + 'res.php', data={'action':'set','resource':resource,'value':value})
+        message = get_session().post(self.baseURL + 'res.php', data={'action':'set','resource':resource,'value':value})
 
         if (debug and message != "\"\""):
             print(" Return message when setting " + resource + " to " + str(value) + ":\r\n" +message)
@@ -45,7 +57,7 @@ class Flir:
         return (message)
 
     def getResource(self,resource):
-        return session.post(self.baseURL + 'res.php', data={'action':'get','resource':resource})
+        return get_session().post(self.baseURL + 'res.php', data={'action':'get','resource':resource})
 
     def setVisualMode(self):
         self.setResource('.image.sysimg.fusion.fusionData.fusionMode',1)
@@ -58,9 +70,10 @@ class Flir:
     def setMSXMode(self):
         self.setResource('.image.sysimg.fusion.fusionData.fusionMode',3)
 
-    def setPeriodicMode(self):
+    def setPeriodicMode(self, ftp_host='192.168.11.18'):
+        # the camera pushes a JPEG to ftp_host every interval, see ftp_ingest.py for the receiving side
         self.setResource('.resmon.schedule.active','true')
-        self.setResource('.resmon.schedule.config.ftp', '192.168.11.18')
+        self.setResource('.resmon.schedule.config.ftp', ftp_host)
         self.setResource('.resmon.schedule.config.imageFormat', 'JPEG')
         self.setResource('.resmon.schedule.actions.sendImage', 'true')
         self.setResource('.resmon.schedule.results.1.active', 'true')
@@ -104,7 +117,7 @@ class Flir:
 
     def login(self):
         print("Logging in")
-        message = session.post(self.baseURL + 'login/dologin', data={'user_name':'admin','user_password':'admin'})
+        message = get_session().post(self.baseURL + 'login/dologin', data={'user_name':'admin','user_password':'admin'})
 
         if (not('success' in message.text)):
             print("Could not log in.")
@@ -127,29 +140,29 @@ class Flir:
 
         print("Getting image from camera")
         while not(ready):
-            response = session.get(self.baseURL + 'storage/download/image/' + filename, allow_redirects=True)
+            response = get_session().get(self.baseURL + 'storage/download/image/' + filename, allow_redirects=True)
 
             #if response.status_code == 404:
             #    print(response.text)
             #    #self.login()
             #el
-            if response.status_code == requests.codes.ok:
+            if response.status_code == 200:
                 ready = True
                 fh.write(response.content)
             else:
                 time.sleep(0.3)
-                response = session.get(self.baseURL + 'download.php', data={'file':'/FLIR/images/' + filename}, allow_redirects=True)
+                response = get_session().get(self.baseURL + 'download.php', data={'file':'/FLIR/images/' + filename}, allow_redirects=True)
 
         fh.close()
 
         print("Deleting picture: " + filename)
-        message = session.post(self.baseURL + 'storage/delete/image/' + filename)
+        message = get_session().post(self.baseURL + 'storage/delete/image/' + filename)
 
         if ('login' in message.text):
             print("Need to log in first")
             self.login()
 
-            message = session.post(self.baseURL + 'storage/delete/image/' + filename)
+            message = get_session().post(self.baseURL + 'storage/delete/image/' + filename)
 
         end = time.time()
 
@@ -159,6 +172,7 @@ class Flir:
 
         start = time.time()
 
+        import flir_image_extractor
         fie = flir_image_extractor.FlirImageExtractor()
         fie.process_image(jpgfile)
 
@@ -171,6 +185,29 @@ class Flir:
         if (plot):
             fie.plot()
 
+    def archiveSnapshot(self, jpgfile, folder, keep=False):
+        import frame_archive
+        import flir_image_extractor
+
+        if getattr(self, 'archive', None) is None or self.archive.folder != folder:
+            # small chunks, --interval runs until killed
+            self.archive = frame_archive.FrameArchive(folder, chunk_frames=8)
+            self.extractor = flir_image_extractor.FlirImageExtractor()
+
+        self.extractor.process_image(jpgfile)
+        index = self.archive.append(self.extractor.get_raw_frame(), time.time())
+        if (len(self.archive) % self.archive.chunk_frames == 0):
+            print("Archived frames up to " + str(index) + " in " + folder)
+
+        if (not keep):
+            os.remove(jpgfile)
+
+    def closeArchive(self):
+        # writes the frames still buffered in the open chunk
+        if getattr(self, 'archive', None) is not None:
+            self.archive.close()
+            self.archive = None
+
     #def getBox(self,boxNumber):
     #    ret = {}
     #    bns = str(boxNumber)
@@ -191,7 +228,7 @@ class Flir:
 if __name__ == '__main__':
     import sys
 
-    args = parser.parse_args()
+    args = build_parser().parse_args()
 
     if (args.debug):
         debug = True
@@ -243,17 +280,25 @@ if __name__ == '__main__':
     if (args.interval):
         if (args.snap):
 
-            while True:
-                timestamp = strftime("%H%M%S")
-                filename = args.snap.strip('.jpg') + '_' + timestamp + '.jpg'
-                f.getSnapshot(filename)
-
-                if (args.csv):
-                    filenamecsv = filename.strip('.jpg') + '.csv'
-                    f.getCsvData(filename, filenamecsv, False)
-
-                if (args.interval > 0):
-                    time.sleep(args.interval)
+            try:
+                while True:
+                    timestamp = strftime("%H%M%S")
+                    filename = args.snap.strip('.jpg') + '_' + timestamp + '.jpg'
+                    f.getSnapshot(filename)
+
+                    if (args.csv):
+                        filenamecsv = filename.strip('.jpg') + '.csv'
+                        f.getCsvData(filename, filenamecsv, False)
+
+                    if (args.archive):
+                        f.archiveSnapshot(filename, args.archive)
+
+                    if (args.interval > 0):
+                        time.sleep(args.interval)
+            except KeyboardInterrupt:
+                print("Interval capture stopped")
+            finally:
+                f.closeArchive()
 
     elif (args.snap):
         f.getSnapshot(args.snap)
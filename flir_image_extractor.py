@@ -13,11 +13,11 @@ import csv
 import subprocess
 from PIL import Image
 from math import sqrt, exp, log
-from matplotlib import cm
-from matplotlib import pyplot as plt
 
 import numpy as np
 
+from rawframe import Calibration, RawFrame, decode_raw
+
 
 class FlirImageExtractor:
 
@@ -36,6 +36,7 @@ class FlirImageExtractor:
 
         self.rgb_image_np = None
         self.thermal_image_np = None
+        self.raw_frame = None
 
     pass
 
@@ -60,7 +61,9 @@ class FlirImageExtractor:
             self.fix_endian = False
 
         self.rgb_image_np = self.extract_embedded_image()
-        self.thermal_image_np = self.extract_thermal_image()
+        # temperatures are computed from the raw frame when first asked for
+        self.raw_frame = self.extract_raw_frame()
+        self.thermal_image_np = None
 
     def get_image_type(self):
         """
@@ -82,11 +85,20 @@ class FlirImageExtractor:
 
     def get_thermal_np(self):
         """
-        Return the last extracted thermal image
+        Return the last extracted thermal image (float32 temperatures in oC)
         :return:
         """
+        if self.thermal_image_np is None and self.raw_frame is not None:
+            return self.raw_frame.temperatures
         return self.thermal_image_np
 
+    def get_raw_frame(self):
+        """
+        Return the last extracted raw frame (uint16 counts + calibration)
+        :return:
+        """
+        return self.raw_frame
+
     def extract_embedded_image(self):
         """
         extracts the visual image as 2D numpy array of RGB values
@@ -103,9 +115,9 @@ class FlirImageExtractor:
 
         return visual_np
 
-    def extract_thermal_image(self):
+    def extract_raw_frame(self):
         """
-        extracts the thermal image as 2D numpy array with temperatures in oC
+        extracts the thermal image as uint16 sensor counts together with the calibration read from the metadata
         """
         # read image metadata needed for conversion of the raw sensor values
         # E=1,SD=1,RTemp=20,ATemp=RTemp,IRWTemp=RTemp,IRT=1,RH=50,PR1=21106.77,PB=1501,PF=1,PO=-7340,PR2=0.012545258
@@ -117,35 +129,16 @@ class FlirImageExtractor:
 
         # exifread can't extract the embedded thermal image, use exiftool instead
         thermal_img_bytes = subprocess.check_output([self.exiftool_path, "-RawThermalImage", "-b", self.flir_img_filename])
-        thermal_img_stream = io.BytesIO(thermal_img_bytes)
-
-        thermal_img = Image.open(thermal_img_stream)
-        thermal_np = np.array(thermal_img)
-
-        # raw values -> temperature
-        subject_distance = self.default_distance
-        if 'SubjectDistance' in meta:
-            subject_distance = FlirImageExtractor.extract_float(meta['SubjectDistance'])
-
-        if self.fix_endian:
-            # fix endianness, the bytes in the embedded png are in the wrong order
-            thermal_np = np.vectorize(lambda x: (x >> 8) + ((x & 0x00ff) << 8))(thermal_np)
-
-        raw2tempfunc = np.vectorize(lambda x: FlirImageExtractor.raw2temp(x, E=meta['Emissivity'], OD=subject_distance,
-                                                                          RTemp=FlirImageExtractor.extract_float(
-                                                                              meta['ReflectedApparentTemperature']),
-                                                                          ATemp=FlirImageExtractor.extract_float(
-                                                                              meta['AtmosphericTemperature']),
-                                                                          IRWTemp=FlirImageExtractor.extract_float(
-                                                                              meta['IRWindowTemperature']),
-                                                                          IRT=meta['IRWindowTransmission'],
-                                                                          RH=FlirImageExtractor.extract_float(
-                                                                              meta['RelativeHumidity']),
-                                                                          PR1=meta['PlanckR1'], PB=meta['PlanckB'],
-                                                                          PF=meta['PlanckF'],
-                                                                          PO=meta['PlanckO'], PR2=meta['PlanckR2']))
-        thermal_np = raw2tempfunc(thermal_np)
-        return thermal_np
+
+        # fix endianness with one byteswap of the buffer, the bytes in the embedded png are in the wrong order
+        raw = decode_raw(thermal_img_bytes, fix_endian=self.fix_endian)
+        return RawFrame(raw, Calibration.from_exif(meta, self.default_distance))
+
+    def extract_thermal_image(self):
+        """
+        extracts the thermal image as 2D numpy array with temperatures in oC (float32)
+        """
+        return self.extract_raw_frame().temperatures
 
     @staticmethod
     def raw2temp(raw, E=1, OD=1, RTemp=20, ATemp=20, IRWTemp=20, IRT=1, RH=50, PR1=21106.77, PB=1501, PF=1, PO=-7340,
@@ -207,6 +200,8 @@ class FlirImageExtractor:
         Plot the rgb + thermal image (easy to see the pixel values)
         :return:
         """
+        from matplotlib import pyplot as plt
+
         rgb_np = self.get_rgb_np()
         thermal_np = self.get_thermal_np()
 
@@ -221,8 +216,10 @@ class FlirImageExtractor:
         Save the extracted images
         :return:
         """
+        from matplotlib import cm
+
         rgb_np = self.get_rgb_np()
-        thermal_np = self.extract_thermal_image()
+        thermal_np = self.get_thermal_np()
 
         img_visual = Image.fromarray(rgb_np)
         thermal_normalized = (thermal_np - np.amin(thermal_np)) / (np.amax(thermal_np) - np.amin(thermal_np))
@@ -252,7 +249,7 @@ class FlirImageExtractor:
             writer.writerow(['x', 'y', 'temp (c)'])
 
             pixel_values = []
-            for e in np.ndenumerate(self.thermal_image_np):
+            for e in np.ndenumerate(self.get_thermal_np()):
                 x, y = e[0]
                 c = e[1]
                 pixel_values.append([x, y, c])
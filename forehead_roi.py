@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Pluggable forehead ROI providers.
+
+Every provider has `locate(frame, gray=None)` returning one dict per face
+with 'face_roi' and 'forehead_roi' boxes (x, y, w, h) in frame pixels:
+
+    HaarFractionRoi    Haar face box + the fixed 10%/5%/80%/20% fractions
+    PoseRoi            MediaPipe Pose on the whole frame, 60x60 box above the
+                       nose (the notebook's skeleton cell)
+    FaceLandmarkRoi    Haar face box, then a face landmark model (dlib 68
+                       points or MediaPipe Face Mesh) run only on the face
+                       crop scaled down to `crop_size`; the forehead is placed
+                       above the eyebrows
+
+Landmark based boxes are smoothed over time with a One Euro filter so the
+ROI does not jitter between frames. mediapipe and dlib are optional.
+"""
+
+import abc
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+# forehead box as fractions of the face box: x offset, y offset, width, height
+FOREHEAD_FRACTIONS = (0.1, 0.05, 0.8, 0.2)
+
+# dlib 68 point model: eyebrows 17-26, nose tip 33
+DLIB_BROWS = list(range(17, 27))
+DLIB_NOSE = 33
+
+# MediaPipe Face Mesh: upper eyebrow contour and nose tip
+MESH_BROWS = [70, 63, 105, 66, 107, 336, 296, 334, 293, 300]
+MESH_NOSE = 1
+
+
+class OneEuroFilter:
+    """
+    One Euro filter (Casiez et al.) on an array of values: smooth when still, responsive when moving
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.x = None
+        self.dx = None
+        self.t = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * np.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def reset(self):
+        self.x = self.dx = self.t = None
+
+    def __call__(self, x, t=None):
+        x = np.asarray(x, dtype=np.float64)
+        t = time.monotonic() if t is None else t
+        if self.x is None or self.x.shape != x.shape:
+            self.x, self.dx, self.t = x, np.zeros_like(x), t
+            return x
+
+        dt = max(t - self.t, 1e-3)
+        self.t = t
+        a_d = self._alpha(self.d_cutoff, dt)
+        self.dx = a_d * (x - self.x) / dt + (1 - a_d) * self.dx
+        cutoff = self.min_cutoff + self.beta * np.abs(self.dx)
+        a = self._alpha(cutoff, dt)
+        self.x = a * x + (1 - a) * self.x
+        return self.x
+
+
+class BoxSmoother:
+    """
+    Keep one filter per face, matched frame to frame by the nearest box center
+    """
+
+    def __init__(self, max_jump=0.5, **filter_args):
+        self.max_jump = max_jump
+        self.filter_args = filter_args
+        self.tracks = []  # list of (center, OneEuroFilter)
+
+    def __call__(self, boxes, t=None):
+        boxes = [np.asarray(b, dtype=np.float64) for b in boxes]
+        centers = [b[:2] + b[2:] / 2 for b in boxes]
+        free = list(range(len(self.tracks)))
+        tracks, smoothed = [], []
+
+        for box, center in zip(boxes, centers):
+            best, best_dist = None, None
+            for i in free:
+                dist = np.linalg.norm(self.tracks[i][0] - center)
+                if best is None or dist < best_dist:
+                    best, best_dist = i, dist
+            if best is not None and best_dist <= self.max_jump * max(box[2], box[3]):
+                free.remove(best)
+                flt = self.tracks[best][1]
+            else:
+                flt = OneEuroFilter(**self.filter_args)
+            smoothed.append(flt(box, t))
+            tracks.append((center, flt))
+
+        self.tracks = tracks
+        return [tuple(int(round(v)) for v in b) for b in smoothed]
+
+
+class RoiProvider(abc.ABC):
+    name = 'base'
+
+    @abc.abstractmethod
+    def locate(self, frame, gray=None):
+        """
+        :return: list of {'face_roi': (x, y, w, h) or None, 'forehead_roi': (x, y, w, h)}
+        """
+
+
+class HaarFractionRoi(RoiProvider):
+    name = 'haar'
+
+    def __init__(self, detect_width=320, min_face=100, cascade_path=None, fractions=FOREHEAD_FRACTIONS):
+        self.detect_width = detect_width
+        self.min_face = min_face
+        self.fractions = fractions
+        if cascade_path is None:
+            cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        self.face_cascade = cv2.CascadeClassifier(cascade_path)
+
+    def detect_faces(self, gray):
+        """
+        Haar detection on a downscaled copy, boxes returned in full-frame pixels
+        :return: int array N x 4 (x, y, w, h)
+        """
+        scale = 1.0
+        small = gray
+        if self.detect_width and gray.shape[1] > self.detect_width:
+            scale = gray.shape[1] / float(self.detect_width)
+            small = cv2.resize(gray, (self.detect_width, int(round(gray.shape[0] / scale))),
+                               interpolation=cv2.INTER_AREA)
+
+        min_size = max(int(self.min_face / scale), 20)
+        faces = self.face_cascade.detectMultiScale(small, 1.1, 3, minSize=(min_size, min_size))
+        if len(faces) == 0:
+            return np.zeros((0, 4), dtype=np.int32)
+        return np.round(np.asarray(faces) * scale).astype(np.int32)
+
+    def forehead_box(self, face):
+        x, y, w, h = (int(v) for v in face)
+        fx, fy, fw, fh = self.fractions
+        return x + int(w * fx), y + int(h * fy), int(w * fw), int(h * fh)
+
+    def locate(self, frame, gray=None):
+        if gray is None:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return [{'face_roi': tuple(int(v) for v in face), 'forehead_roi': self.forehead_box(face)}
+                for face in self.detect_faces(gray)]
+
+
+class PoseRoi(RoiProvider):
+    name = 'pose'
+
+    def __init__(self, roi_half=30, min_visibility=0.5):
+        import mediapipe as mp
+
+        self.pose = mp.solutions.pose.Pose(static_image_mode=False)
+        self.roi_half = roi_half
+        self.min_visibility = min_visibility
+
+    def locate(self, frame, gray=None):
+        h, w = frame.shape[:2]
+        results = self.pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if not results.pose_landmarks:
+            return []
+
+        lm = results.pose_landmarks.landmark
+        if min(lm[0].visibility, lm[1].visibility, lm[2].visibility) < self.min_visibility:
+            return []
+
+        x = int((lm[2].x + lm[5].x) / 2 * w)
+        y = int((lm[0].y - 0.1) * h)
+        x1, y1 = max(0, x - self.roi_half), max(0, y - self.roi_half)
+        x2, y2 = min(w, x + self.roi_half), min(h, y + self.roi_half)
+        return [{'face_roi': None, 'forehead_roi': (x1, y1, x2 - x1, y2 - y1)}]
+
+
+def forehead_from_landmarks(brows, nose, width_ratio=0.8, height_ratio=0.6):
+    """
+    Place the forehead box above the eyebrows, sized from the brow span and the brow to nose distance
+    :param brows: K x 2 eyebrow points
+    :param nose: nose tip (x, y)
+    :return: (x, y, w, h) floats
+    """
+    brow_left, brow_right = brows[:, 0].min(), brows[:, 0].max()
+    brow_top = brows[:, 1].min()
+    width = (brow_right - brow_left) * width_ratio
+    height = max(nose[1] - brow_top, 1.0) * height_ratio
+    cx = (brow_left + brow_right) / 2
+    return cx - width / 2, brow_top - height, width, height
+
+
+class _DlibLandmarks:
+
+    def __init__(self, predictor_path):
+        import dlib
+
+        self.dlib = dlib
+        self.predictor = dlib.shape_predictor(predictor_path)
+
+    def __call__(self, gray_crop):
+        h, w = gray_crop.shape[:2]
+        shape = self.predictor(gray_crop, self.dlib.rectangle(0, 0, w - 1, h - 1))
+        points = np.array([(p.x, p.y) for p in shape.parts()], dtype=np.float64)
+        return points[DLIB_BROWS], points[DLIB_NOSE]
+
+
+class _MeshLandmarks:
+
+    def __init__(self):
+        import mediapipe as mp
+
+        self.mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=False, max_num_faces=1,
+                                                    refine_landmarks=False)
+
+    def __call__(self, bgr_crop):
+        h, w = bgr_crop.shape[:2]
+        results = self.mesh.process(cv2.cvtColor(bgr_crop, cv2.COLOR_BGR2RGB))
+        if not results.multi_face_landmarks:
+            return None
+        lm = results.multi_face_landmarks[0].landmark
+        brows = np.array([(lm[i].x * w, lm[i].y * h) for i in MESH_BROWS])
+        return brows, np.array([lm[MESH_NOSE].x * w, lm[MESH_NOSE].y * h])
+
+
+class FaceLandmarkRoi(RoiProvider):
+    name = 'landmarks'
+
+    def __init__(self, backend='mesh', predictor_path=None, crop_size=128, margin=0.15, smooth=True,
+                 detector=None, **smoother_args):
+        """
+        :param backend: 'mesh' (MediaPipe Face Mesh) or 'dlib' (needs predictor_path to the 68 point model)
+        :param crop_size: side the face crop is scaled to before running the landmark model
+        :param margin: extra border around the Haar face box, as a fraction of its size
+        """
+        if backend == 'dlib':
+            if predictor_path is None:
+                raise ValueError("The dlib backend needs predictor_path (shape_predictor_68_face_landmarks.dat)")
+            self.landmarks = _DlibLandmarks(predictor_path)
+            self.gray_input = True
+        elif backend == 'mesh':
+            self.landmarks = _MeshLandmarks()
+            self.gray_input = False
+        else:
+            raise ValueError("Unknown landmark backend: {}".format(backend))
+
+        self.detector = detector if detector is not None else HaarFractionRoi()
+        self.crop_size = crop_size
+        self.margin = margin
+        self.smoother = BoxSmoother(**smoother_args) if smooth else None
+
+    def locate(self, frame, gray=None):
+        if gray is None:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        fh_img, fw_img = gray.shape[:2]
+
+        faces, boxes = [], []
+        for face in self.detector.detect_faces(gray):
+            x, y, w, h = (int(v) for v in face)
+            m = int(max(w, h) * self.margin)
+            x1, y1 = max(0, x - m), max(0, y - m)
+            x2, y2 = min(fw_img, x + w + m), min(fh_img, y + h + m)
+
+            crop = (gray if self.gray_input else frame)[y1:y2, x1:x2]
+            scale = self.crop_size / float(max(crop.shape[:2]))
+            if scale < 1:
+                crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            else:
+                scale = 1.0
+
+            found = self.landmarks(crop)
+            if found is None:
+                continue
+            brows, nose = found
+            bx, by, bw, bh = forehead_from_landmarks(brows / scale, nose / scale)
+            faces.append((x, y, w, h))
+            boxes.append((bx + x1, by + y1, bw, bh))
+
+        if self.smoother is not None:
+            boxes = self.smoother(boxes)
+        else:
+            boxes = [tuple(int(round(v)) for v in b) for b in boxes]
+
+        results = []
+        for face, (bx, by, bw, bh) in zip(faces, boxes):
+            bx, by = max(bx, 0), max(by, 0)
+            results.append({'face_roi': face, 'forehead_roi': (bx, by, bw, bh)})
+        return results
+
+
+def make_provider(name, **kwargs):
+    if name == 'haar':
+        return HaarFractionRoi(**kwargs)
+    if name == 'pose':
+        return PoseRoi(**kwargs)
+    if name in ('mesh', 'dlib'):
+        return FaceLandmarkRoi(backend=name, **kwargs)
+    raise ValueError("Unknown ROI provider: {}".format(name))
+
+
+def benchmark(frames, providers, repeat=1):
+    """
+    Mean per-frame cost of every provider and how many faces it found
+    :return: dict {name: (ms per frame, ROIs found)}
+    """
+    results = {}
+    for name, provider in providers.items():
+        found = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for frame in frames:
+                found += len(provider.locate(frame))
+        elapsed = time.perf_counter() - start
+        results[name] = (elapsed / (len(frames) * repeat) * 1000, found)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the per-frame cost of the forehead ROI providers')
+    parser.add_argument('--video', type=str, help='Video file')
+    parser.add_argument('--image', type=str, default='image.jpg', help='Image used when no video is given')
+    parser.add_argument('--frames', type=int, default=100, help='Frames to use')
+    parser.add_argument('--providers', type=str, nargs='+', default=['haar', 'pose', 'mesh'],
+                        choices=['haar', 'pose', 'mesh', 'dlib'])
+    parser.add_argument('--predictor', type=str, help='dlib 68 point shape predictor file')
+    args = parser.parse_args()
+
+    frames = []
+    if args.video:
+        cap = cv2.VideoCapture(args.video)
+        while len(frames) < args.frames:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+    else:
+        frames = [cv2.imread(args.image)] * args.frames
+
+    providers = {}
+    for name in args.providers:
+        try:
+            kwargs = {'predictor_path': args.predictor} if name == 'dlib' else {}
+            providers[name] = make_provider(name, **kwargs)
+        except (ImportError, ValueError, AttributeError) as e:
+            print("{}: not available ({})".format(name, e))
+
+    for name, (ms, found) in benchmark(frames, providers).items():
+        print("{:<6} {:8.2f} ms/frame  {} ROIs".format(name, ms, found))
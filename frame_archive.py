@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Append-only archive of raw thermal frames (see rawframe.py), one folder per camera.
+
+    frames.bin   compressed chunks, back to back
+    chunks.idx   one record per chunk: offset, size, frame count, shape, time span, calibration
+    frames.idx   one record per frame: timestamp, chunk, slot in the chunk
+
+A chunk holds up to `chunk_frames` frames of the same shape and calibration
+(a new chunk starts whenever either changes). The first frame is stored
+as is, the next ones as the uint16 difference with the previous frame
+(wrapping, so decoding is exact); the high and low bytes are split into
+two planes before zlib, since consecutive frames of a static scene differ
+by a few counts. The two .idx files are fixed-size records read through
+np.memmap: finding a frame or a time range is a binary search on the
+timestamps, reading it decompresses a single chunk.
+
+Frames are buffered until their chunk is full (or flush()/close() is
+called), so a crash loses at most the open chunk; the index files are
+written after the chunk data, so the archive on disk is always readable.
+
+    archive = FrameArchive('archive/ax8')
+    archive.append(fie.get_raw_frame(), time.time())
+    for timestamp, frame in archive.range(start, end):
+        ...
+"""
+
+import argparse
+import os
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from rawframe import CALIBRATION_FIELDS, Calibration, RawFrame
+
+CHUNK_DTYPE = np.dtype([('offset', '<u8'), ('nbytes', '<u8'), ('frames', '<u4'), ('rows', '<u4'), ('cols', '<u4'),
+                        ('t_first', '<f8'), ('t_last', '<f8'), ('calibration', '<f8', len(CALIBRATION_FIELDS))])
+FRAME_DTYPE = np.dtype([('timestamp', '<f8'), ('chunk', '<u4'), ('slot', '<u4')])
+
+
+def encode_chunk(frames, level=1):
+    """
+    Delta + byte plane + zlib encoding of a (n, rows, cols) uint16 stack
+    :param level: zlib level; above 1 the ratio barely improves on sensor noise and writing gets several times slower
+    :return: bytes
+    """
+    frames = np.ascontiguousarray(frames, dtype='<u2')
+    deltas = frames.copy()
+    # uint16 arithmetic wraps around, cumsum in decode_chunk undoes it exactly
+    np.subtract(frames[1:], frames[:-1], out=deltas[1:])
+    pairs = deltas.view(np.uint8).reshape(-1, 2)
+    planes = np.empty((2, len(pairs)), dtype=np.uint8)
+    planes[0] = pairs[:, 0]
+    planes[1] = pairs[:, 1]
+    return zlib.compress(planes, level)
+
+
+def decode_chunk(payload, n, rows, cols):
+    """
+    Inverse of encode_chunk
+    :return: (n, rows, cols) uint16 array
+    """
+    planes = np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(2, -1)
+    frames = np.empty((n, rows, cols), dtype='<u2')
+    pairs = frames.view(np.uint8).reshape(-1, 2)
+    pairs[:, 0] = planes[0]
+    pairs[:, 1] = planes[1]
+    np.cumsum(frames, axis=0, dtype=np.uint16, out=frames)
+    return frames
+
+
+class FrameArchive:
+
+    def __init__(self, folder, chunk_frames=32, level=1, cache_chunks=4):
+        """
+        :param folder: archive folder, created if needed; appending to an existing archive continues it
+        :param chunk_frames: frames per chunk, the unit of compression and of random access
+        :param cache_chunks: decoded chunks kept in memory for sequential reads
+        """
+        self.folder = folder
+        self.chunk_frames = chunk_frames
+        self.level = level
+        self.cache_chunks = cache_chunks
+        os.makedirs(folder, exist_ok=True)
+        self.data_path = os.path.join(folder, 'frames.bin')
+        self.chunks_path = os.path.join(folder, 'chunks.idx')
+        self.frames_path = os.path.join(folder, 'frames.idx')
+        for path in (self.data_path, self.chunks_path, self.frames_path):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+
+        self._buffer = []
+        self._buffer_times = []
+        self._buffer_key = None
+        self._cache = OrderedDict()
+        self._maps = {}
+        self._sizes = {}
+
+    # writing
+
+    def append(self, frame, timestamp, calibration=None):
+        """
+        Add a frame; timestamps must not decrease
+        :param frame: RawFrame, or uint16 counts together with calibration
+        :return: index of the frame in the archive
+        """
+        if isinstance(frame, RawFrame):
+            raw, calibration = frame.raw, frame.calibration
+        else:
+            raw = np.asarray(frame, dtype=np.uint16)
+            calibration = calibration if calibration is not None else Calibration()
+        last = self._buffer_times[-1] if self._buffer_times else self._last_timestamp()
+        if last is not None and timestamp < last:
+            raise ValueError("Timestamp {} is older than the last archived frame ({})".format(timestamp, last))
+
+        key = (raw.shape, tuple(calibration))
+        if self._buffer and key != self._buffer_key:
+            self.flush()
+        self._buffer_key = key
+        self._buffer.append(np.array(raw, dtype=np.uint16))
+        self._buffer_times.append(float(timestamp))
+        index = len(self) - 1
+        if len(self._buffer) >= self.chunk_frames:
+            self.flush()
+        return index
+
+    def flush(self):
+        """
+        Compress and write the open chunk
+        :return:
+        """
+        if not self._buffer:
+            return
+        (rows, cols), calibration = self._buffer_key
+        payload = encode_chunk(np.stack(self._buffer), self.level)
+        chunk_id = self._count(self.chunks_path, CHUNK_DTYPE)
+
+        with open(self.data_path, 'ab') as fh:
+            offset = fh.tell()
+            fh.write(payload)
+        chunk = np.zeros(1, dtype=CHUNK_DTYPE)
+        chunk[0] = (offset, len(payload), len(self._buffer), rows, cols,
+                    self._buffer_times[0], self._buffer_times[-1], calibration)
+        frames = np.zeros(len(self._buffer), dtype=FRAME_DTYPE)
+        frames['timestamp'] = self._buffer_times
+        frames['chunk'] = chunk_id
+        frames['slot'] = np.arange(len(self._buffer))
+        # the data is on disk before the index points at it
+        with open(self.chunks_path, 'ab') as fh:
+            fh.write(chunk.tobytes())
+        with open(self.frames_path, 'ab') as fh:
+            fh.write(frames.tobytes())
+
+        self._buffer = []
+        self._buffer_times = []
+        self._buffer_key = None
+
+    def close(self):
+        self.flush()
+        self._maps = {}
+        self._sizes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # reading
+
+    def _count(self, path, dtype):
+        return os.path.getsize(path) // dtype.itemsize
+
+    def _map(self, path, dtype=np.uint8):
+        """
+        Memory map of a file, remapped when it has grown
+        :return: array (empty if the file is)
+        """
+        size = os.path.getsize(path)
+        if self._sizes.get(path) != size:
+            count = size // np.dtype(dtype).itemsize
+            self._maps[path] = np.memmap(path, dtype=dtype, mode='r', shape=(count,)) if count else np.zeros(0, dtype)
+            self._sizes[path] = size
+        return self._maps[path]
+
+    @property
+    def chunks(self):
+        return self._map(self.chunks_path, CHUNK_DTYPE)
+
+    @property
+    def index(self):
+        return self._map(self.frames_path, FRAME_DTYPE)
+
+    @property
+    def timestamps(self):
+        """
+        Timestamps of the written frames (memory mapped)
+        :return:
+        """
+        return self.index['timestamp']
+
+    def _last_timestamp(self):
+        index = self.index
+        return float(index['timestamp'][-1]) if len(index) else None
+
+    def __len__(self):
+        return self._count(self.frames_path, FRAME_DTYPE) + len(self._buffer)
+
+    def read_chunk(self, chunk_id):
+        """
+        Decoded frames of a chunk
+        :return: ((n, rows, cols) uint16 array, Calibration)
+        """
+        if chunk_id in self._cache:
+            self._cache.move_to_end(chunk_id)
+            return self._cache[chunk_id]
+        chunk = self.chunks[chunk_id]
+        data = self._map(self.data_path)
+        payload = data[int(chunk['offset']):int(chunk['offset'] + chunk['nbytes'])]
+        frames = decode_chunk(payload, int(chunk['frames']), int(chunk['rows']), int(chunk['cols']))
+        frames.flags.writeable = False
+        entry = (frames, Calibration(*chunk['calibration'].tolist()))
+        self._cache[chunk_id] = entry
+        if len(self._cache) > self.cache_chunks:
+            self._cache.popitem(last=False)
+        return entry
+
+    def frame(self, i):
+        """
+        :return: (timestamp, RawFrame) of the i-th frame, negative indices count from the end
+        """
+        written = self._count(self.frames_path, FRAME_DTYPE)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Frame {} not in archive of {} frames".format(i, len(self)))
+        if i >= written:
+            j = i - written
+            return self._buffer_times[j], RawFrame(self._buffer[j], Calibration(*self._buffer_key[1]))
+        record = self.index[i]
+        frames, calibration = self.read_chunk(int(record['chunk']))
+        return float(record['timestamp']), RawFrame(frames[int(record['slot'])], calibration)
+
+    def __getitem__(self, i):
+        return self.frame(i)
+
+    def locate(self, start=None, end=None):
+        """
+        Frame indices with start <= timestamp < end (written frames only)
+        :return: (first, stop)
+        """
+        timestamps = self.timestamps
+        first = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+        stop = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='left'))
+        return first, stop
+
+    def range(self, start=None, end=None, step=1):
+        """
+        Iterate over the frames of a time range, one chunk decoded at a time
+        :return: generator of (timestamp, RawFrame)
+        """
+        first, stop = self.locate(start, end)
+        for i in range(first, stop, step):
+            yield self.frame(i)
+
+    def nearest(self, timestamp):
+        """
+        :return: (timestamp, RawFrame) of the frame closest in time
+        """
+        timestamps = self.timestamps
+        if not len(timestamps):
+            raise IndexError("Empty archive")
+        i = int(np.searchsorted(timestamps, timestamp))
+        if i == len(timestamps) or (i > 0 and timestamp - timestamps[i - 1] <= timestamps[i] - timestamp):
+            i -= 1
+        return self.frame(i)
+
+    def stats(self):
+        """
+        :return: dict with frame/chunk counts and the compression ratio
+        """
+        chunks = self.chunks
+        raw_bytes = int((chunks['frames'].astype(np.int64) * chunks['rows'] * chunks['cols'] * 2).sum())
+        stored = os.path.getsize(self.data_path)
+        return {
+            'frames': len(self.index),
+            'chunks': len(chunks),
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored,
+            'ratio': raw_bytes / stored if stored else float('nan'),
+            'first': float(chunks['t_first'][0]) if len(chunks) else None,
+            'last': float(chunks['t_last'][-1]) if len(chunks) else None,
+        }
+
+
+def import_files(archive, filenames, exiftool_path='exiftool'):
+    """
+    Archive existing snapshots: FLIR JPEGs, RawFrame .npz (rawframe.py); timestamps from the file times
+    :return: number of frames added
+    """
+    fie = None
+    filenames = sorted(filenames, key=os.path.getmtime)
+    for filename in filenames:
+        if filename.endswith('.npz'):
+            frame = RawFrame.load(filename)
+        else:
+            if fie is None:
+                from flir_image_extractor import FlirImageExtractor
+                fie = FlirImageExtractor(exiftool_path=exiftool_path)
+            fie.process_image(filename)
+            frame = fie.get_raw_frame()
+        archive.append(frame, os.path.getmtime(filename))
+    archive.flush()
+    return len(filenames)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Chunked, delta-compressed archive of raw thermal frames')
+    parser.add_argument('archive', type=str, help='Archive folder')
+    parser.add_argument('--add', type=str, nargs='+', help='FLIR JPEGs or RawFrame .npz files to append')
+    parser.add_argument('--exiftool', type=str, default='exiftool', help='Path to exiftool executable')
+    parser.add_argument('--chunk', type=int, default=32, help='Frames per chunk')
+    parser.add_argument('--export', type=float, nargs=2, metavar=('START', 'END'),
+                        help='Export the frames of a time range (unix seconds) as RawFrame .npz files')
+    parser.add_argument('--out', type=str, default='export', help='Folder for --export')
+    parser.add_argument('--demo', type=int, default=0, help='Append N synthetic frames (no camera needed)')
+    args = parser.parse_args()
+
+    archive = FrameArchive(args.archive, chunk_frames=args.chunk)
+
+    if args.add:
+        print("{} files archived".format(import_files(archive, args.add, args.exiftool)))
+
+    if args.demo:
+        import time
+        rng = np.random.default_rng(0)
+        scene = rng.normal(17500, 40, (60, 80))
+        start = archive._last_timestamp() or time.time()
+        for i in range(args.demo):
+            raw = np.clip(scene + rng.normal(0, 3, scene.shape), 0, 65535).astype(np.uint16)
+            archive.append(raw, start + i + 1, Calibration(E=0.95))
+        archive.flush()
+
+    if args.export:
+        os.makedirs(args.out, exist_ok=True)
+        n = 0
+        for timestamp, frame in archive.range(*args.export):
+            frame.save(os.path.join(args.out, 'frame_{:.3f}.npz'.format(timestamp)))
+            n += 1
+        print("{} frames exported to {}".format(n, args.out))
+
+    archive.close()
+    print(archive.stats())
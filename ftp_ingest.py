@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Push-based ingestion of the JPEGs the AX8 uploads by FTP (Flir.setPeriodicMode).
+
+Incoming files go to an IngestPool: a bounded queue drained by a fixed
+number of worker threads running the extraction. When the queue is full,
+submit() either blocks the uploader (policy='block', the FTP transfer of
+that camera waits, TCP does the rest) or drops the frame and counts it
+(policy='drop').
+
+Two ways to receive:
+
+    FTP server (pyftpdlib, optional)   the upload itself triggers the pipeline, one
+                                       thread per camera connection
+    DirectoryWatcher                   any other FTP/SMB server writing to a folder,
+                                       scanned every `interval` seconds
+
+Uploads land in root/<camera>/ where <camera> is the FTP user, or the
+camera IP for anonymous uploads, and every received file is renamed to a
+unique name before it is queued, so one receiver serves many cameras
+without two uploads of the same name overwriting each other. Anonymous
+users can only change directory and store files. Try it without a camera:
+
+    python ftp_ingest.py --root incoming --ftp 2121 &
+    python ftp_ingest.py --upload frame1.jpg frame2.jpg --port 2121
+"""
+
+import argparse
+import ftplib
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class IngestPool:
+
+    def __init__(self, handler, workers=4, queue_size=16, policy='block', delete_after=False, on_result=None,
+                 latency_window=10000):
+        """
+        :param handler: function(path) -> result, run in the worker threads
+        :param queue_size: frames waiting for a worker before backpressure applies
+        :param policy: 'block' the uploader or 'drop' the frame when the queue is full
+        :param delete_after: remove the file once processed
+        :param on_result: function(path, camera, result) called in the worker after the handler
+        :param latency_window: latest latencies kept for the percentiles
+        """
+        if policy not in ('block', 'drop'):
+            raise ValueError("Unknown policy: {}".format(policy))
+        self.handler = handler
+        self.policy = policy
+        self.delete_after = delete_after
+        self.on_result = on_result
+
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=latency_window)
+
+        self.threads = [threading.Thread(target=self._loop, name='ingest-{}'.format(i), daemon=True)
+                        for i in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, path, camera='', timeout=None):
+        """
+        Queue a received file; a dropped file is left where it is, see the callers
+        :return: True if queued, False if dropped
+        """
+        with self.lock:
+            self.received += 1
+        item = (path, camera, time.monotonic())
+        try:
+            if self.policy == 'block':
+                self.pending.put(item, timeout=timeout)
+            else:
+                self.pending.put_nowait(item)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def _loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            path, camera, received = item
+            try:
+                result = self.handler(path)
+                if self.on_result is not None:
+                    self.on_result(path, camera, result)
+                with self.lock:
+                    self.processed += 1
+                    self.latencies.append(time.monotonic() - received)
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                print("Ingest error on {}: {}".format(path, e))
+            finally:
+                if self.delete_after and os.path.isfile(path):
+                    os.remove(path)
+
+    def stats(self):
+        with self.lock:
+            latencies = np.fromiter(self.latencies, dtype=np.float64, count=len(self.latencies)) * 1000
+            return {
+                'received': self.received,
+                'processed': self.processed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'queued': self.pending.qsize(),
+                'latency_p50_ms': float(np.percentile(latencies, 50)) if latencies.size else float('nan'),
+                'latency_p95_ms': float(np.percentile(latencies, 95)) if latencies.size else float('nan'),
+            }
+
+    def close(self):
+        """
+        Process what is queued and stop the workers
+        :return:
+        """
+        for _ in self.threads:
+            self.pending.put(None)
+        for t in self.threads:
+            t.join()
+
+
+class ExtractionHandler:
+    """
+    Default handler: radiometric JPEG -> RawFrame (temperatures stay lazy)
+    """
+
+    def __init__(self, exiftool_path='exiftool'):
+        self.exiftool_path = exiftool_path
+        self.local = threading.local()
+
+    def __call__(self, path):
+        fie = getattr(self.local, 'fie', None)
+        if fie is None:
+            from flir_image_extractor import FlirImageExtractor
+            fie = self.local.fie = FlirImageExtractor(exiftool_path=self.exiftool_path)
+        fie.process_image(path)
+        return fie.get_raw_frame()
+
+
+def _camera_of(root, path):
+    rel = os.path.relpath(path, root)
+    parts = rel.split(os.sep)
+    return parts[0] if len(parts) > 1 else ''
+
+
+class DirectoryWatcher:
+    """
+    Hand every new file of a folder tree to the pool once its size stops changing
+    """
+
+    def __init__(self, root, pool, interval=0.5, suffixes=('.jpg', '.jpeg')):
+        self.root = root
+        self.pool = pool
+        self.interval = interval
+        self.suffixes = suffixes
+        self.sizes = {}
+        self.seen = set()
+        self.running = False
+        self.thread = None
+        os.makedirs(root, exist_ok=True)
+
+    def scan(self):
+        """
+        One pass over the tree
+        :return: number of files submitted
+        """
+        submitted = 0
+        current = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.lower().endswith(self.suffixes):
+                    continue
+                path = os.path.join(dirpath, name)
+                if path in self.seen:
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                # still being written if the size changed since the last scan; a file
+                # dropped by a full pool is not marked seen and is retried on the next scan
+                stable = size > 0 and self.sizes.get(path) == size
+                if stable and self.pool.submit(path, _camera_of(self.root, path)):
+                    self.seen.add(path)
+                    submitted += 1
+                else:
+                    current[path] = size
+        self.sizes = current
+        # forget deleted files so a new upload with the same name is picked up
+        self.seen = {p for p in self.seen if os.path.exists(p)}
+        return submitted
+
+    def _loop(self):
+        while self.running:
+            self.scan()
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name='ingest-watcher', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+
+def make_ftp_server(root, pool, host='0.0.0.0', port=21, users=None):
+    """
+    Embedded FTP server that submits every completed upload (requires pyftpdlib)
+    :param users: {user: password}, each user gets root/<user> as home; anonymous uploads if None,
+                  write-only, each camera in root/<camera ip>
+    :return: pyftpdlib server, run it with serve_forever()
+    """
+    try:
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+    except ImportError:
+        raise ImportError("The FTP receiver needs pyftpdlib (pip install pyftpdlib), "
+                          "or use DirectoryWatcher behind another FTP server")
+
+    authorizer = DummyAuthorizer()
+    if users:
+        for user, password in users.items():
+            home = os.path.join(root, user)
+            os.makedirs(home, exist_ok=True)
+            authorizer.add_user(user, password, home, perm='elwadfmw')
+    else:
+        os.makedirs(root, exist_ok=True)
+        # store only: no listing, download, rename or delete for anonymous cameras
+        authorizer.add_anonymous(root, perm='ew')
+    sequence = itertools.count()
+
+    class IngestFTPHandler(FTPHandler):
+
+        def handle_auth_success(self, home, password, msg_login):
+            if self.username == 'anonymous':
+                # one folder per camera, uploads of the same name from two cameras do not collide
+                home = os.path.join(root, self.remote_ip.replace(':', '_'))
+                os.makedirs(home, exist_ok=True)
+            super().handle_auth_success(home, password, msg_login)
+
+        def on_file_received(self, file):
+            # a unique name, so the next upload of the same name does not overwrite a queued file
+            folder, name = os.path.split(file)
+            unique = os.path.join(folder, '{}_{:06d}_{}'.format(time.time_ns(), next(sequence), name))
+            os.replace(file, unique)
+            # ThreadedFTPServer: blocking here only holds back this camera's connection
+            camera = self.username if self.username and self.username != 'anonymous' else self.remote_ip
+            if not pool.submit(unique, camera) and pool.delete_after and os.path.isfile(unique):
+                os.remove(unique)
+
+        def on_incomplete_file_received(self, file):
+            if os.path.isfile(file):
+                os.remove(file)
+
+    IngestFTPHandler.authorizer = authorizer
+    IngestFTPHandler.banner = 'AX8 ingest ready'
+    return ThreadedFTPServer((host, port), IngestFTPHandler)
+
+
+def upload(files, host='127.0.0.1', port=21, user='anonymous', password=''):
+    """
+    Push files like the camera does, with the standard library FTP client
+    :return: seconds spent
+    """
+    start = time.perf_counter()
+    ftp = ftplib.FTP()
+    ftp.connect(host, port)
+    ftp.login(user, password)
+    for i, filename in enumerate(files):
+        with open(filename, 'rb') as fh:
+            ftp.storbinary('STOR {:06d}_{}'.format(i, os.path.basename(filename)), fh)
+    ftp.quit()
+    return time.perf_counter() - start
+
+
+def print_result(path, camera, result):
+    temps = result.temperatures if hasattr(result, 'temperatures') else result
+    print("[{}] {}: max {:.2f} °C".format(camera or '-', os.path.basename(path), float(np.nanmax(temps))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Receive the AX8 FTP uploads and run the extraction on them')
+    parser.add_argument('--root', type=str, default='incoming', help='Folder receiving the uploads')
+    parser.add_argument('--ftp', type=int, default=None, help='Run the embedded FTP server on this port')
+    parser.add_argument('--watch', action='store_true', help='Watch --root instead of running an FTP server')
+    parser.add_argument('--user', type=str, nargs=2, action='append', metavar=('USER', 'PASSWORD'),
+                        help='FTP account, one per camera (anonymous if none)')
+    parser.add_argument('--workers', type=int, default=4, help='Extraction threads')
+    parser.add_argument('--queue', type=int, default=16, help='Frames waiting before backpressure')
+    parser.add_argument('--policy', type=str, default='block', choices=['block', 'drop'], help='When the queue is full')
+    parser.add_argument('--keep', action='store_true', help='Keep the files after processing')
+    parser.add_argument('--exiftool', type=str, default='exiftool', help='Path to exiftool executable')
+    parser.add_argument('--upload', type=str, nargs='+', help='Client mode: upload these files')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Client mode: server address')
+    parser.add_argument('--port', type=int, default=21, help='Client mode: server port')
+    args = parser.parse_args()
+
+    if args.upload:
+        user, password = args.user[0] if args.user else ('anonymous', '')
+        elapsed = upload(args.upload, args.host, args.port, user, password)
+        print("{} files uploaded in {:.2f} s".format(len(args.upload), elapsed))
+    else:
+        pool = IngestPool(ExtractionHandler(args.exiftool), workers=args.workers, queue_size=args.queue,
+                          policy=args.policy, delete_after=not args.keep, on_result=print_result)
+        try:
+            if args.watch:
+                watcher = DirectoryWatcher(args.root, pool).start()
+                print("Watching {}".format(args.root))
+                while True:
+                    time.sleep(1)
+            else:
+                server = make_ftp_server(args.root, pool, port=args.ftp or 21,
+                                         users=dict(args.user) if args.user else None)
+                server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.close()
+            print(pool.stats())
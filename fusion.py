@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Time-aligned fusion of camera forehead readings with SteadyTemp patch series.
+
+PatchTimeline keeps one sorted int64 time index per patch; each camera
+reading is matched to the patch sample before/after/nearest to it with a
+binary search (np.searchsorted), for whole arrays of readings at once.
+The paired table feeds the calibration and agreement analysis.
+"""
+
+import argparse
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+CAMERA_COLUMNS = ['time', 'patchId', 'face', 'mean', 'median', 'max', 'min']
+
+
+class CameraReadingLog:
+    """
+    Append-only CSV log of the per-face statistics computed by lab.py
+    """
+
+    def __init__(self, csv_filename):
+        self.csv_filename = csv_filename
+        if not os.path.isfile(csv_filename):
+            with open(csv_filename, 'w', newline='') as fh:
+                csv.writer(fh).writerow(CAMERA_COLUMNS)
+
+    def append(self, temp_stats, timestamp=None, patch_id=''):
+        """
+        Log the stats returned by get_face_temperatures for one frame
+        :return:
+        """
+        if timestamp is None:
+            timestamp = pd.Timestamp.now(tz='UTC')
+        stamp = pd.Timestamp(timestamp)
+        if stamp.tzinfo is None:
+            stamp = stamp.tz_localize('UTC')
+
+        with open(self.csv_filename, 'a', newline='') as fh:
+            writer = csv.writer(fh)
+            for i, stats in enumerate(temp_stats):
+                writer.writerow([stamp.isoformat(), patch_id, i,
+                                 float(stats['mean']), float(stats['median']),
+                                 float(stats['max']), float(stats['min'])])
+
+
+def read_camera_log(csv_filename):
+    df = pd.read_csv(csv_filename, dtype={'patchId': 'category'})
+    df['time'] = pd.to_datetime(df['time'], utc=True, format='ISO8601')
+    return df
+
+
+def _to_ns(times):
+    times = pd.to_datetime(pd.Series(times), utc=True)
+    return times.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+class PatchTimeline:
+
+    def __init__(self):
+        self.times = {}   # patchId -> sorted int64 ns
+        self.values = {}  # patchId -> float32 temperatures, same order
+
+    @classmethod
+    def from_frame(cls, df, column='temperatureProcessed', valid_only=True):
+        """
+        Build the index from export-like rows (store query, merged series or raw export)
+        :return:
+        """
+        timeline = cls()
+        if valid_only and 'valid' in df.columns:
+            df = df[df['valid']]
+
+        patch_ids = df['patchId'].astype(str).to_numpy()
+        times = _to_ns(df['time'])
+        values = df[column].to_numpy(dtype=np.float32)
+
+        for patch_id in np.unique(patch_ids):
+            sel = patch_ids == patch_id
+            timeline.add(patch_id, times[sel], values[sel])
+        return timeline
+
+    def add(self, patch_id, times_ns, values):
+        """
+        Add samples of one patch, keeping the index sorted and without duplicated times
+        :return:
+        """
+        times_ns = np.asarray(times_ns, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        if patch_id in self.times:
+            times_ns = np.concatenate((self.times[patch_id], times_ns))
+            values = np.concatenate((self.values[patch_id], values))
+
+        order = np.argsort(times_ns, kind='stable')
+        times_ns, values = times_ns[order], values[order]
+        keep = np.concatenate(([True], np.diff(times_ns) != 0))
+        self.times[patch_id] = times_ns[keep]
+        self.values[patch_id] = values[keep]
+
+    def lookup(self, patch_id, times, direction='nearest', tolerance=None):
+        """
+        As-of lookup of many times on one patch
+        :param direction: 'backward' (last sample at or before), 'forward' or 'nearest'
+        :param tolerance: maximum distance, a pd.Timedelta or anything it accepts
+        :return: (matched values, matched sample times in ns, index into the patch series or -1)
+        """
+        query = times if isinstance(times, np.ndarray) and times.dtype == np.int64 else _to_ns(times)
+        index = self.times.get(patch_id)
+        n = 0 if index is None else index.size
+
+        matched = np.full(query.size, -1, dtype=np.int64)
+        if n:
+            right = np.searchsorted(index, query, side='right')
+            before = right - 1
+            after = np.searchsorted(index, query, side='left')
+
+            if direction == 'backward':
+                matched = before
+            elif direction == 'forward':
+                matched = np.where(after < n, after, -1)
+            elif direction == 'nearest':
+                before_c = np.clip(before, 0, n - 1)
+                after_c = np.clip(after, 0, n - 1)
+                d_before = np.where(before >= 0, query - index[before_c], np.iinfo(np.int64).max)
+                d_after = np.where(after < n, index[after_c] - query, np.iinfo(np.int64).max)
+                matched = np.where(d_before <= d_after, before, np.where(after < n, after, -1))
+            else:
+                raise ValueError("Unknown direction: {}".format(direction))
+
+            if tolerance is not None:
+                tol = pd.Timedelta(tolerance).value
+                ok = matched >= 0
+                dist = np.abs(index[np.clip(matched, 0, n - 1)] - query)
+                matched = np.where(ok & (dist <= tol), matched, -1)
+
+        found = matched >= 0
+        values = np.full(query.size, np.nan, dtype=np.float32)
+        sample_times = np.zeros(query.size, dtype=np.int64)
+        if n:
+            values[found] = self.values[patch_id][matched[found]]
+            sample_times[found] = index[matched[found]]
+        return values, sample_times, matched
+
+
+def join_camera_with_patch(camera, timeline, patch_id=None, value_column='median', direction='nearest',
+                           tolerance='5min'):
+    """
+    As-of join of camera readings with the patch series
+    :param camera: DataFrame with `time`, the camera temperature column and `patchId`
+                   (or pass patch_id to pair every reading with the same patch)
+    :return: paired DataFrame with camera and patch temperatures and the time offset;
+             readings without a patch sample inside the tolerance are dropped
+    """
+    camera = camera.reset_index(drop=True)
+    if patch_id is not None:
+        patch_ids = np.full(len(camera), patch_id, dtype=object)
+    else:
+        patch_ids = camera['patchId'].astype(str).to_numpy()
+    times = _to_ns(camera['time'])
+
+    patch_values = np.full(len(camera), np.nan, dtype=np.float32)
+    patch_times = np.zeros(len(camera), dtype=np.int64)
+    for pid in pd.unique(patch_ids):
+        sel = np.nonzero(patch_ids == pid)[0]
+        values, sample_times, _ = timeline.lookup(pid, times[sel], direction=direction, tolerance=tolerance)
+        patch_values[sel] = values
+        patch_times[sel] = sample_times
+
+    paired = pd.DataFrame({
+        'time': camera['time'],
+        'patchId': pd.Categorical(patch_ids),
+        'camera': camera[value_column].to_numpy(dtype=np.float32),
+        'patch': patch_values,
+        'patch_time': pd.to_datetime(patch_times, utc=True),
+    })
+    paired['offset_s'] = (times - patch_times) / 1e9
+    return paired[np.isfinite(paired['patch'].to_numpy())].reset_index(drop=True)
+
+
+def agreement(paired):
+    """
+    Bland-Altman agreement and linear calibration (patch = slope * camera + intercept)
+    :return: dict
+    """
+    camera = paired['camera'].to_numpy(dtype=np.float64)
+    patch = paired['patch'].to_numpy(dtype=np.float64)
+    n = camera.size
+    if n < 2:
+        return {'n': n}
+
+    diff = camera - patch
+    bias = diff.mean()
+    sd = diff.std(ddof=1)
+    slope, intercept = np.polyfit(camera, patch, 1)
+    return {
+        'n': n,
+        'bias': float(bias),
+        'sd': float(sd),
+        'loa_low': float(bias - 1.96 * sd),
+        'loa_high': float(bias + 1.96 * sd),
+        'mae': float(np.abs(diff).mean()),
+        'r': float(np.corrcoef(camera, patch)[0, 1]),
+        'slope': float(slope),
+        'intercept': float(intercept),
+    }
+
+
+if __name__ == '__main__':
+    from steadytemp_store import read_export
+
+    parser = argparse.ArgumentParser(description='Pair camera readings with SteadyTemp patch samples')
+    parser.add_argument('-c', '--camera', type=str, required=True, help='Camera readings CSV (see CameraReadingLog)')
+    parser.add_argument('-p', '--patch', type=str, nargs='+', required=True, help='SteadyTemp exports')
+    parser.add_argument('--patch-id', type=str, help='Pair every camera reading with this patch')
+    parser.add_argument('--tolerance', type=str, default='5min', help='Maximum time offset of a pair')
+    parser.add_argument('--direction', type=str, default='nearest', choices=['backward', 'forward', 'nearest'])
+    parser.add_argument('-o', '--output', type=str, help='Write the paired dataset to this CSV')
+    args = parser.parse_args()
+
+    timeline = PatchTimeline.from_frame(pd.concat([read_export(f) for f in args.patch], ignore_index=True))
+    paired = join_camera_with_patch(read_camera_log(args.camera), timeline, patch_id=args.patch_id,
+                                    direction=args.direction, tolerance=args.tolerance)
+    if args.output:
+        paired.to_csv(args.output, index=False)
+
+    for key, value in agreement(paired).items():
+        print("{:<10} {}".format(key, value))
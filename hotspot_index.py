@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hotspot index of a thermal frame: min/max/mean per tile.
+
+The tiles are built in one vectorized pass over the pixels (a reshape to
+tile bands and three reductions). Queries then touch tiles instead of
+pixels:
+
+    max_in_region    exact maximum of a box: the tiles it fully covers plus
+                     the pixels of its partial border tiles
+    hotspots         top-k connected blobs of skin-temperature tiles, with their
+                     hottest pixel; no face detection needed
+    visual_regions   the same blobs as visual-image boxes (registration.py), to
+                     tell the face detector where to look
+
+With --hotspots, lab.run uses the index to narrow the Haar detection to
+the warm regions, and shows the hottest blobs when no face is found
+(masks, glasses, profile views). Those are not forehead readings: they
+only reach the screening decisions with --hotspot-screening.
+"""
+
+import argparse
+
+import numpy as np
+
+# apparent skin temperature range of the AX8 at screening distance, °C
+SKIN_RANGE = (30.0, 42.0)
+
+
+class HotspotIndex:
+
+    def __init__(self, thermal, tile=4):
+        """
+        :param thermal: 2D temperature map in °C
+        :param tile: side of the tiles in pixels
+        """
+        self.thermal = np.asarray(thermal)
+        self.tile = tile
+        rows, cols = self.thermal.shape
+        self.tiles_shape = (-(-rows // tile), -(-cols // tile))
+
+        # pad with the edge values so partial tiles keep their true min/max
+        tr, tc = self.tiles_shape
+        padded = self.thermal
+        if (tr * tile, tc * tile) != (rows, cols):
+            padded = np.pad(self.thermal, ((0, tr * tile - rows), (0, tc * tile - cols)), mode='edge')
+        # reduce the rows of each tile first (whole-row vector ops), then the few columns left
+        bands = padded.reshape(tr, tile, tc * tile)
+        self.tiles = {
+            'max': bands.max(axis=1).reshape(tr, tc, tile).max(axis=2),
+            'min': bands.min(axis=1).reshape(tr, tc, tile).min(axis=2),
+            'mean': bands.sum(axis=1, dtype=np.float64).reshape(tr, tc, tile).sum(axis=2) / (tile * tile),
+        }
+
+    def tile_box(self, row, col):
+        """
+        :return: (x, y, w, h) thermal pixels of a tile, clipped to the frame
+        """
+        size = self.tile
+        rows, cols = self.thermal.shape
+        x, y = col * size, row * size
+        return x, y, min(size, cols - x), min(size, rows - y)
+
+    def max_in_region(self, box, exact=True):
+        """
+        Maximum temperature in a thermal box (x, y, w, h)
+        :param exact: scan the pixels of partial tiles; otherwise return the max of all touched tiles (an upper bound)
+        :return: float, NaN for an empty box
+        """
+        rows, cols = self.thermal.shape
+        x, y, w, h = (int(v) for v in box)
+        x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + w, cols), min(y + h, rows)
+        if x1 <= x0 or y1 <= y0:
+            return float('nan')
+        t = self.tile
+        tiles = self.tiles['max']
+        if not exact:
+            return float(tiles[y0 // t:-(-y1 // t), x0 // t:-(-x1 // t)].max())
+
+        # tiles fully inside the box
+        ty0, tx0 = -(-y0 // t), -(-x0 // t)
+        ty1, tx1 = y1 // t, x1 // t
+        if y1 == rows:
+            ty1 = tiles.shape[0]
+        if x1 == cols:
+            tx1 = tiles.shape[1]
+        if ty1 <= ty0 or tx1 <= tx0:
+            return float(self.thermal[y0:y1, x0:x1].max())
+        best = tiles[ty0:ty1, tx0:tx1].max()
+        # pixel strips around them
+        iy0, iy1 = ty0 * t, min(ty1 * t, rows)
+        ix0, ix1 = tx0 * t, min(tx1 * t, cols)
+        for strip in (self.thermal[y0:iy0, x0:x1], self.thermal[iy1:y1, x0:x1],
+                      self.thermal[iy0:iy1, x0:ix0], self.thermal[iy0:iy1, ix1:x1]):
+            if strip.size:
+                best = max(best, strip.max())
+        return float(best)
+
+    def hot_tiles(self, skin_range=SKIN_RANGE):
+        """
+        :return: boolean mask of the tiles whose maximum is in the skin range
+        """
+        maxima = self.tiles['max']
+        return (maxima >= skin_range[0]) & (maxima <= skin_range[1])
+
+    def hotspots(self, k=5, skin_range=SKIN_RANGE, min_tiles=1):
+        """
+        Hottest connected blobs of skin-temperature tiles (8-connected)
+        :return: list of dicts (max, mean, pixel (x, y), box (x, y, w, h) thermal pixels, tiles), hottest first
+        """
+        from scipy import ndimage
+
+        mask = self.hot_tiles(skin_range)
+        if not mask.any():
+            return []
+        labels, n = ndimage.label(mask, structure=np.ones((3, 3), dtype=bool))
+        ids = np.arange(1, n + 1)
+        # per blob reductions over tiles, not pixels
+        sizes = ndimage.sum_labels(mask, labels, ids)
+        blob_max = ndimage.maximum(self.tiles['max'], labels, ids)
+        blob_mean = ndimage.mean(self.tiles['mean'], labels, ids)
+        hottest_tile = ndimage.maximum_position(self.tiles['max'], labels, ids)
+        extents = ndimage.find_objects(labels)
+
+        result = []
+        for i in np.argsort(-np.asarray(blob_max)):
+            if sizes[i] < min_tiles:
+                continue
+            rows, cols = extents[i]
+            x0, y0, _, _ = self.tile_box(rows.start, cols.start)
+            x1, y1, w1, h1 = self.tile_box(rows.stop - 1, cols.stop - 1)
+            # hottest pixel: scan the one tile holding it
+            tx, ty, tw, th = self.tile_box(*hottest_tile[i])
+            tile = self.thermal[ty:ty + th, tx:tx + tw]
+            py, px = np.unravel_index(np.argmax(tile), tile.shape)
+            result.append({
+                'max': float(blob_max[i]),
+                'mean': float(blob_mean[i]),
+                'pixel': (int(tx + px), int(ty + py)),
+                'box': (int(x0), int(y0), int(x1 + w1 - x0), int(y1 + h1 - y0)),
+                'tiles': int(sizes[i]),
+            })
+            if len(result) == k:
+                break
+        return result
+
+    def visual_regions(self, registration, k=5, margin=0.5, skin_range=SKIN_RANGE):
+        """
+        Hotspot boxes in visual pixels, grown by `margin` of their size on each side
+        :param registration: registration.Registration of the camera
+        :return: int32 array N x 4
+        """
+        spots = self.hotspots(k, skin_range)
+        if not spots:
+            return np.zeros((0, 4), dtype=np.int32)
+        boxes = np.array([s['box'] for s in spots], dtype=np.float64)
+        boxes[:, :2] -= boxes[:, 2:] * margin
+        boxes[:, 2:] *= 1 + 2 * margin
+        rows, cols = self.thermal.shape
+        boxes[:, :2] = np.maximum(boxes[:, :2], 0)
+        boxes[:, 2] = np.minimum(boxes[:, 2], cols - boxes[:, 0])
+        boxes[:, 3] = np.minimum(boxes[:, 3], rows - boxes[:, 1])
+        return registration.inverse_boxes(np.round(boxes).astype(int))
+
+
+def hotspot_stats(index, registration, k=5, skin_range=SKIN_RANGE):
+    """
+    lab.get_face_temperatures-like stats for the hotspots, used when no face is detected
+    :return: (visual boxes N x 4, list of stats dicts)
+    """
+    spots = index.hotspots(k, skin_range)
+    if not spots:
+        return np.zeros((0, 4), dtype=np.int32), []
+    thermal_boxes = np.array([s['box'] for s in spots], dtype=int)
+    visual_boxes = registration.inverse_boxes(thermal_boxes)
+    temp_stats = []
+    for spot, t_box, v_box in zip(spots, thermal_boxes, visual_boxes):
+        tx, ty, tw, th = t_box
+        region = index.thermal[ty:ty + th, tx:tx + tw]
+        # only the skin pixels of the blob, not the background around it
+        skin = region[(region >= skin_range[0]) & (region <= skin_range[1])]
+        temp_stats.append({
+            'max': spot['max'],
+            'min': float(skin.min()),
+            'mean': float(skin.mean()),
+            'median': float(np.median(skin)),
+            'face_roi': tuple(int(v) for v in t_box),
+            'forehead_roi': tuple(int(v) for v in t_box),
+            'face_roi_image': tuple(int(v) for v in v_box),
+            'forehead_roi_image': tuple(int(v) for v in v_box),
+            'source': 'hotspot'
+        })
+    return visual_boxes, temp_stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hotspots of a thermal map without face detection')
+    parser.add_argument('--thermal', type=str, default='thermal_map.npy', help='Temperature map (.npy)')
+    parser.add_argument('--k', type=int, default=5, help='Hotspots to report')
+    parser.add_argument('--tile', type=int, default=4, help='Tile size in pixels')
+    parser.add_argument('--skin', type=float, nargs=2, default=SKIN_RANGE, help='Skin temperature range')
+    args = parser.parse_args()
+
+    import time
+
+    thermal = np.load(args.thermal)
+    start = time.perf_counter()
+    index = HotspotIndex(thermal, tile=args.tile)
+    spots = index.hotspots(args.k, tuple(args.skin))
+    elapsed = time.perf_counter() - start
+
+    print("{}x{} map, {} tiles, indexed and queried in {:.2f} ms".format(
+        thermal.shape[1], thermal.shape[0], index.tiles['max'].size, elapsed * 1000))
+    for spot in spots:
+        print("{max:.2f} °C at {pixel}, mean {mean:.2f} °C, box {box}, {tiles} tiles".format(**spot))
@@ -9,18 +9,20 @@ Features:
 """
 # %%
 import os
+import sys
 import time
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
 import cv2
 from flir_image_extractor import FlirImageExtractor
 from flir import Flir
-from IPython.display import display, clear_output
-import tempfile
+from registration import RegistrationCache
+from tracker import ScreeningTracker, iou_matrix
+from change_gate import ChangeGate, load_preview
+from hotspot_index import HotspotIndex, hotspot_stats
+# matplotlib, IPython, pandas (fusion) are imported where they are used
 
 
-scale_factor = 8
 # %%
 # Argument Parser Setup
 def parse_args():
@@ -32,19 +34,45 @@ def parse_args():
     parser.add_argument('--exiftool', type=str, 
                        default="C:/Program Files (x86)/ExifTool/exiftool.exe",
                        help="Path to exiftool executable")
-    return parser.parse_args([])  # Empty list for notebook, use None for script
+    parser.add_argument('--patch', type=str, default='',
+                       help="SteadyTemp patchId worn by the subject, used to pair the readings")
+    parser.add_argument('--log', type=str, default=None,
+                       help="Append the forehead readings to this CSV (see fusion.py)")
+    parser.add_argument('--harvest', type=str, default=None,
+                       help="Save deduplicated forehead crops and temperatures to this dataset root")
+    parser.add_argument('--store', type=str, default='steadytemp_store',
+                       help="SteadyTemp store (see steadytemp_store.py) with the --patch readings for the harvested crops")
+    parser.add_argument('--registration', type=str, default='registration',
+                       help="Visual -> thermal registration cache (see registration.py), plain scale if empty")
+    parser.add_argument('--distance', type=float, default=1.0,
+                       help="Subject distance in meters, selects the cached registration")
+    parser.add_argument('--fever', type=float, default=37.5,
+                       help="Screening decision flagged as fever from this temperature")
+    parser.add_argument('--gate', type=float, default=0,
+                       help="Skip frames that stay within this many standard deviations of the background (e.g. 4), 0 to process all")
+    parser.add_argument('--alerts', type=str, default=None,
+                       help="Append the fever alerts of the screening decisions to this CSV (see alert_engine.py)")
+    parser.add_argument('--hotspots', type=int, default=0,
+                       help="Search faces only in this many warm blobs, shown when no face is found; 0 to search the whole image")
+    parser.add_argument('--hotspot-screening', action='store_true',
+                       help="Screen the --hotspots blobs like faces when none is found (not forehead readings)")
+    # defaults when imported (replay.py) or run in a notebook, whose sys.argv are not ours
+    if __name__ != '__main__' or 'ipykernel' in sys.modules:
+        return parser.parse_args([])
+    return parser.parse_args()
 
 args = parse_args()
 
 # %%
 class FlirThermalProcessor:
-    def __init__(self, camera_url, exiftool_path):
+    def __init__(self, camera_url, exiftool_path, registration=None, flir=None):
         self.camera_url = camera_url
         self.exiftool_path = exiftool_path
         self.fie = FlirImageExtractor(exiftool_path=exiftool_path)
+        self.registration = registration if registration is not None else RegistrationCache().get('ax8')
         
-        # Initialize FLIR camera
-        self.flir = Flir(baseURL=camera_url)
+        # Initialize FLIR camera (or any object with the same interface, e.g. replay.ReplayFlir)
+        self.flir = flir if flir is not None else Flir(baseURL=camera_url)
         self.flir.login()
         
         # Face detection model
@@ -78,40 +106,72 @@ class FlirThermalProcessor:
     
     def process_thermal_image(self, thermal_path):
         """Extract temperature data from thermal image"""
+        # Recorded thermal maps (replay.py) are plain .npy files
+        with open(thermal_path, 'rb') as fh:
+            if fh.read(6) == b'\x93NUMPY':
+                return np.load(thermal_path)
         self.fie.process_image(thermal_path)
         return self.fie.get_thermal_np()
     
-    def detect_faces(self, vis_img):
-        """Detect faces in visible image"""
+    def detect_faces(self, vis_img, regions=None):
+        """Detect faces in visible image, only inside regions (visual x, y, w, h boxes, see hotspot_index.py) if given"""
         gray = cv2.cvtColor(vis_img, cv2.COLOR_BGR2GRAY)
-        return self.face_cascade.detectMultiScale(
-            gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        if regions is None:
+            return self.face_cascade.detectMultiScale(
+                gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+
+        faces = []
+        for x, y, w, h in regions:
+            if w < 30 or h < 30:
+                continue
+            found = np.asarray(self.face_cascade.detectMultiScale(
+                gray[y:y+h, x:x+w], scaleFactor=1.1, minNeighbors=5, minSize=(30, 30)), dtype=int).reshape(-1, 4)
+            faces.extend(found + [x, y, 0, 0])
+        faces = np.asarray(faces, dtype=int).reshape(-1, 4)
+        if len(faces) > 1:
+            # overlapping regions find the same face twice
+            overlap = np.triu(iou_matrix(faces, faces), 1)
+            faces = faces[~(overlap > 0.5).any(axis=0)]
+        return faces
     
-    def get_face_temperatures(self, faces, thermal_data):
-        """Calculate temperature stats for each forehead region"""
+    def get_face_temperatures(self, faces, thermal_data, track_ids=None):
+        """Calculate temperature stats for each forehead region, faces in visible image pixels"""
+        faces = np.asarray(faces, dtype=int).reshape(-1, 4)
+        if track_ids is None:
+            track_ids = np.arange(len(faces))
+        x, y, w, h = faces.T
+        # Define forehead region (upper middle part of the face)
+        foreheads = np.stack([x + (w * 0.1).astype(int), y + (h * 0.05).astype(int),
+                              (w * 0.8).astype(int), (h * 0.2).astype(int)], axis=1)
+
+        # Map both boxes to thermal pixels in one go
+        thermal_faces = self.registration.transform_boxes(faces)
+        thermal_foreheads = self.registration.transform_boxes(foreheads)
+
         temp_stats = []
-        for (x, y, w, h) in faces:
-            # Define forehead region (upper middle part of the face)
-            fx = x + int(w * 0.1)
-            fw = int(w * 0.8)
-            fy = y + int(h * 0.05)
-            fh = int(h * 0.2)
-            
-            forehead_region = thermal_data[fy:fy+fh, fx:fx+fw]
+        for track, face, forehead, t_face, t_forehead in zip(track_ids, faces, foreheads,
+                                                              thermal_faces, thermal_foreheads):
+            tx, ty, tw, th = t_forehead
+            forehead_region = thermal_data[ty:ty+th, tx:tx+tw]
+            if forehead_region.size == 0:
+                continue
             temp_stats.append({
                 'max': np.max(forehead_region),
                 'min': np.min(forehead_region),
                 'mean': np.mean(forehead_region),
                 'median': np.median(forehead_region),
-                'face_roi': (x, y, w, h),
-                'forehead_roi': (fx, fy, fw, fh),
-                'face_roi_image': (scale_factor*x, scale_factor*y, scale_factor*w, scale_factor*h),
-                'forehead_roi_image': (scale_factor*fx, scale_factor*fy, scale_factor*fw, scale_factor*fh)
+                'track': int(track),
+                'face_roi': tuple(int(v) for v in t_face),
+                'forehead_roi': tuple(int(v) for v in t_forehead),
+                'face_roi_image': tuple(int(v) for v in face),
+                'forehead_roi_image': tuple(int(v) for v in forehead)
             })
         return temp_stats
     
     def visualize_results(self, vis_img, thermal_data, temp_stats):
         """Display results with face and forehead annotations"""
+        import matplotlib.pyplot as plt
+
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
         
         vis_display = vis_img.copy()
@@ -125,7 +185,8 @@ class FlirThermalProcessor:
             fx, fy, fw, fh = stats['forehead_roi_image']
             cv2.rectangle(vis_display, (fx, fy), (fx+fw, fy+fh), (255, 0, 0), 2)
 
-            text = f"Face {i+1}: {stats['mean']:.1f}°C"
+            label = 'Hotspot' if stats.get('source') == 'hotspot' else 'Face'
+            text = f"{label} {stats['track']}: {stats['mean']:.1f}°C"
             cv2.putText(vis_display, text, (x, y-10),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
 
@@ -150,112 +211,194 @@ class FlirThermalProcessor:
         plt.tight_layout()
         plt.show()
 
-# %%
-# Initialize processor
-processor = FlirThermalProcessor(
-    camera_url=args.camera,
-    exiftool_path=args.exiftool
-)
-
 # %%
 # Main processing loop
-try:
-    while True:
+def run(processor, tracker, camera_log=None, harvester=None, patch_id='', interval=2.0,
+        max_frames=None, show=True, gate=None, hotspots=0, alerts=None, screen_hotspots=False):
+    """Capture, measure and display until interrupted or max_frames frames are processed"""
+    frames = 0
+    hotspot_tracks = set()
+    while max_frames is None or frames < max_frames:
         start_time = time.time()
         
         # Capture and process images
         vis_img, thermal_path = processor.capture_images()
-        thermal_data = processor.process_thermal_image(thermal_path)
 
-        faces = processor.detect_faces(vis_img)
-        
-        # Get temperatures if faces found
-        temp_stats = processor.get_face_temperatures((faces/scale_factor).astype(int), thermal_data) if len(faces) > 0 else []
-        
-        # Visualize results
-        processor.visualize_results(vis_img, thermal_data, temp_stats)
+        # Static scene (see change_gate.py): no extraction, detection or rendering
+        changed = gate is None or gate.check(vis_img, load_preview(thermal_path))
+        if changed:
+            process_start = time.perf_counter()
+            thermal_data = processor.process_thermal_image(thermal_path)
+            if gate is not None:
+                # keeps the gate open while someone skin-warm is in view
+                gate.record_temperatures(thermal_data)
+
+            # Look for faces only around the warm blobs of the thermal frame
+            index = HotspotIndex(thermal_data) if hotspots else None
+            regions = index.visual_regions(processor.registration, k=hotspots) if index is not None else None
+            faces = np.asarray(processor.detect_faces(vis_img, regions), dtype=int).reshape(-1, 4)
+            
+            # Follow people across frames, measure only the ones not screened yet
+            spots = []
+            if len(faces) or index is None or not screen_hotspots:
+                track_ids, pending = tracker.update(faces)
+                temp_stats = processor.get_face_temperatures(faces[pending], thermal_data, track_ids[pending]) if pending.any() else []
+                if show and index is not None and not len(faces):
+                    # not forehead readings: shown only, kept out of the decisions, logs and alerts
+                    spots = [dict(stats, track=-1) for stats in hotspot_stats(index, processor.registration, k=hotspots)[1]]
+            else:
+                # No face found (mask, glasses, profile): measure the hottest skin-temperature blobs
+                boxes, spot_stats = hotspot_stats(index, processor.registration, k=hotspots)
+                track_ids, pending = tracker.update(boxes)
+                temp_stats = [dict(stats, track=int(track)) for stats, track, measure
+                              in zip(spot_stats, track_ids, pending) if measure]
+                hotspot_tracks.update(s['track'] for s in temp_stats)
+            decisions = tracker.record_stats(temp_stats)
+            for decision in decisions:
+                status = 'FEVER' if decision['fever'] else ('ok' if decision['converged'] else 'inconclusive')
+                source = ' hotspot' if decision['track'] in hotspot_tracks else ''
+                print(f"Person {decision['track']}{source}: {decision['temperature']:.2f}°C ({status})")
+            if alerts is not None and decisions:
+                alerts.update([f"{'hotspot' if d['track'] in hotspot_tracks else 'camera'}:{d['track']}" for d in decisions],
+                              [d['temperature'] for d in decisions], decisions[0]['time'])
+            if camera_log is not None and temp_stats:
+                camera_log.append(temp_stats, patch_id=patch_id)
+            faces_stats = [s for s in temp_stats if s.get('source') != 'hotspot']
+            if harvester is not None and faces_stats:
+                harvester.submit_stats(vis_img, faces_stats)
+            
+            # Visualize results
+            if show:
+                processor.visualize_results(vis_img, thermal_data, temp_stats + spots)
+            if gate is not None:
+                gate.record_processing(time.perf_counter() - process_start)
         
         # Clean up
         os.remove(thermal_path)
         os.remove(thermal_path.replace('thermal_', 'vis_'))
         
+        frames += 1
+
         # Wait for next capture
         #elapsed = time.time() - start_time
-        #sleep_time = max(0, args.interval - elapsed)
+        #sleep_time = max(0, interval - elapsed)
         #time.sleep(sleep_time)
-        time.sleep(2)
-        clear_output(wait=True)
+        if interval > 0:
+            time.sleep(interval)
+        if show and changed:
+            from IPython.display import clear_output
+            clear_output(wait=True)
+    return frames
 
-except KeyboardInterrupt:
-    print("Processing stopped by user")
-except Exception as e:
-    print(f"Error: {str(e)}")
 
+# %%
+# Initialize processor
+if __name__ == '__main__':
+    from fusion import CameraReadingLog
+    from roi_harvester import RoiHarvester
+    from alert_engine import AlertEngine, CsvSink, ThresholdRule
+
+    processor = FlirThermalProcessor(
+        camera_url=args.camera,
+        exiftool_path=args.exiftool,
+        registration=RegistrationCache(args.registration).get('ax8', args.distance)
+    )
+    camera_log = CameraReadingLog(args.log) if args.log else None
+    harvester = None
+    if args.harvest:
+        # pair the crops with the patch readings already in the store
+        timeline = None
+        if args.patch and os.path.isdir(args.store):
+            from fusion import PatchTimeline
+            from steadytemp_store import SteadyTempStore
+            readings = SteadyTempStore(args.store).query(patch_id=args.patch,
+                                                         columns=['time', 'patchId', 'temperatureProcessed'])
+            timeline = PatchTimeline.from_frame(readings)
+        harvester = RoiHarvester(args.harvest, timeline=timeline, patch_id=args.patch or None)
+    tracker = ScreeningTracker(fever_threshold=args.fever)
+    gate = ChangeGate(sigma=args.gate) if args.gate > 0 else None
+    alerts = AlertEngine([ThresholdRule('fever', args.fever)], sinks=[CsvSink(args.alerts)]) if args.alerts else None
+
+    try:
+        run(processor, tracker, camera_log, harvester, patch_id=args.patch, interval=args.interval, gate=gate,
+            hotspots=args.hotspots, alerts=alerts, screen_hotspots=args.hotspot_screening)
+    except KeyboardInterrupt:
+        print("Processing stopped by user")
+    except Exception as e:
+        print(f"Error: {str(e)}")
+    finally:
+        if harvester is not None:
+            harvester.close()
+        if gate is not None:
+            print(gate.summary())
 
 
-import cv2
-import numpy as np
-import matplotlib.pyplot as plt
-
-# Load RGB image
-image_path = 'image.jpg'
-img_bgr = cv2.imread(image_path)
-img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-
-# Load corresponding thermal map
-thermal_path = 'thermal_map.npy'
-thermal = np.load(thermal_path) 
-
-# Face detection
-gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
-
-# Copy for drawing
-rgb_vis = img_rgb.copy()
-thermal_vis = cv2.normalize(thermal, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-thermal_vis_color = cv2.applyColorMap(thermal_vis, cv2.COLORMAP_PLASMA)
-
-# Process first detected face
-for (x, y, w, h) in faces[:1]:
-
-    # Forehead
-    fy = y + int(h * 0.05)
-    fh = int(h * 0.2)
-    fx = x + int(w * 0.1)
-    fw = int(w * 0.8)
-
-    # ROI: 1/8 of forehead
-    roi_w = fw // 8
-    roi_h = fh // 8
-    roi_x = fx // 8
-    roi_y = fy // 8
-
-    # Draw rectangles on RGB image
-    cv2.rectangle(rgb_vis, (x, y), (x+w, y+h), (0, 255, 0), 2)         # face
-    cv2.rectangle(rgb_vis, (fx, fy), (fx+fw, fy+fh), (255, 165, 0), 2) # forehead
-
-    # Draw rectangles on thermal image
-    cv2.rectangle(thermal_vis_color, (roi_x, roi_y), (roi_x+roi_w, roi_y+roi_h), (0, 0, 255), 2)
-
-    # Compute average
-    #avg_temp = np.mean(thermal[roi_y:roi_y+roi_h, roi_x:roi_x+roi_w])
-    avg_temp = np.median(thermal[roi_y:roi_y+roi_h, roi_x:roi_x+roi_w])
-    cv2.putText(rgb_vis, f"{avg_temp:.2f}", (fx, fy+30),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 1)
-
-# Plot side-by-side
-plt.figure(figsize=(12, 6))
-
-plt.subplot(1, 2, 1)
-plt.imshow(rgb_vis)
-plt.title('RGB with Face & Forehead')
-plt.axis('off')
-
-plt.subplot(1, 2, 2)
-plt.imshow(cv2.cvtColor(thermal_vis_color, cv2.COLOR_BGR2RGB))
-plt.title('Thermal Map with ROI')
-plt.axis('off')
-
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+# %%
+# Still image: image.jpg + thermal_map.npy
+if __name__ == '__main__':
+    import cv2
+    import numpy as np
+    import matplotlib.pyplot as plt
+
+    # Load RGB image
+    image_path = 'image.jpg'
+    img_bgr = cv2.imread(image_path)
+    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+
+    # Load corresponding thermal map
+    thermal_path = 'thermal_map.npy'
+    thermal = np.load(thermal_path) 
+
+    # Visual -> thermal mapping, plain 1/8 scale until a calibration is cached
+    registration = RegistrationCache(args.registration).get('ax8', args.distance)
+
+    # Face detection
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+
+    # Copy for drawing
+    rgb_vis = img_rgb.copy()
+    thermal_vis = cv2.normalize(thermal, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    thermal_vis_color = cv2.applyColorMap(thermal_vis, cv2.COLORMAP_PLASMA)
+
+    # Process every detected face
+    for (x, y, w, h) in faces:
+
+        # Forehead
+        fy = y + int(h * 0.05)
+        fh = int(h * 0.2)
+        fx = x + int(w * 0.1)
+        fw = int(w * 0.8)
+
+        # ROI: forehead in thermal pixels
+        roi_x, roi_y, roi_w, roi_h = registration.transform_boxes([(fx, fy, fw, fh)])[0]
+
+        # Draw rectangles on RGB image
+        cv2.rectangle(rgb_vis, (x, y), (x+w, y+h), (0, 255, 0), 2)         # face
+        cv2.rectangle(rgb_vis, (fx, fy), (fx+fw, fy+fh), (255, 165, 0), 2) # forehead
+
+        # Draw rectangles on thermal image
+        cv2.rectangle(thermal_vis_color, (roi_x, roi_y), (roi_x+roi_w, roi_y+roi_h), (0, 0, 255), 2)
+
+        # Compute average
+        #avg_temp = np.mean(thermal[roi_y:roi_y+roi_h, roi_x:roi_x+roi_w])
+        avg_temp = np.median(thermal[roi_y:roi_y+roi_h, roi_x:roi_x+roi_w])
+        cv2.putText(rgb_vis, f"{avg_temp:.2f}", (fx, fy+30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 1)
+
+    # Plot side-by-side
+    plt.figure(figsize=(12, 6))
+
+    plt.subplot(1, 2, 1)
+    plt.imshow(rgb_vis)
+    plt.title('RGB with Face & Forehead')
+    plt.axis('off')
+
+    plt.subplot(1, 2, 2)
+    plt.imshow(cv2.cvtColor(thermal_vis_color, cv2.COLOR_BGR2RGB))
+    plt.title('Thermal Map with ROI')
+    plt.axis('off')
+
+    plt.tight_layout()
+    plt.show()
@@ -1,10 +1,12 @@
 import asyncio
 from bleak import BleakScanner
 from datetime import datetime
-from collections import deque
+from ble_decode import decode_temperature
 import matplotlib
 matplotlib.use('Qt5Agg')
 import matplotlib.pyplot as plt
+from decimating_plot import DecimatingPlot
+from alert_engine import AlertEngine, PrintSink, default_rules
 
 # === Configurazioni ===
 uid_to_find = "05CB993F100000"
@@ -12,26 +14,17 @@ patchId_to_find = "cma3neyd100004h6zfj8tj8e3"
 TARGET_UUID = "0000fef3-0000-1000-8000-00805f9b34fb"
 
 # === Preparazione grafico ===
+# storia completa per patch, decimata alla larghezza del grafico (decimating_plot.py)
 plt.ion()
 fig, ax = plt.subplots()
-line, = ax.plot([], [], label="Temperatura (°C)", color='red')
-ax.set_ylim(30, 45)
-ax.set_title("Temperatura in tempo reale")
 ax.set_xlabel("Orario")
-ax.set_ylabel("°C")
-ax.legend()
+plot = DecimatingPlot(ax, ylim=(30, 45))
 
-# === Buffer circolari ===
-times = deque(maxlen=100)
-temps = deque(maxlen=100)
+# === Allarmi febbre per patch (alert_engine.py) ===
+alerts = AlertEngine(default_rules(37.5), sinks=[PrintSink()])
 
 # === Decodifica temperatura da raw data ===
-def decode_temperature(data: bytes) -> float:
-    if len(data) >= 2:
-        temp_raw = int.from_bytes(data[0:2], byteorder="little", signed=True)
-        temp_celsius = (temp_raw / 100.0) - 25  # 🔧 Calibrazione basata sui tuoi dati
-        return temp_celsius
-    return None
+TEMP_OFFSET = -25  # 🔧 Calibrazione basata sui tuoi dati
 
 # === Callback su ogni dispositivo rilevato ===
 def detection_callback(device, advertisement_data):
@@ -41,12 +34,12 @@ def detection_callback(device, advertisement_data):
     # Filtro su UUID dei servizi
     if TARGET_UUID in advertisement_data.service_data:
         data = advertisement_data.service_data[TARGET_UUID]
-        temp = decode_temperature(data)
+        temp = decode_temperature(data, offset=TEMP_OFFSET)
 
         if temp is not None:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Temp: {temp:.2f}°C")
-            times.append(datetime.now())
-            temps.append(temp)
+            plot.append(device.address, datetime.now(), temp)
+            alerts.update([device.address], [temp])
 
     # Ulteriore filtro: cerca UID nei manufacturer data
     for mfg_id, mfg_data in advertisement_data.manufacturer_data.items():
@@ -64,13 +57,7 @@ async def main():
     try:
         while True:
             await asyncio.sleep(1)
-            if times and temps:
-                line.set_data(times, temps)
-                ax.set_xlim(times[0], times[-1])
-                ax.relim()
-                ax.autoscale_view()
-                plt.draw()
-                plt.pause(0.01)
+            plot.refresh()
     except KeyboardInterrupt:
         print("🛑 Interrotto.")
     finally:
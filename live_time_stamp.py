@@ -3,10 +3,11 @@ from bleak import BleakScanner, BleakClient
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 from datetime import datetime
+from decimating_plot import DecimatingPlot
 
 # === GESTIONE DATI PER IL GRAFICO ===
-timestamps = []
-temperatures = []
+# tutta la storia, decimata alla larghezza del grafico (decimating_plot.py)
+plot = None
 
 def handle_temperature(sender, data):
     print(f"📥 Dati grezzi da {sender}: {data.hex()} ({len(data)} byte)")
@@ -21,23 +22,13 @@ def handle_temperature(sender, data):
 
     print(f"🌡️ Temperatura: {temp_celsius} °C")
 
-    timestamps.append(datetime.now())
-    temperatures.append(temp_celsius)
-
-    # Mantieni gli ultimi 100 valori
-    if len(timestamps) > 100:
-        timestamps.pop(0)
-        temperatures.pop(0)
+    if plot is not None:
+        plot.append(sender, datetime.now(), temp_celsius)
 
 # === GRAFICO LIVE ===
 def animate(i):
-    ax.clear()
-    ax.plot(timestamps, temperatures, color='red')
-    ax.set_title("Temperatura Live")
-    ax.set_ylabel("°C")
-    ax.set_xlabel("Ora")
-    plt.xticks(rotation=45)
-    plt.tight_layout()
+    # aggiorna solo le linee con nuovi dati
+    plot.refresh()
 
 # === FUNZIONE PRINCIPALE ===
 async def main():
@@ -77,11 +68,16 @@ async def main():
             print("❌ Nessuna caratteristica con notify trovata.")
             return
 
+        # Grafico live, pronto prima delle notifiche
+        global plot
+        fig, ax = plt.subplots()
+        ax.set_xlabel("Ora")
+        plot = DecimatingPlot(ax, title="Temperatura Live")
+
         print(f"\n📡 Avvio monitoraggio su: {notify_char}")
         await client.start_notify(notify_char, handle_temperature)
 
         # Avvia il grafico live
-        fig, ax = plt.subplots()
         ani = animation.FuncAnimation(fig, animate, interval=1000)
         plt.show()
 
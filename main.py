@@ -2,7 +2,6 @@
 import os
 import time
 import numpy as np
-import matplotlib.pyplot as plt
 from flir_image_extractor import FlirImageExtractor  # Assuming both files are in same directory
 from flir import Flir
 
@@ -11,6 +10,7 @@ class FlirThermalProcessor:
         self.camera_url = camera_url
         self.exiftool_path = exiftool_path
         self.fie = FlirImageExtractor(exiftool_path=exiftool_path)
+        self.archive = None
         
         # Initialize FLIR camera connection
         self.flir = Flir(baseURL=camera_url)
@@ -50,6 +50,8 @@ class FlirThermalProcessor:
     
     def plot_results(self, RGB_filename, thermal_data):
         """Plot both RGB and thermal images with temperature scale"""
+        import matplotlib.pyplot as plt
+
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 6))
         
         # Plot RGB image
@@ -78,6 +80,27 @@ class FlirThermalProcessor:
         print(f"Temperature data saved to {temp_filename}")
         return temp_filename
 
+    def archive_frame(self, output_dir="output"):
+        """Append the raw frame of the last processed image to the archive in output_dir/frames (frame_archive.py)"""
+        from frame_archive import FrameArchive
+
+        raw_frame = self.fie.get_raw_frame()
+        if raw_frame is None:
+            raise ValueError("No raw frame to archive, process an image first")
+        archive_dir = os.path.join(output_dir, "frames")
+        if self.archive is None or self.archive.folder != archive_dir:
+            self.close()
+            self.archive = FrameArchive(archive_dir)
+        index = self.archive.append(raw_frame, time.time())
+        print(f"Temperature data archived as frame {index} of {archive_dir}")
+        return index
+
+    def close(self):
+        """Write the frames still buffered in the archive"""
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
 # Example usage
 if __name__ == "__main__":
     # Configuration - change these to match your setup
@@ -87,14 +110,17 @@ if __name__ == "__main__":
     # Create processor instance
     processor = FlirThermalProcessor(camera_url=CAMERA_URL, exiftool_path=EXIFTOOL_PATH)
     
-    # 1. Capture images
-    vis_img, thermal_img = processor.capture_images()
-    
-    # 2. Process thermal image to get temperature data
-    thermal_data = processor.process_images(thermal_img)
-    
-    # 3. Plot results
-    processor.plot_results(vis_img, thermal_data)
-    
-    # 4. Save temperature data
-    processor.save_temperature_data(thermal_data)
\ No newline at end of file
+    try:
+        # 1. Capture images
+        vis_img, thermal_img = processor.capture_images()
+
+        # 2. Process thermal image to get temperature data
+        thermal_data = processor.process_images(thermal_img)
+
+        # 3. Plot results
+        processor.plot_results(vis_img, thermal_data)
+
+        # 4. Save temperature data: raw counts and calibration in the frame archive
+        processor.archive_frame()
+    finally:
+        processor.close()
\ No newline at end of file
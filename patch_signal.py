@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Signal quality and smoothing for SteadyTemp patch temperatures.
+
+Everything works on whole NumPy arrays: validity is recomputed from `adc`
+(valid samples read ~49.5k, invalid ones ~16.7-16.9k), rolling medians and
+MADs use strided sliding-window views, the EMA and the device filter model
+run through scipy.signal.lfilter. StreamingSignalFilter applies the same
+steps one sample at a time for live BLE data.
+"""
+
+import argparse
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# invalid readings sit around 16.7k-16.9k counts, valid ones around 49.5k
+ADC_VALID_MIN = 33000
+
+# MAD -> standard deviation for normally distributed samples
+MAD_SCALE = 1.4826
+
+# rows handled per block by the rolling operations, bounds the temporary (block, window) arrays
+BLOCK_SIZE = 1 << 18
+
+
+def validity_from_adc(adc, adc_min=ADC_VALID_MIN):
+    """
+    Recompute the validity flag of each sample from its adc reading
+    :return: bool array
+    """
+    return np.asarray(adc) >= adc_min
+
+
+def _rolling(values, window, func):
+    """
+    Apply func(axis=-1) over a centered window, edges padded by repetition
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if window < 2 or values.size == 0:
+        return values.copy()
+
+    half = window // 2
+    padded = np.pad(values, (half, window - 1 - half), mode='edge')
+    windows = sliding_window_view(padded, window)
+
+    out = np.empty(values.size, dtype=np.float64)
+    for start in range(0, values.size, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, values.size)
+        out[start:stop] = func(windows[start:stop], axis=-1)
+    return out
+
+
+def rolling_median(values, window=5):
+    return _rolling(values, window, np.median)
+
+
+def rolling_mad(values, window=5, median=None):
+    """
+    Rolling median absolute deviation around the rolling median
+    :return:
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return values.copy()
+    if median is None:
+        median = rolling_median(values, window)
+
+    half = window // 2
+    padded = np.pad(values, (half, window - 1 - half), mode='edge')
+    windows = sliding_window_view(padded, window)
+
+    out = np.empty(values.size, dtype=np.float64)
+    for start in range(0, values.size, BLOCK_SIZE):
+        stop = min(start + BLOCK_SIZE, values.size)
+        out[start:stop] = np.median(np.abs(windows[start:stop] - median[start:stop, None]), axis=-1)
+    return out
+
+
+def ema(values, alpha=0.2, initial=None):
+    """
+    Exponential moving average y[n] = alpha * x[n] + (1 - alpha) * y[n-1]
+    :return:
+    """
+    from scipy.signal import lfilter
+
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return values.copy()
+    if initial is None:
+        initial = values[0]
+    zi = np.array([(1 - alpha) * initial])
+    out, _ = lfilter([alpha], [1.0, alpha - 1.0], values, zi=zi)
+    return out
+
+
+def hampel_outliers(values, window=7, n_sigmas=3.0, median=None, mad=None):
+    """
+    Flag samples farther than n_sigmas robust standard deviations from the rolling median
+    :return: bool array
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if median is None:
+        median = rolling_median(values, window)
+    if mad is None:
+        mad = rolling_mad(values, window, median)
+    return np.abs(values - median) > n_sigmas * MAD_SCALE * mad + 1e-9
+
+
+def detect_steps(values, window=6, threshold=0.5):
+    """
+    Find level shifts: positions where the median of the next `window` samples differs
+    from the median of the previous `window` by more than threshold (°C)
+    :return: (indices, step sizes)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.size < 2 * window:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+
+    block_medians = np.median(sliding_window_view(values, window), axis=-1)
+    # before[i] covers values[i:i+window], after[i] the following window, the step is at i + window
+    before = block_medians[:-window]
+    after = block_medians[window:]
+    diff = after - before
+    candidates = np.abs(diff) > threshold
+    if not candidates.any():
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+
+    # keep the strongest position of every run of consecutive candidates
+    idx = np.nonzero(candidates)[0]
+    run_starts = np.concatenate(([0], np.nonzero(np.diff(idx) > 1)[0] + 1))
+    run_stops = np.concatenate((run_starts[1:], [idx.size]))
+    peaks = np.array([idx[a + np.argmax(np.abs(diff[idx[a:b]]))] for a, b in zip(run_starts, run_stops)])
+    return peaks + window, diff[peaks]
+
+
+def fit_device_filter(raw, processed):
+    """
+    Least squares fit of the first order model the patch seems to use to derive
+    temperatureProcessed from temperatureRaw:
+
+        processed[n] = a * processed[n-1] + b * raw[n] + c
+
+    :return: (a, b, c)
+    """
+    raw = np.asarray(raw, dtype=np.float64)
+    processed = np.asarray(processed, dtype=np.float64)
+    design = np.column_stack((processed[:-1], raw[1:], np.ones(raw.size - 1)))
+    coeffs, _, _, _ = np.linalg.lstsq(design, processed[1:], rcond=None)
+    return tuple(float(c) for c in coeffs)
+
+
+def apply_device_filter(raw, coeffs, initial=None):
+    """
+    Run the fitted device model over a whole raw series
+    :param initial: processed value before the first raw sample, the model's steady state for it if None
+    :return: predicted processed series
+    """
+    from scipy.signal import lfilter
+
+    a, b, c = coeffs
+    raw = np.asarray(raw, dtype=np.float64)
+    if raw.size == 0:
+        return raw.copy()
+    if initial is None:
+        # steady state of the model for the first raw value
+        initial = (b * raw[0] + c) / (1 - a) if a != 1 else raw[0]
+    out, _ = lfilter([b], [1.0, -a], raw + c / b, zi=np.array([a * initial]))
+    return out
+
+
+def process_series(raw, adc=None, valid=None, median_window=5, ema_alpha=0.2, outlier_window=7,
+                   n_sigmas=3.0, step_window=6, step_threshold=0.5):
+    """
+    Run the whole pipeline over a patch series. Smoothing runs over the valid
+    samples only; outputs are aligned with the input and NaN where invalid.
+    :param raw: temperature series (temperatureRaw or temperatureProcessed)
+    :param adc: adc readings used to recompute validity
+    :param valid: validity flags, used when adc is not given
+    :return: dict of arrays: valid, median, ema, outlier, and steps (indices into the input)
+    """
+    raw = np.asarray(raw, dtype=np.float64)
+    if adc is not None:
+        valid = validity_from_adc(adc)
+    elif valid is None:
+        valid = np.isfinite(raw)
+    valid = np.asarray(valid, dtype=bool) & np.isfinite(raw)
+
+    positions = np.nonzero(valid)[0]
+    values = raw[positions]
+    if values.size == 0:
+        # no valid sample in the series, e.g. a patch off the skin for the whole window
+        return {
+            'valid': valid,
+            'median': np.full(raw.size, np.nan),
+            'ema': np.full(raw.size, np.nan),
+            'outlier': np.zeros(raw.size, dtype=bool),
+            'steps': np.array([], dtype=np.int64),
+            'step_sizes': np.array([], dtype=np.float64),
+        }
+
+    median = rolling_median(values, median_window)
+    outlier_median = median if outlier_window == median_window else rolling_median(values, outlier_window)
+    outlier = hampel_outliers(values, outlier_window, n_sigmas, median=outlier_median)
+    # outliers do not feed the EMA, they are replaced by the rolling median
+    smoothed = ema(np.where(outlier, outlier_median, values), ema_alpha)
+    step_idx, step_size = detect_steps(median, step_window, step_threshold)
+
+    def _scatter(arr, fill=np.nan):
+        out = np.full(raw.size, fill, dtype=arr.dtype if arr.dtype == bool else np.float64)
+        out[positions] = arr
+        return out
+
+    return {
+        'valid': valid,
+        'median': _scatter(median),
+        'ema': _scatter(smoothed),
+        'outlier': _scatter(outlier, fill=False),
+        'steps': positions[step_idx] if step_idx.size else step_idx,
+        'step_sizes': step_size,
+    }
+
+
+class StreamingSignalFilter:
+    """
+    Sample by sample version of process_series for live data; keeps only the last window of samples
+    """
+
+    def __init__(self, median_window=5, ema_alpha=0.2, n_sigmas=3.0, device_coeffs=None, adc_min=ADC_VALID_MIN):
+        self.median_window = median_window
+        self.ema_alpha = ema_alpha
+        self.n_sigmas = n_sigmas
+        self.device_coeffs = device_coeffs
+        self.adc_min = adc_min
+
+        self.window = deque(maxlen=median_window)
+        self.ema_value = None
+        self.device_value = None
+
+    def update(self, raw, adc=None):
+        """
+        Feed one sample
+        :return: dict with valid, median, ema, outlier and (when coefficients are given) processed
+        """
+        valid = np.isfinite(raw) and (adc is None or adc >= self.adc_min)
+        if not valid:
+            return {'valid': False, 'median': np.nan, 'ema': self.ema_value if self.ema_value is not None else np.nan,
+                    'outlier': False, 'processed': self.device_value}
+
+        # the window is trailing here, the batch version uses a centered one
+        self.window.append(float(raw))
+        buf = np.fromiter(self.window, dtype=np.float64, count=len(self.window))
+        median = float(np.median(buf))
+        mad = float(np.median(np.abs(buf - median)))
+        outlier = len(buf) >= 3 and abs(raw - median) > self.n_sigmas * MAD_SCALE * mad + 1e-9
+
+        value = median if outlier else float(raw)
+        if self.ema_value is None:
+            self.ema_value = value
+        else:
+            self.ema_value += self.ema_alpha * (value - self.ema_value)
+
+        if self.device_coeffs is not None:
+            a, b, c = self.device_coeffs
+            if self.device_value is None:
+                self.device_value = (b * raw + c) / (1 - a) if a != 1 else float(raw)
+            else:
+                self.device_value = a * self.device_value + b * raw + c
+
+        return {'valid': True, 'median': median, 'ema': self.ema_value, 'outlier': bool(outlier),
+                'processed': self.device_value}
+
+
+if __name__ == '__main__':
+    from steadytemp_store import read_export
+
+    parser = argparse.ArgumentParser(description='Signal quality report for a SteadyTemp export')
+    parser.add_argument('-i', '--input', type=str, help='CSV export', required=True)
+    parser.add_argument('--column', type=str, default='temperatureRaw', help='Column to smooth')
+    args = parser.parse_args()
+
+    df = read_export(args.input)
+    result = process_series(df[args.column].to_numpy(), adc=df['adc'].to_numpy())
+
+    agree = np.mean(result['valid'] == df['valid'].to_numpy())
+    print("adc validity agrees with the export flag on {:.1%} of the rows".format(agree))
+    print("{} outliers, {} steps".format(int(result['outlier'].sum()), len(result['steps'])))
+    for i, size in zip(result['steps'], result['step_sizes']):
+        print("  step of {:+.2f} °C at {}".format(size, df['time'].iloc[i]))
+
+    valid = df['valid'].to_numpy()
+    coeffs = fit_device_filter(df['temperatureRaw'].to_numpy()[valid], df['temperatureProcessed'].to_numpy()[valid])
+    predicted = apply_device_filter(df['temperatureRaw'].to_numpy()[valid], coeffs)
+    rmse = np.sqrt(np.mean((predicted - df['temperatureProcessed'].to_numpy()[valid]) ** 2))
+    print("device filter a={:.4f} b={:.4f} c={:.4f}, rmse {:.3f} °C".format(*coeffs, rmse))
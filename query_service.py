@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local HTTP/JSON query service over the stored temperature history.
+
+Readings of the SteadyTemp store (steadytemp_store.py, one series per
+patch) and of the camera log (fusion.CameraReadingLog, one series per
+patch the readings were taken for) are folded into rollup tiers of
+1 minute, 5 minutes and 1 hour: per bucket count, sum, min and max, in
+sorted numpy arrays per series. New data only touches the buckets from
+its first timestamp on, so the tiers are kept up to date incrementally:
+new exports are picked up from the store manifest, new camera readings
+by reading the log from the last offset.
+
+A range query is answered from the coarsest tier whose bucket is not
+larger than the requested step (or span / points), and re-binned to the
+step with reduceat; weeks of data are a few thousand buckets, never the
+raw rows. Responses are kept in an LRU cache keyed on the request and on
+the version of the series, so new data never serves a stale answer.
+
+    GET /series                                   series with first/last time and counts
+    GET /rollup?series=patch:<id>&start=...&end=...&points=500   (or &step=900)
+    GET /stats                                    tiers, cache hits and misses
+
+    python query_service.py --store steadytemp_store --camera camera.csv --port 8765
+"""
+
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+# bucket sizes of the rollup tiers, seconds
+TIERS = (60, 300, 3600)
+
+
+def to_seconds(times):
+    """
+    Timestamps (strings, datetimes, datetime64, pandas) -> int64 unix seconds
+    :return:
+    """
+    times = pd.to_datetime(pd.Series(times), utc=True)
+    return times.to_numpy(dtype='datetime64[ns]').view(np.int64) // 1000000000
+
+
+def _parse_time(value):
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(to_seconds([value])[0])
+
+
+def _parse_step(value):
+    # seconds, or a pandas offset like '15min'
+    if value is None or value == '':
+        return None
+    if value.isdigit():
+        return int(value)
+    return int(pd.Timedelta(value).total_seconds())
+
+
+def _combine(start, count, total, low, high):
+    """
+    Reduce (start, count, sum, min, max) rows to one row per start
+    :return: tuple of arrays sorted by start
+    """
+    if len(start) > 1 and np.any(start[1:] < start[:-1]):
+        order = np.argsort(start, kind='stable')
+        start, count, total, low, high = start[order], count[order], total[order], low[order], high[order]
+    edges = np.flatnonzero(np.r_[True, start[1:] != start[:-1]])
+    return (start[edges], np.add.reduceat(count, edges), np.add.reduceat(total, edges),
+            np.minimum.reduceat(low, edges), np.maximum.reduceat(high, edges))
+
+
+class Rollup:
+    """
+    Count, sum, min and max per `step`-second bucket of one series
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.start = np.empty(0, dtype=np.int64)
+        self.count = np.empty(0, dtype=np.int64)
+        self.total = np.empty(0, dtype=np.float64)
+        self.low = np.empty(0, dtype=np.float64)
+        self.high = np.empty(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.start)
+
+    def add(self, seconds, values):
+        """
+        Fold raw readings in; only the buckets from the first new one on are rebuilt
+        :return:
+        """
+        if not len(values):
+            return
+        buckets = seconds // self.step * self.step
+        new = _combine(buckets, np.ones(len(values), dtype=np.int64), values, values, values)
+        first = int(np.searchsorted(self.start, new[0][0]))
+        old = (self.start, self.count, self.total, self.low, self.high)
+        if first < len(self.start):
+            new = _combine(*[np.concatenate([a[first:], b]) for a, b in zip(old, new)])
+        self.start, self.count, self.total, self.low, self.high = [
+            np.concatenate([a[:first], b]) for a, b in zip(old, new)]
+
+    def range(self, start=None, end=None, step=None):
+        """
+        Buckets in [start, end), re-binned to `step` seconds if coarser than the tier
+        :return: (start, count, mean, min, max)
+        """
+        lo = 0 if start is None else int(np.searchsorted(self.start, start))
+        hi = len(self.start) if end is None else int(np.searchsorted(self.start, end))
+        rows = (self.start[lo:hi], self.count[lo:hi], self.total[lo:hi], self.low[lo:hi], self.high[lo:hi])
+        if step is not None and step > self.step and hi > lo:
+            rows = _combine(rows[0] // step * step, *rows[1:])
+        first, count, total, low, high = rows
+        return first, count, total / np.maximum(count, 1), low, high
+
+
+class RollupStore:
+    """
+    Rollup tiers of every series, with a version per series bumped on each update
+    """
+
+    def __init__(self, tiers=TIERS):
+        self.tiers = tuple(sorted(tiers))
+        self.series = {}
+        self.versions = {}
+        self.generation = 0
+        self.lock = threading.RLock()
+
+    def add(self, name, times, values):
+        """
+        Add readings of one series; times as unix seconds or anything pd.to_datetime accepts
+        :return: number of readings used
+        """
+        values = np.asarray(values, dtype=np.float64)
+        times = np.asarray(times)
+        seconds = times.astype(np.int64) if times.dtype.kind in 'iuf' else to_seconds(times)
+        keep = np.isfinite(values)
+        seconds, values = seconds[keep], values[keep]
+        if not len(values):
+            return 0
+        with self.lock:
+            tiers = self.series.get(name)
+            if tiers is None:
+                tiers = self.series[name] = [Rollup(step) for step in self.tiers]
+            for rollup in tiers:
+                rollup.add(seconds, values)
+            self.versions[name] = self.versions.get(name, 0) + 1
+            self.generation += 1
+        return len(values)
+
+    def add_frame(self, df, column, prefix, id_column='patchId'):
+        """
+        Add the rows of a store query or camera log, one series per `prefix`:<id>
+        :return: number of readings used
+        """
+        if df.empty:
+            return 0
+        seconds = to_seconds(df['time'])
+        values = df[column].to_numpy(dtype=np.float64)
+        used = 0
+        for key, idx in df.groupby(df[id_column].astype(str), sort=False, observed=True).indices.items():
+            used += self.add(prefix + ':' + key if key else prefix, seconds[idx], values[idx])
+        return used
+
+    def pick(self, step):
+        """
+        Coarsest tier whose bucket is not larger than `step` seconds (the finest if none is)
+        :return: index of the tier
+        """
+        if step is None:
+            return 0
+        return max(int(np.searchsorted(self.tiers, step, side='right')) - 1, 0)
+
+    def query(self, name, start=None, end=None, step=None, points=None):
+        """
+        Range query of one series
+        :param step: requested resolution in seconds
+        :param points: requested number of points, used for the resolution if no step
+        :return: dict with the tier used and columnar time/count/mean/min/max
+        """
+        with self.lock:
+            tiers = self.series.get(name)
+            if tiers is None:
+                raise KeyError(name)
+            if step is None and points:
+                finest = tiers[0]
+                lo = start if start is not None else (int(finest.start[0]) if len(finest) else 0)
+                hi = end if end is not None else (int(finest.start[-1]) + finest.step if len(finest) else 0)
+                step = max((hi - lo) // points, 1)
+            tier = self.pick(step)
+            # a whole number of tier buckets, so that the re-binned buckets are exact
+            step = -(-(step or 0) // self.tiers[tier]) * self.tiers[tier] or self.tiers[tier]
+            first, count, mean, low, high = tiers[tier].range(start, end, step)
+
+        times = np.char.add(np.datetime_as_string(first.astype('datetime64[s]'), unit='s'), 'Z')
+        return {
+            'series': name,
+            'tier': self.tiers[tier],
+            'step': step,
+            'time': times.tolist(),
+            'count': count.tolist(),
+            'mean': np.round(mean, 3).tolist(),
+            'min': np.round(low, 3).tolist(),
+            'max': np.round(high, 3).tolist(),
+        }
+
+    def describe(self):
+        """
+        :return: list of dicts, one per series, from the finest tier
+        """
+        with self.lock:
+            rows = []
+            for name, tiers in sorted(self.series.items()):
+                finest = tiers[0]
+                rows.append({
+                    'series': name,
+                    'first': pd.Timestamp(int(finest.start[0]), unit='s', tz='UTC').isoformat(),
+                    'last': pd.Timestamp(int(finest.start[-1]), unit='s', tz='UTC').isoformat(),
+                    'readings': int(finest.count.sum()),
+                    'buckets': [len(rollup) for rollup in tiers],
+                })
+            return rows
+
+
+class QueryService:
+
+    def __init__(self, store_root=None, camera_log=None, column='temperatureProcessed',
+                 camera_column='median', tiers=TIERS, cache_size=256, refresh=10.0):
+        """
+        :param store_root: SteadyTempStore root, series 'patch:<patchId>'
+        :param camera_log: CameraReadingLog CSV, series 'camera:<patchId>'
+        :param refresh: seconds between checks for new store exports and camera readings
+        """
+        self.store_root = store_root
+        self.camera_log = camera_log
+        self.column = column
+        self.camera_column = camera_column
+        self.refresh_interval = refresh
+        self.rollups = RollupStore(tiers)
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.sources = {}
+        self.camera_offset = 0
+        self.camera_header = None
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+        self._stop = threading.Event()
+
+    def _store(self):
+        from steadytemp_store import SteadyTempStore
+        return SteadyTempStore(self.store_root)
+
+    def refresh(self):
+        """
+        Fold new store exports and new camera log lines into the rollups
+        :return: number of readings added
+        """
+        added = 0
+        if self.store_root is not None and os.path.isdir(self.store_root):
+            added += self._refresh_store()
+        if self.camera_log is not None and os.path.isfile(self.camera_log):
+            added += self._refresh_camera()
+        return added
+
+    def _refresh_store(self):
+        store = self._store()
+        manifest = store._load_manifest()
+        if not self.sources and manifest:
+            # first load, one dataset scan instead of one per export
+            df = store.query(columns=['time', 'patchId', self.column])
+            self.sources = {path: entry['key'] for path, entry in manifest.items()}
+            return self.rollups.add_frame(df, self.column, 'patch')
+
+        added = 0
+        for path, entry in manifest.items():
+            if self.sources.get(path) == entry['key']:
+                continue
+            if path in self.sources:
+                # a re-converted export replaced its partitions, start over
+                self.rollups = RollupStore(self.rollups.tiers)
+                self.sources = {}
+                with self.lock:
+                    self.cache.clear()
+                self.camera_offset = 0
+                self.camera_header = None
+                return self.refresh()
+            added += self._read_source(store, path)
+            self.sources[path] = entry['key']
+        return added
+
+    def _read_source(self, store, path):
+        # the partitions written for one export share the hash prefix of its path
+        prefix = hashlib.sha1(path.encode()).hexdigest()[:12]
+        ext = '.parquet' if store.fmt == 'parquet' else '.feather'
+        added = 0
+        for filename in glob.glob(os.path.join(store.root, 'patchId=*', 'day=*', prefix + ext)):
+            patch_id = os.path.basename(os.path.dirname(os.path.dirname(filename)))[len('patchId='):]
+            if store.fmt == 'parquet':
+                import pyarrow.parquet as pq
+                df = pq.read_table(filename, columns=['time', self.column, 'valid']).to_pandas()
+            else:
+                import pyarrow.feather as feather
+                df = feather.read_feather(filename, columns=['time', self.column, 'valid'])
+            df = df[df['valid']]
+            added += self.rollups.add('patch:' + patch_id, df['time'], df[self.column])
+        return added
+
+    def _refresh_camera(self):
+        with open(self.camera_log, 'rb') as fh:
+            if self.camera_header is None:
+                self.camera_header = fh.readline()
+                self.camera_offset = fh.tell()
+            fh.seek(self.camera_offset)
+            data = fh.read()
+        # only whole lines, the logger may be writing the last one
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return 0
+        df = pd.read_csv(io.BytesIO(self.camera_header + data[:end]), dtype={'patchId': str},
+                         keep_default_na=False)
+        added = self.rollups.add_frame(df, self.camera_column, 'camera')
+        # only once the lines are in the rollups, a failed parse is retried on the next refresh
+        self.camera_offset += end
+        return added
+
+    def handle(self, path, params):
+        """
+        Answer a GET request, from the cache when the data did not change
+        :return: (status, JSON bytes)
+        """
+        rollups = self.rollups
+        name = params.get('series')
+        version = rollups.versions.get(name) if name else rollups.generation
+        key = (path, tuple(sorted(params.items())), version)
+        with self.lock:
+            body = self.cache.get(key)
+            if body is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return 200, body
+            self.misses += 1
+
+        try:
+            status, result = 200, self._answer(path, params)
+        except KeyError as e:
+            status, result = 404, {'error': 'unknown series {}'.format(e)}
+        except ValueError as e:
+            status, result = 400, {'error': str(e)}
+        body = json.dumps(result).encode('utf-8')
+        if status == 200 and path != '/stats':
+            with self.lock:
+                self.cache[key] = body
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return status, body
+
+    def _answer(self, path, params):
+        if path == '/series':
+            return self.rollups.describe()
+        if path == '/rollup':
+            if 'series' not in params:
+                raise ValueError("missing series")
+            points = params.get('points')
+            return self.rollups.query(params['series'], _parse_time(params.get('start')),
+                                      _parse_time(params.get('end')), step=_parse_step(params.get('step')),
+                                      points=int(points) if points else None)
+        if path == '/stats':
+            return self.stats()
+        raise KeyError(path)
+
+    def stats(self):
+        return {
+            'tiers': list(self.rollups.tiers),
+            'series': len(self.rollups.series),
+            'buckets': sum(len(r) for tiers in self.rollups.series.values() for r in tiers),
+            'cache': len(self.cache), 'hits': self.hits, 'misses': self.misses,
+        }
+
+    def _poll(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Refresh failed: {}".format(e))
+
+    def start(self, host='127.0.0.1', port=8765):
+        """
+        Load the history and serve in background threads
+        :return: self
+        """
+        self.refresh()
+        self.httpd = ThreadingHTTPServer((host, port), _QueryHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = self
+        threading.Thread(target=self.httpd.serve_forever, name='query-http', daemon=True).start()
+        if self.refresh_interval:
+            self.thread = threading.Thread(target=self._poll, name='query-refresh', daemon=True)
+            self.thread.start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def stop(self):
+        self._stop.set()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        status, body = self.server.service.handle(url.path.rstrip('/') or '/', params)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def synthetic_history(patches=4, days=28, period=10, seed=0):
+    """
+    SteadyTemp-like readings of several patches, one every `period` seconds
+    :return: DataFrame with time, patchId and temperatureProcessed
+    """
+    rng = np.random.default_rng(seed)
+    n = int(days * 86400 // period)
+    start = int(time.time()) // 86400 * 86400 - days * 86400
+    seconds = start + np.arange(n, dtype=np.int64) * period
+    daily = 0.4 * np.sin(2 * np.pi * (seconds % 86400) / 86400)
+    frames = []
+    for p in range(patches):
+        values = 36.6 + daily + np.cumsum(rng.normal(0, 0.002, n)) + rng.normal(0, 0.05, n)
+        frames.append(pd.DataFrame({'time': pd.to_datetime(seconds, unit='s', utc=True),
+                                    'patchId': 'patch{}'.format(p),
+                                    'temperatureProcessed': values.astype(np.float32)}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def demo(patches=4, days=28, points=500, repeat=20):
+    """
+    Time a dashboard query over the whole synthetic history
+    :return: dict of {method: milliseconds}
+    """
+    df = synthetic_history(patches, days)
+    service = QueryService()
+    begin = time.perf_counter()
+    service.rollups.add_frame(df, 'temperatureProcessed', 'patch')
+    build = time.perf_counter() - begin
+
+    params = {'series': 'patch:patch0', 'points': str(points)}
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        service.cache.clear()
+        service.handle('/rollup', params)
+    rollup = (time.perf_counter() - begin) / repeat
+
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        service.handle('/rollup', params)
+    cached = (time.perf_counter() - begin) / repeat
+
+    raw = df[df['patchId'] == 'patch0'].set_index('time')['temperatureProcessed']
+    step = '{}s'.format(days * 86400 // points)
+    begin = time.perf_counter()
+    for _ in range(max(repeat // 10, 1)):
+        raw.resample(step).agg(['count', 'mean', 'min', 'max'])
+    resample = (time.perf_counter() - begin) / max(repeat // 10, 1)
+    return {'rows': len(df), 'build': build * 1000, 'rollup': rollup * 1000,
+            'cached': cached * 1000, 'resample': resample * 1000}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP/JSON range queries over rolled-up temperature history')
+    parser.add_argument('-s', '--store', type=str, default='steadytemp_store', help='SteadyTemp store root')
+    parser.add_argument('-c', '--camera', type=str, default=None, help='Camera readings CSV (see CameraReadingLog)')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8765)
+    parser.add_argument('--refresh', type=float, default=10.0, help='Seconds between checks for new data')
+    parser.add_argument('--cache', type=int, default=256, help='Responses kept in the LRU cache')
+    parser.add_argument('--demo', type=int, default=None, metavar='DAYS',
+                        help='Time queries over DAYS of synthetic readings instead of serving')
+    args = parser.parse_args()
+
+    if args.demo:
+        result = demo(days=args.demo)
+        print("{rows} readings, rollups built in {build:.0f} ms".format(**result))
+        print("rollup query {rollup:.2f} ms, cached {cached:.3f} ms, pandas resample {resample:.1f} ms".format(
+            **result))
+    else:
+        service = QueryService(args.store, args.camera, cache_size=args.cache, refresh=args.refresh)
+        service.start(args.host, args.port)
+        print("{} series, serving on {}".format(len(service.rollups.series), service.url))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("Stopped")
+        finally:
+            service.stop()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Raw thermal frames: uint16 sensor counts plus the calibration to read them.
+
+The radiometric payload embedded in a FLIR JPEG (PNG on the AX8, TIFF on
+the Zenmuse XTR) is decoded straight into a uint16 array; the AX8 PNG
+has its bytes swapped, which is fixed with one in-place byteswap of the
+buffer. Temperatures are only computed when RawFrame.temperatures is
+read, as float32, through a 65536-entry lookup table built once per
+calibration, so a frame costs 2 bytes per pixel until it is needed in °C
+(instead of 8 for the float64 temperature map).
+"""
+
+import argparse
+import io
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+CALIBRATION_FIELDS = ('E', 'OD', 'RTemp', 'ATemp', 'IRWTemp', 'IRT', 'RH', 'PR1', 'PB', 'PF', 'PO', 'PR2')
+# same defaults as FlirImageExtractor.raw2temp
+CALIBRATION_DEFAULTS = (1, 1, 20, 20, 20, 1, 50, 21106.77, 1501, 1, -7340, 0.012545258)
+
+
+class Calibration(namedtuple('Calibration', CALIBRATION_FIELDS, defaults=CALIBRATION_DEFAULTS)):
+    """
+    raw2temp parameters; a tuple, so it can key the lookup table cache
+    """
+
+    @classmethod
+    def from_exif(cls, meta, default_distance=1.0):
+        """
+        Build from the exiftool JSON of a FLIR image
+        :return:
+        """
+        from flir_image_extractor import FlirImageExtractor
+        extract_float = FlirImageExtractor.extract_float
+
+        subject_distance = default_distance
+        if 'SubjectDistance' in meta:
+            subject_distance = extract_float(meta['SubjectDistance'])
+        return cls(E=meta['Emissivity'], OD=subject_distance,
+                   RTemp=extract_float(meta['ReflectedApparentTemperature']),
+                   ATemp=extract_float(meta['AtmosphericTemperature']),
+                   IRWTemp=extract_float(meta['IRWindowTemperature']),
+                   IRT=meta['IRWindowTransmission'],
+                   RH=extract_float(meta['RelativeHumidity']),
+                   PR1=meta['PlanckR1'], PB=meta['PlanckB'], PF=meta['PlanckF'],
+                   PO=meta['PlanckO'], PR2=meta['PlanckR2'])
+
+
+def _raw_obj_coefficients(cal):
+    """
+    raw2temp is affine in the raw counts up to the final log: raw_obj = raw * gain - offset.
+    Same formulas as FlirImageExtractor.raw2temp, evaluated once per calibration.
+    :return: (gain, offset)
+    """
+    E, OD, RTemp, ATemp, IRWTemp, IRT, RH, PR1, PB, PF, PO, PR2 = cal
+    ATA1, ATA2, ATB1, ATB2, ATX = 0.006569, 0.01262, -0.002276, -0.00667, 1.9
+
+    emiss_wind = 1 - IRT
+    refl_wind = 0
+
+    h2o = (RH / 100) * np.exp(1.5587 + 0.06939 * ATemp - 0.00027816 * ATemp ** 2 + 0.00000068455 * ATemp ** 3)
+    tau = ATX * np.exp(-np.sqrt(OD / 2) * (ATA1 + ATB1 * np.sqrt(h2o))) + (1 - ATX) * np.exp(
+        -np.sqrt(OD / 2) * (ATA2 + ATB2 * np.sqrt(h2o)))
+    tau1 = tau2 = tau
+
+    def planck(t):
+        return PR1 / (PR2 * (np.exp(PB / (t + 273.15)) - PF)) - PO
+
+    raw_refl1_attn = (1 - E) / E * planck(RTemp)
+    raw_atm1_attn = (1 - tau1) / E / tau1 * planck(ATemp)
+    raw_wind_attn = emiss_wind / E / tau1 / IRT * planck(IRWTemp)
+    raw_refl2_attn = refl_wind / E / tau1 / IRT * planck(RTemp)
+    raw_atm2_attn = (1 - tau2) / E / tau1 / IRT / tau2 * planck(ATemp)
+
+    gain = 1.0 / (E * tau1 * IRT * tau2)
+    offset = raw_atm1_attn + raw_atm2_attn + raw_wind_attn + raw_refl1_attn + raw_refl2_attn
+    return gain, offset
+
+
+def raw2temp(raw, calibration=None):
+    """
+    Vectorized FlirImageExtractor.raw2temp for any array of raw counts
+    :return: float64 array, NaN where the counts are outside the calibration domain
+    """
+    cal = calibration if calibration is not None else Calibration()
+    gain, offset = _raw_obj_coefficients(cal)
+    raw_obj = np.asarray(raw, dtype=np.float64) * gain - offset
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cal.PB / np.log(cal.PR1 / (cal.PR2 * (raw_obj + cal.PO)) + cal.PF) - 273.15
+
+
+@lru_cache(maxsize=32)
+def temperature_lut(calibration):
+    """
+    float32 temperature of every possible uint16 count for a calibration
+    :return: read-only array of 65536 values
+    """
+    lut = raw2temp(np.arange(65536, dtype=np.float64), calibration).astype(np.float32)
+    lut.flags.writeable = False
+    return lut
+
+
+def decode_raw(payload, fix_endian=True):
+    """
+    Decode an embedded PNG/TIFF thermal payload into native uint16 counts
+    :param payload: bytes of the image (exiftool -RawThermalImage -b)
+    :param fix_endian: swap the bytes of every pixel (AX8 PNGs are stored little endian)
+    :return: uint16 array
+    """
+    raw = np.array(Image.open(io.BytesIO(payload)))
+    if raw.dtype != np.uint16:
+        # big endian ('>u2') or 32-bit modes come back as a different dtype
+        raw = raw.astype(np.uint16)
+    if fix_endian:
+        raw.byteswap(inplace=True)
+    return raw
+
+
+class RawFrame:
+    """
+    uint16 counts + Calibration; temperatures computed on first access and kept as float32
+    """
+
+    def __init__(self, raw, calibration=None):
+        self.raw = np.ascontiguousarray(raw, dtype=np.uint16)
+        self.calibration = calibration if calibration is not None else Calibration()
+        self._temperatures = None
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def temperatures(self):
+        if self._temperatures is None:
+            self._temperatures = temperature_lut(self.calibration)[self.raw]
+        return self._temperatures
+
+    def drop_temperatures(self):
+        """
+        Free the materialized temperatures, keeping only the counts
+        :return:
+        """
+        self._temperatures = None
+
+    def with_calibration(self, calibration):
+        return RawFrame(self.raw, calibration)
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes + (self._temperatures.nbytes if self._temperatures is not None else 0)
+
+    def save(self, npz_filename):
+        np.savez(npz_filename, raw=self.raw, calibration=np.array(self.calibration, dtype=np.float64))
+
+    @classmethod
+    def load(cls, npz_filename):
+        data = np.load(npz_filename)
+        return cls(data['raw'], Calibration(*data['calibration'].tolist()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the raw frame decoder with the per-pixel conversion')
+    parser.add_argument('--rows', type=int, default=480, help='Rows of the synthetic frame')
+    parser.add_argument('--cols', type=int, default=640, help='Columns of the synthetic frame')
+    args = parser.parse_args()
+
+    import time
+    from flir_image_extractor import FlirImageExtractor
+
+    rng = np.random.default_rng(0)
+    counts = rng.integers(17000, 21000, (args.rows, args.cols)).astype(np.uint16)
+    buf = io.BytesIO()
+    Image.fromarray(counts.byteswap()).save(buf, format='PNG')
+    payload = buf.getvalue()
+
+    start = time.perf_counter()
+    frame = RawFrame(decode_raw(payload), Calibration())
+    temps = frame.temperatures
+    fast = time.perf_counter() - start
+
+    start = time.perf_counter()
+    old = np.array(Image.open(io.BytesIO(payload)))
+    old = np.vectorize(lambda x: (x >> 8) + ((x & 0x00ff) << 8))(old)
+    old = np.vectorize(FlirImageExtractor.raw2temp)(old)
+    slow = time.perf_counter() - start
+
+    print("raw frame: {:.4f} s, per pixel: {:.4f} s, max difference {:.5f} °C".format(
+        fast, slow, float(np.abs(temps - old).max())))
+    print("memory: {} bytes raw, {} bytes float32, {} bytes float64".format(
+        frame.raw.nbytes, temps.nbytes, old.nbytes))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Re-calibration of stored raw frames, without running exiftool again.
+
+The frame archive (frame_archive.py) and RawFrame .npz files keep the
+uint16 counts with the Calibration they were taken with. A parameter set
+(e.g. E=0.98 for skin, or the measured subject distance OD) replaces
+those fields of every frame's calibration and keeps the rest (Planck
+constants, ...) as read from the EXIF at capture:
+
+    recalibrate_archive   new archive sharing the counts, only chunks.idx is rewritten
+    recalibrate_files     new .npz files with the same counts and the new calibration
+
+For sensitivity analysis, sweep() computes min, max, mean and quantiles
+of every frame (or of a box) for every parameter set of a grid. raw2temp
+is increasing in the counts, so the order statistics of a frame are the
+temperatures of its order statistics in counts; each frame is reduced
+once to a histogram of its counts, and every parameter set is then only
+a lookup in its 65536-entry table (as rawframe.temperature_lut) plus one
+dot product for the mean, instead of converting every pixel again.
+Frames are split in jobs along archive chunks and run on all cores.
+
+    python recalibrate.py output/frames --set E=0.98 --out output/frames_e098
+    python recalibrate.py output/frames --sweep E=0.95,0.97,0.98 --sweep OD=0.5,1,2 --stats sweep.csv
+"""
+
+import argparse
+import itertools
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from frame_archive import CHUNK_DTYPE, FrameArchive
+from rawframe import CALIBRATION_FIELDS, Calibration, RawFrame, raw2temp
+
+QUANTILES = (0.5, 0.95)
+
+
+def stats_columns(quantiles=QUANTILES):
+    return ['min', 'max', 'mean'] + ['p{:02d}'.format(int(round(q * 100))) for q in quantiles]
+
+
+def parameter_grid(sweep=None, fixed=None):
+    """
+    Every combination of the swept values, each with the fixed overrides
+    :param sweep: {field: [values]}
+    :param fixed: {field: value} applied to every set
+    :return: list of {field: value}
+    """
+    sweep = dict(sweep or {})
+    fixed = dict(fixed or {})
+    for field in list(sweep) + list(fixed):
+        if field not in CALIBRATION_FIELDS:
+            raise ValueError("Unknown calibration field: {} (one of {})".format(field, ', '.join(CALIBRATION_FIELDS)))
+    names = list(sweep)
+    return [dict(fixed, **dict(zip(names, values))) for values in itertools.product(*[sweep[n] for n in names])]
+
+
+def apply(calibration, overrides):
+    """
+    :return: the calibration with the overridden fields replaced
+    """
+    return calibration._replace(**{k: float(v) for k, v in overrides.items()})
+
+
+def _luts(calibration, sets, cache):
+    # (sets, 65536) float32 tables of one stored calibration
+    key = tuple(calibration)
+    if key not in cache:
+        counts = np.arange(65536, dtype=np.float64)
+        cache[key] = np.stack([raw2temp(counts, apply(calibration, o)) for o in sets]).astype(np.float32)
+    return cache[key]
+
+
+def frame_stats(raw, luts, quantiles=QUANTILES, box=None):
+    """
+    Statistics of one frame under several calibrations, from the histogram of its counts
+    :param luts: (sets, 65536) temperature tables
+    :param box: (x0, y0, x1, y1) in raw pixels, the whole frame if None
+    :return: (sets, 3 + len(quantiles)) array of min, max, mean, quantiles
+    """
+    if box is not None:
+        x0, y0, x1, y1 = box
+        raw = raw[y0:y1, x0:x1]
+    flat = raw.ravel()
+    lo, hi = int(flat.min()), int(flat.max())
+    counts = np.bincount(flat - np.uint16(lo), minlength=hi - lo + 1)
+    table = luts[:, lo:hi + 1]
+    n = flat.size
+
+    # linear interpolation between the order statistics, like np.quantile
+    cum = np.cumsum(counts)
+    pos = np.asarray(quantiles, dtype=np.float64) * (n - 1)
+    below = np.floor(pos).astype(np.int64)
+    frac = (pos - below).astype(np.float32)
+    k0 = np.searchsorted(cum, below, side='right')
+    k1 = np.searchsorted(cum, np.minimum(below + 1, n - 1), side='right')
+
+    out = np.empty((len(luts), 3 + len(quantiles)), dtype=np.float64)
+    out[:, 0] = table[:, 0]
+    out[:, 1] = table[:, -1]
+    out[:, 2] = table @ counts.astype(np.float32) / n
+    out[:, 3:] = table[:, k0] * (1 - frac) + table[:, k1] * frac
+    return out
+
+
+def _archive_job(folder, first, stop, sets, quantiles, box):
+    archive = FrameArchive(folder, cache_chunks=1)
+    cache = {}
+    times = np.empty(stop - first)
+    stats = np.empty((stop - first, len(sets), 3 + len(quantiles)))
+    for j, i in enumerate(range(first, stop)):
+        times[j], frame = archive.frame(i)
+        stats[j] = frame_stats(frame.raw, _luts(frame.calibration, sets, cache), quantiles, box)
+    return np.arange(first, stop), times, stats
+
+
+def _files_job(filenames, sets, quantiles, box):
+    cache = {}
+    times = np.empty(len(filenames))
+    stats = np.empty((len(filenames), len(sets), 3 + len(quantiles)))
+    for j, filename in enumerate(filenames):
+        frame = RawFrame.load(filename)
+        times[j] = os.path.getmtime(filename)
+        stats[j] = frame_stats(frame.raw, _luts(frame.calibration, sets, cache), quantiles, box)
+    return filenames, times, stats
+
+
+def _archive_jobs(folder, jobs):
+    # whole chunks per job, so that no chunk is decoded twice
+    index = FrameArchive(folder).index
+    if not len(index):
+        return []
+    starts = np.flatnonzero(np.r_[True, index['chunk'][1:] != index['chunk'][:-1]])
+    bounds = starts[np.linspace(0, len(starts), min(jobs, len(starts)) + 1).astype(int)[:-1]]
+    return [(int(a), int(b)) for a, b in zip(bounds, np.r_[bounds[1:], len(index)])]
+
+
+def sweep(source, sets, quantiles=QUANTILES, box=None, workers=None):
+    """
+    Per-frame statistics for every parameter set
+    :param source: archive folder, or list of RawFrame .npz files
+    :param sets: list of overrides, see parameter_grid
+    :param workers: processes, all cores if None, in this process if 1
+    :return: DataFrame, one row per (frame, set)
+    """
+    workers = workers or os.cpu_count() or 1
+    if isinstance(source, str):
+        jobs = [(_archive_job, (source, a, b, sets, quantiles, box)) for a, b in _archive_jobs(source, 4 * workers)]
+    else:
+        files = list(source)
+        size = max(-(-len(files) // (4 * workers)), 1)
+        jobs = [(_files_job, (files[i:i + size], sets, quantiles, box)) for i in range(0, len(files), size)]
+
+    if workers == 1 or len(jobs) <= 1:
+        results = [fn(*job) for fn, job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(fn, *job) for fn, job in jobs]
+            results = [f.result() for f in futures]
+
+    columns = stats_columns(quantiles)
+    if not results:
+        return pd.DataFrame(columns=['frame', 'timestamp', 'set'] + columns)
+    frames = np.concatenate([np.asarray(r[0]) for r in results])
+    times = np.concatenate([r[1] for r in results])
+    stats = np.concatenate([r[2] for r in results])
+
+    n, k = stats.shape[:2]
+    df = pd.DataFrame(stats.reshape(n * k, -1), columns=columns)
+    df.insert(0, 'frame', np.repeat(frames, k))
+    df.insert(1, 'timestamp', np.repeat(times, k))
+    df.insert(2, 'set', np.tile(np.arange(k), n))
+    for field in sorted({f for o in sets for f in o}, key=CALIBRATION_FIELDS.index):
+        df[field] = np.tile([o.get(field, np.nan) for o in sets], n)
+    return df
+
+
+def recalibrate_archive(folder, out, overrides):
+    """
+    Copy an archive with the overrides applied to the calibration of every chunk; the counts are not decoded
+    :return: number of frames
+    """
+    if os.path.abspath(folder) == os.path.abspath(out):
+        raise ValueError("Write the recalibrated archive to another folder")
+    source = FrameArchive(folder)
+    os.makedirs(out, exist_ok=True)
+    chunks = np.array(source.chunks)
+    for i, values in enumerate(chunks['calibration']):
+        chunks['calibration'][i] = apply(Calibration(*values.tolist()), overrides)
+    shutil.copyfile(source.data_path, os.path.join(out, 'frames.bin'))
+    # index after data, like FrameArchive.flush
+    chunks.astype(CHUNK_DTYPE).tofile(os.path.join(out, 'chunks.idx'))
+    shutil.copyfile(source.frames_path, os.path.join(out, 'frames.idx'))
+    return len(source)
+
+
+def recalibrate_files(filenames, out, overrides):
+    """
+    Write each RawFrame .npz again under `out` with the overrides applied
+    :return: number of files written
+    """
+    os.makedirs(out, exist_ok=True)
+    for filename in filenames:
+        frame = RawFrame.load(filename)
+        frame.with_calibration(apply(frame.calibration, overrides)).save(
+            os.path.join(out, os.path.basename(filename)))
+    return len(filenames)
+
+
+def _parse_assignment(text, many=False):
+    field, _, values = text.partition('=')
+    if not values:
+        raise argparse.ArgumentTypeError("Expected FIELD=VALUE, got {}".format(text))
+    if many:
+        return field, [float(v) for v in values.split(',')]
+    return field, float(values)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply new calibration parameters to archived raw frames')
+    parser.add_argument('inputs', nargs='+', help='Frame archive folder, or RawFrame .npz files')
+    parser.add_argument('--set', type=_parse_assignment, action='append', default=[], metavar='FIELD=VALUE',
+                        help='Calibration override, e.g. E=0.98 or OD=1.5 (fields: {})'.format(
+                            ' '.join(CALIBRATION_FIELDS)))
+    parser.add_argument('--sweep', type=lambda s: _parse_assignment(s, many=True), action='append', default=[],
+                        metavar='FIELD=V1,V2,...', help='Values of a field to sweep, combined with the other sweeps')
+    parser.add_argument('--out', type=str, default=None, help='Write the recalibrated frames here (single set)')
+    parser.add_argument('--stats', type=str, default=None, help='Write the per-frame statistics to this CSV')
+    parser.add_argument('--box', type=int, nargs=4, default=None, metavar=('X0', 'Y0', 'X1', 'Y1'),
+                        help='Statistics of this region of the raw frame only')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Processes, all cores by default')
+    args = parser.parse_args()
+
+    archive_input = len(args.inputs) == 1 and os.path.isdir(args.inputs[0])
+    source = args.inputs[0] if archive_input else args.inputs
+    try:
+        sets = parameter_grid(dict(args.sweep), dict(args.set))
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.out:
+        if len(sets) != 1:
+            parser.error("--out needs a single parameter set, not a sweep")
+        if archive_input:
+            n = recalibrate_archive(source, args.out, sets[0])
+        else:
+            n = recalibrate_files(source, args.out, sets[0])
+        print("{} frames recalibrated with {} in {}".format(n, sets[0], args.out))
+
+    if args.stats or not args.out:
+        start = time.perf_counter()
+        df = sweep(source, sets, box=args.box, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print("{} frames x {} parameter sets in {:.2f} s".format(df['frame'].nunique(), len(sets), elapsed))
+        fields = [c for c in df.columns if c in CALIBRATION_FIELDS]
+        summary = df.groupby('set')[fields + ['mean', 'max']].mean()
+        print(summary.to_string())
+        if args.stats:
+            df.to_csv(args.stats, index=False)
+            print("Statistics written to {}".format(args.stats))
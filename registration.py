@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Visual <-> thermal registration for the AX8.
+
+The AX8 visual and IR sensors sit side by side, so a plain division by 8
+(lab.py scale_factor and fx // 8) ignores their offset and the
+parallax, which changes with subject distance. A Registration holds the
+homography visual -> thermal estimated once from calibration frames
+(a heated chessboard seen by both sensors) and the cv2.remap grids built
+from it:
+
+    registration.transform_boxes(faces)        face boxes -> thermal boxes, vectorized
+    registration.warp_thermal_to_visual(t)     one remap, no per-frame recomputation
+
+RegistrationCache stores one homography per camera and distance as .npz
+files and returns the one calibrated closest to the requested distance.
+"""
+
+import argparse
+import os
+import re
+
+import cv2
+import numpy as np
+
+AX8_VISUAL_SHAPE = (480, 640)
+AX8_THERMAL_SHAPE = (60, 80)
+
+
+class Registration:
+
+    def __init__(self, homography, visual_shape=AX8_VISUAL_SHAPE, thermal_shape=AX8_THERMAL_SHAPE):
+        """
+        :param homography: 3x3 matrix mapping visual pixel coordinates to thermal pixel coordinates
+        :param visual_shape: (rows, cols) of the visual image
+        :param thermal_shape: (rows, cols) of the thermal image
+        """
+        self.homography = np.asarray(homography, dtype=np.float64)
+        self.inverse = np.linalg.inv(self.homography)
+        self.visual_shape = tuple(visual_shape)
+        self.thermal_shape = tuple(thermal_shape)
+        self._thermal_to_visual_maps = None
+        self._visual_to_thermal_maps = None
+
+    @classmethod
+    def from_scale(cls, scale=8, visual_shape=AX8_VISUAL_SHAPE, thermal_shape=AX8_THERMAL_SHAPE):
+        """
+        The fixed division by `scale` used so far, as a registration
+        :return:
+        """
+        return cls(np.diag([1.0 / scale, 1.0 / scale, 1.0]), visual_shape, thermal_shape)
+
+    @classmethod
+    def estimate(cls, visual_points, thermal_points, visual_shape=AX8_VISUAL_SHAPE,
+                 thermal_shape=AX8_THERMAL_SHAPE, ransac_threshold=1.0):
+        """
+        Fit the homography from matched points (N x 2, N >= 4)
+        :return: (Registration, reprojection RMSE in thermal pixels)
+        """
+        visual_points = np.asarray(visual_points, dtype=np.float32).reshape(-1, 2)
+        thermal_points = np.asarray(thermal_points, dtype=np.float32).reshape(-1, 2)
+        if len(visual_points) < 4:
+            raise ValueError("At least 4 point pairs are needed, got {}".format(len(visual_points)))
+
+        homography, inliers = cv2.findHomography(visual_points, thermal_points, cv2.RANSAC, ransac_threshold)
+        if homography is None:
+            raise ValueError("Could not estimate the homography from the given points")
+
+        registration = cls(homography, visual_shape, thermal_shape)
+        mask = inliers.ravel().astype(bool)
+        projected = registration.visual_to_thermal_points(visual_points[mask])
+        rmse = float(np.sqrt(np.mean(np.sum((projected - thermal_points[mask]) ** 2, axis=1))))
+        return registration, rmse
+
+    @staticmethod
+    def _apply(matrix, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        homogeneous = points @ matrix[:, :2].T + matrix[:, 2]
+        return homogeneous[:, :2] / homogeneous[:, 2:3]
+
+    def visual_to_thermal_points(self, points):
+        return self._apply(self.homography, points)
+
+    def thermal_to_visual_points(self, points):
+        return self._apply(self.inverse, points)
+
+    @staticmethod
+    def _transform_boxes(matrix, boxes, shape):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if boxes.size == 0:
+            return np.zeros((0, 4), dtype=np.int32)
+
+        x, y, w, h = boxes.T
+        corners = np.stack([np.stack([x, y], -1), np.stack([x + w, y], -1),
+                            np.stack([x, y + h], -1), np.stack([x + w, y + h], -1)], axis=1)
+        mapped = Registration._apply(matrix, corners.reshape(-1, 2)).reshape(-1, 4, 2)
+
+        x1 = np.clip(np.floor(mapped[:, :, 0].min(axis=1)), 0, shape[1])
+        y1 = np.clip(np.floor(mapped[:, :, 1].min(axis=1)), 0, shape[0])
+        x2 = np.clip(np.ceil(mapped[:, :, 0].max(axis=1)), 0, shape[1])
+        y2 = np.clip(np.ceil(mapped[:, :, 1].max(axis=1)), 0, shape[0])
+        return np.stack([x1, y1, x2 - x1, y2 - y1], axis=1).astype(np.int32)
+
+    def transform_boxes(self, boxes):
+        """
+        Map (x, y, w, h) boxes from visual to thermal pixels, as the bounding box of the mapped corners
+        :return: int32 array N x 4, clipped to the thermal image
+        """
+        return self._transform_boxes(self.homography, boxes, self.thermal_shape)
+
+    def inverse_boxes(self, boxes):
+        """
+        Map (x, y, w, h) boxes from thermal to visual pixels
+        :return: int32 array N x 4, clipped to the visual image
+        """
+        return self._transform_boxes(self.inverse, boxes, self.visual_shape)
+
+    @staticmethod
+    def _maps(matrix, out_shape):
+        rows, cols = out_shape
+        xs, ys = np.meshgrid(np.arange(cols, dtype=np.float64), np.arange(rows, dtype=np.float64))
+        src = Registration._apply(matrix, np.stack([xs.ravel(), ys.ravel()], -1))
+        map_x = src[:, 0].reshape(rows, cols).astype(np.float32)
+        map_y = src[:, 1].reshape(rows, cols).astype(np.float32)
+        # fixed point maps make cv2.remap faster
+        return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+    def warp_thermal_to_visual(self, thermal, interpolation=cv2.INTER_LINEAR):
+        """
+        Resample a thermal frame on the visual pixel grid
+        :return: array with visual_shape, NaN-free (borders replicated)
+        """
+        if self._thermal_to_visual_maps is None:
+            # for every visual pixel, where to sample the thermal frame
+            self._thermal_to_visual_maps = self._maps(self.homography, self.visual_shape)
+        map1, map2 = self._thermal_to_visual_maps
+        src = thermal if thermal.dtype != np.float64 else thermal.astype(np.float32)
+        return cv2.remap(src, map1, map2, interpolation, borderMode=cv2.BORDER_REPLICATE)
+
+    def warp_visual_to_thermal(self, visual, interpolation=cv2.INTER_AREA):
+        """
+        Resample a visual frame on the thermal pixel grid
+        :return:
+        """
+        if self._visual_to_thermal_maps is None:
+            self._visual_to_thermal_maps = self._maps(self.inverse, self.thermal_shape)
+        map1, map2 = self._visual_to_thermal_maps
+        if interpolation == cv2.INTER_AREA:
+            interpolation = cv2.INTER_LINEAR
+        return cv2.remap(visual, map1, map2, interpolation, borderMode=cv2.BORDER_REPLICATE)
+
+    def save(self, npz_filename):
+        np.savez(npz_filename, homography=self.homography, visual_shape=self.visual_shape,
+                 thermal_shape=self.thermal_shape)
+
+    @classmethod
+    def load(cls, npz_filename):
+        data = np.load(npz_filename)
+        return cls(data['homography'], tuple(data['visual_shape']), tuple(data['thermal_shape']))
+
+
+def _canonical_order(corners):
+    # symmetric boards can be returned rotated by 180°: start from the top-left corner in both images
+    corners = corners.reshape(-1, 2)
+    if corners[0].sum() > corners[-1].sum():
+        corners = corners[::-1]
+    return corners
+
+
+def chessboard_correspondences(visual_gray, thermal, pattern=(8, 5)):
+    """
+    Find the inner corners of a heated chessboard in both images
+    :param pattern: inner corners per row and column, one of them even so the board has a single orientation
+    :return: (visual points, thermal points) or None if the board is not found in both
+    """
+    ok_v, corners_v = cv2.findChessboardCorners(visual_gray, pattern)
+    if not ok_v:
+        return None
+
+    thermal_u8 = cv2.normalize(thermal, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    # the thermal frame is tiny, corners are found more reliably on an upscaled copy
+    up = 4
+    thermal_big = cv2.resize(thermal_u8, None, fx=up, fy=up, interpolation=cv2.INTER_CUBIC)
+    ok_t, corners_t = cv2.findChessboardCorners(thermal_big, pattern)
+    if not ok_t:
+        ok_t, corners_t = cv2.findChessboardCorners(255 - thermal_big, pattern)
+    if not ok_t:
+        return None
+
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+    corners_v = cv2.cornerSubPix(visual_gray, corners_v, (5, 5), (-1, -1), criteria)
+    # pixel centres: pixel i of the upscaled image is centred on (i + 0.5) / up - 0.5 of the original
+    return _canonical_order(corners_v), (_canonical_order(corners_t) + 0.5) / up - 0.5
+
+
+class RegistrationCache:
+    """
+    One registration per camera and subject distance, stored as <camera>_<distance>m.npz
+    """
+
+    def __init__(self, cache_dir='registration'):
+        self.cache_dir = cache_dir
+        self.loaded = {}
+
+    def _filename(self, camera, distance):
+        return os.path.join(self.cache_dir, "{}_{:.2f}m.npz".format(camera, distance))
+
+    def store(self, camera, distance, registration):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        registration.save(self._filename(camera, distance))
+        self.loaded[(camera, round(distance, 2))] = registration
+
+    def distances(self, camera):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        pattern = re.compile(r'^{}_(\d+\.\d+)m\.npz$'.format(re.escape(camera)))
+        found = []
+        for name in os.listdir(self.cache_dir):
+            m = pattern.match(name)
+            if m:
+                found.append(float(m.group(1)))
+        return sorted(found)
+
+    def get(self, camera, distance=1.0, default_scale=8):
+        """
+        Return the registration calibrated closest to `distance`, or the plain scale if none is cached
+        :return:
+        """
+        distances = self.distances(camera)
+        if not distances:
+            return Registration.from_scale(default_scale)
+
+        nearest = min(distances, key=lambda d: abs(d - distance))
+        key = (camera, round(nearest, 2))
+        if key not in self.loaded:
+            self.loaded[key] = Registration.load(self._filename(camera, nearest))
+        return self.loaded[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrate the visual -> thermal registration from chessboard frames')
+    parser.add_argument('--visual', type=str, nargs='+', required=True, help='Visual calibration images')
+    parser.add_argument('--thermal', type=str, nargs='+', required=True,
+                        help='Thermal frames (.npy) matching the visual images')
+    parser.add_argument('--camera', type=str, default='ax8', help='Camera name used in the cache')
+    parser.add_argument('--distance', type=float, default=1.0, help='Subject distance of the frames (m)')
+    parser.add_argument('--pattern', type=int, nargs=2, default=[8, 5], help='Inner corners of the chessboard, one count even')
+    parser.add_argument('--cache', type=str, default='registration', help='Cache directory')
+    args = parser.parse_args()
+
+    visual_points, thermal_points = [], []
+    visual_shape = thermal_shape = None
+    for vis_filename, thermal_filename in zip(args.visual, args.thermal):
+        gray = cv2.imread(vis_filename, cv2.IMREAD_GRAYSCALE)
+        thermal = np.load(thermal_filename)
+        visual_shape, thermal_shape = gray.shape, thermal.shape
+        found = chessboard_correspondences(gray, thermal, tuple(args.pattern))
+        if found is None:
+            print("{}: chessboard not found in both images".format(vis_filename))
+            continue
+        visual_points.append(found[0])
+        thermal_points.append(found[1])
+
+    if not visual_points:
+        raise SystemExit("No usable calibration frames")
+
+    registration, rmse = Registration.estimate(np.concatenate(visual_points), np.concatenate(thermal_points),
+                                               visual_shape, thermal_shape)
+    RegistrationCache(args.cache).store(args.camera, args.distance, registration)
+    print("homography from {} frames, reprojection RMSE {:.3f} thermal px".format(len(visual_points), rmse))
+    print(registration.homography)
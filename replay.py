@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Offline replay of recorded FLIR frames, no AX8 needed.
+
+A Recording is a folder of captured frames: the vis_*.jpg / thermal_*.jpg
+pairs written by lab.py (thermal frames may be radiometric JPEGs or .npy
+temperature maps), any other radiometric *.jpg, and the still pair
+image.jpg / thermal_map.npy. Two ways to serve it:
+
+    ReplayFlir(folder)      drop-in for flir.Flir, getSnapshot() copies the next frame
+    FakeAX8Server(folder)   local HTTP server answering res.php, login/dologin,
+                            storage/download/image and storage/delete/image, so
+                            the real flir.Flir client runs end to end
+
+Both follow the visual/IR mode selected through setVisualMode/setIRMode
+and pace snapshots at `rate` per second (0 = as fast as possible).
+
+    python replay.py --folder recording --frames 100 --rate 0 [--http]
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+MODE_RESOURCE = '.image.sysimg.fusion.fusionData.useLevelSpan'
+STORE_NAME_RESOURCE = '.image.services.store.fileNameW'
+STORE_COMMIT_RESOURCE = '.image.services.store.commit'
+
+
+class Recording:
+    """
+    Visual and thermal frame lists of a folder, served in order and looped
+    """
+
+    def __init__(self, folder, loop=True):
+        self.folder = folder
+        self.loop = loop
+
+        visual = sorted(glob.glob(os.path.join(folder, 'vis_*.jpg')))
+        thermal = sorted(glob.glob(os.path.join(folder, 'thermal_*.jpg')) +
+                         glob.glob(os.path.join(folder, 'thermal_*.npy')))
+        others = sorted(f for f in glob.glob(os.path.join(folder, '*.jpg'))
+                        if f not in visual and f not in thermal and os.path.basename(f) != 'image.jpg')
+        thermal += others
+
+        still_visual = os.path.join(folder, 'image.jpg')
+        still_thermal = os.path.join(folder, 'thermal_map.npy')
+        if os.path.isfile(still_visual):
+            visual.append(still_visual)
+        if os.path.isfile(still_thermal):
+            thermal.append(still_thermal)
+
+        if not visual and not thermal:
+            raise ValueError("No recorded frames in {}".format(folder))
+        # a folder with a single kind of frame serves it in both modes
+        self.frames = {'visual': visual or thermal, 'ir': thermal or visual}
+        self.position = {'visual': 0, 'ir': 0}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return max(len(self.frames['visual']), len(self.frames['ir']))
+
+    def next(self, mode):
+        """
+        :param mode: 'visual' or 'ir'
+        :return: path of the next frame, None when the recording is over and not looping
+        """
+        with self.lock:
+            frames = self.frames[mode]
+            i = self.position[mode]
+            if i >= len(frames):
+                if not self.loop:
+                    return None
+                i = 0
+            self.position[mode] = i + 1
+            return frames[i]
+
+
+class _Pacer:
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_time is None:
+            self.next_time = now
+        delay = self.next_time - now
+        if delay > 0:
+            time.sleep(delay)
+        self.next_time = max(self.next_time, now) + self.interval
+
+
+class ReplayFlir:
+    """
+    Same interface as flir.Flir, backed by a Recording instead of the camera
+    """
+
+    def __init__(self, folder, rate=0, loop=True):
+        """
+        :param rate: snapshots per second, 0 for as fast as possible
+        """
+        self.recording = folder if isinstance(folder, Recording) else Recording(folder, loop)
+        self.pacer = _Pacer(rate)
+        self.resources = {}
+        self.mode = 'ir'
+        self.snapshots = 0
+
+    def setResource(self, resource, value):
+        self.resources[resource] = value
+        if resource == MODE_RESOURCE:
+            self.mode = 'ir' if str(value) == '1' else 'visual'
+        return '""'
+
+    def getResource(self, resource):
+        return '"{}"'.format(self.resources.get(resource, ''))
+
+    def setVisualMode(self):
+        self.setResource('.image.sysimg.fusion.fusionData.fusionMode', 1)
+        self.setResource(MODE_RESOURCE, 0)
+
+    def setIRMode(self):
+        self.setResource('.image.sysimg.fusion.fusionData.fusionMode', 1)
+        self.setResource(MODE_RESOURCE, 1)
+
+    def setMSXMode(self):
+        self.setResource('.image.sysimg.fusion.fusionData.fusionMode', 3)
+
+    def setTemperatureRange(self, minTemp, maxTemp):
+        pass
+
+    def setAutoTemperatureRange(self):
+        pass
+
+    def showOverlay(self, show=True):
+        pass
+
+    def light(self, on=True):
+        pass
+
+    def login(self):
+        pass
+
+    def getSnapshot(self, jpgfile):
+        """
+        Copy the next recorded frame of the current mode to jpgfile
+        :return:
+        """
+        self.pacer.wait()
+        source = self.recording.next(self.mode)
+        if source is None:
+            raise EOFError("Recording {} is over".format(self.recording.folder))
+        shutil.copyfile(source, jpgfile)
+        self.snapshots += 1
+
+
+class _AX8Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        return {k: v[-1] for k, v in parse_qs(body).items()}
+
+    def _reply(self, status, body=b'', content_type='text/plain'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        camera = self.server.camera
+        path = self.path.lstrip('/')
+        form = self._form()
+
+        if path == 'res.php':
+            if form.get('action') == 'set':
+                camera.set_resource(form.get('resource', ''), form.get('value', ''))
+                self._reply(200, '""')
+            else:
+                self._reply(200, camera.replay.getResource(form.get('resource', '')))
+        elif path == 'login/dologin':
+            self._reply(200, '{"success": true}', 'application/json')
+        elif path.startswith('storage/delete/image/'):
+            camera.delete(path[len('storage/delete/image/'):])
+            self._reply(200, '""')
+        else:
+            self._reply(404, 'not found')
+
+    def do_GET(self):
+        camera = self.server.camera
+        path = self.path.lstrip('/')
+        if path.startswith('storage/download/image/'):
+            data = camera.download(path[len('storage/download/image/'):])
+            if data is None:
+                self._reply(404, 'not ready')
+            else:
+                self._reply(200, data, 'image/jpeg')
+        else:
+            self._reply(404, 'not found')
+
+
+class FakeAX8Server:
+    """
+    Local HTTP stand-in for the AX8 web interface, serving a Recording
+    """
+
+    def __init__(self, folder, host='127.0.0.1', port=0, rate=0, loop=True, store_delay=0.0):
+        """
+        :param port: 0 picks a free port, see url
+        :param store_delay: seconds between the store commit and the image being downloadable
+        """
+        self.replay = ReplayFlir(folder, rate=rate, loop=loop)
+        self.store_delay = store_delay
+        self.images = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+        self.httpd = ThreadingHTTPServer((host, port), _AX8Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.camera = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-ax8', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def set_resource(self, resource, value):
+        self.replay.setResource(resource, value)
+        if resource == STORE_COMMIT_RESOURCE and value == 'true':
+            name = os.path.basename(self.replay.resources.get(STORE_NAME_RESOURCE, 'snapshot.jpg'))
+            self.replay.pacer.wait()
+            source = self.replay.recording.next(self.replay.mode)
+            if source is not None:
+                with open(source, 'rb') as fh:
+                    data = fh.read()
+                with self.lock:
+                    self.images[name] = (time.monotonic() + self.store_delay, data)
+
+    def download(self, name):
+        with self.lock:
+            entry = self.images.get(name)
+        if entry is None or time.monotonic() < entry[0]:
+            return None
+        return entry[1]
+
+    def delete(self, name):
+        with self.lock:
+            self.images.pop(name, None)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def replay_pipeline(folder, frames, rate=0, http=False, exiftool='exiftool', gate=None):
+    """
+    Run lab.run over a recording
+    :param gate: change_gate.ChangeGate skipping static frames, None to process all
+    :return: dict with frames, seconds and frames per second
+    """
+    import lab
+    from flir import Flir
+    from registration import Registration
+    from tracker import ScreeningTracker
+
+    server = FakeAX8Server(folder, rate=rate).start() if http else None
+    try:
+        flir = Flir(baseURL=server.url) if http else ReplayFlir(folder, rate=rate)
+        processor = lab.FlirThermalProcessor(camera_url=server.url if http else 'replay://' + folder,
+                                             exiftool_path=exiftool, registration=Registration.from_scale(8),
+                                             flir=flir)
+        start = time.perf_counter()
+        done = lab.run(processor, ScreeningTracker(), interval=0, max_frames=frames, show=False, gate=gate)
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.stop()
+    return {'frames': done, 'seconds': elapsed, 'fps': done / elapsed if elapsed > 0 else 0.0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded FLIR frames through the camera pipeline')
+    parser.add_argument('--folder', type=str, default='.', help='Folder with the recorded frames')
+    parser.add_argument('--frames', type=int, default=50, help='Frames to process')
+    parser.add_argument('--rate', type=float, default=0, help='Snapshots per second, 0 for as fast as possible')
+    parser.add_argument('--http', action='store_true', help='Go through flir.Flir and the fake HTTP server')
+    parser.add_argument('--exiftool', type=str, default='exiftool', help='Path to exiftool executable')
+    parser.add_argument('--gate', type=float, default=0, help='Change gate sigma (see change_gate.py), 0 to process all')
+    parser.add_argument('--serve', type=int, default=None, help='Only run the fake camera on this port')
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        server = FakeAX8Server(args.folder, host='0.0.0.0', port=args.serve, rate=args.rate).start()
+        print("Fake AX8 serving {} at {}".format(args.folder, server.url))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+    else:
+        gate = None
+        if args.gate > 0:
+            from change_gate import ChangeGate
+            gate = ChangeGate(sigma=args.gate)
+        result = replay_pipeline(args.folder, args.frames, rate=args.rate, http=args.http, exiftool=args.exiftool,
+                                 gate=gate)
+        print("{frames} frames in {seconds:.2f} s, {fps:.1f} frames/s".format(**result))
+        if gate is not None:
+            print(gate.summary())
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Cached, memory-mapped ROI dataset for training the temperature CNN.
+
+The ROIs listed in labels.csv (image_path, temperature) are decoded and
+resized once into a contiguous uint8 array on disk (images.u8, N x S x S x 3,
+RGB) with the labels alongside (labels.npy). manifest.json records size,
+mtime and sha1 of every source image, so a rebuild only decodes new or
+changed images and copies the rest from the previous cache.
+
+The DataLoader receives whole batches of indices; every worker slices the
+memory map once per batch and the augmentation runs on the batch tensor.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, SequentialSampler
+
+from temperature_cnn import INPUT_SIZE
+
+IMAGES_NAME = 'images.u8'
+LABELS_NAME = 'labels.npy'
+MANIFEST_NAME = 'manifest.json'
+
+
+def _file_sha1(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _decode(filename, size):
+    img = cv2.imread(filename, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not read image: {}".format(filename))
+    if img.shape[0] != size or img.shape[1] != size:
+        img = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def load_manifest(cache_dir):
+    path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def build_cache(labels_filename, images_dir, cache_dir, size=INPUT_SIZE):
+    """
+    Create or update the cache for a labels CSV
+    :return: (number of decoded images, number of images reused from the previous cache)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    labels = pd.read_csv(labels_filename)
+    n = len(labels)
+
+    old = load_manifest(cache_dir)
+    old_images = None
+    old_entries = {}
+    if old is not None and old['size'] == size and old['count'] > 0:
+        old_images = np.memmap(os.path.join(cache_dir, IMAGES_NAME), dtype=np.uint8, mode='r',
+                               shape=(old['count'], size, size, 3))
+        old_entries = {e['path']: e for e in old['entries']}
+
+    tmp_images = os.path.join(cache_dir, IMAGES_NAME + '.tmp')
+    images = np.memmap(tmp_images, dtype=np.uint8, mode='w+', shape=(max(n, 1), size, size, 3))
+    entries = []
+    decoded = reused = 0
+
+    for i, rel_path in enumerate(labels['image_path']):
+        path = os.path.join(images_dir, rel_path)
+        st = os.stat(path)
+        entry = {'path': rel_path, 'bytes': st.st_size, 'mtime': st.st_mtime_ns}
+
+        prev = old_entries.get(rel_path)
+        if prev is not None and prev['bytes'] == entry['bytes'] and prev['mtime'] == entry['mtime']:
+            entry['sha1'] = prev['sha1']
+        else:
+            entry['sha1'] = _file_sha1(path)
+
+        if old_images is not None and prev is not None and prev['sha1'] == entry['sha1']:
+            images[i] = old_images[prev['index']]
+            reused += 1
+        else:
+            images[i] = _decode(path, size)
+            decoded += 1
+
+        entry['index'] = i
+        entries.append(entry)
+
+    images.flush()
+    del images, old_images
+    os.replace(tmp_images, os.path.join(cache_dir, IMAGES_NAME))
+    np.save(os.path.join(cache_dir, LABELS_NAME), labels['temperature'].to_numpy(dtype=np.float32))
+
+    with open(os.path.join(cache_dir, MANIFEST_NAME), 'w') as fh:
+        json.dump({'size': size, 'count': n, 'labels': os.path.abspath(labels_filename), 'entries': entries}, fh)
+
+    return decoded, reused
+
+
+class RoiDataset(Dataset):
+    """
+    Indexed by a list of indices, returns a whole batch: (uint8 N x 3 x S x S tensor, float32 labels)
+    """
+
+    def __init__(self, cache_dir):
+        manifest = load_manifest(cache_dir)
+        if manifest is None:
+            raise ValueError("No ROI cache in {}, run build_cache first".format(cache_dir))
+
+        self.cache_dir = cache_dir
+        self.size = manifest['size']
+        self.count = manifest['count']
+        self.labels = np.load(os.path.join(cache_dir, LABELS_NAME))
+        self.images = None  # opened lazily, once per worker process
+
+    def __len__(self):
+        return self.count
+
+    def _open(self):
+        if self.images is None:
+            self.images = np.memmap(os.path.join(self.cache_dir, IMAGES_NAME), dtype=np.uint8, mode='r',
+                                    shape=(self.count, self.size, self.size, 3))
+        return self.images
+
+    def __getitem__(self, indices):
+        images = self._open()
+        if np.isscalar(indices):
+            indices = [indices]
+        indices = np.sort(np.asarray(indices, dtype=np.int64))  # sequential reads from the map
+        batch = torch.from_numpy(np.ascontiguousarray(images[indices])).permute(0, 3, 1, 2)
+        return batch, torch.from_numpy(self.labels[indices])
+
+
+def augment_batch(images, generator=None, flip=0.5, brightness=0.1, contrast=0.1, noise=0.01):
+    """
+    Augment a uint8 batch and return it as float in [0, 1], all samples at once
+    :param images: uint8 tensor N x 3 x S x S
+    :return: float32 tensor N x 3 x S x S
+    """
+    x = images.float().div_(255.0)
+    n = x.shape[0]
+
+    if flip:
+        flip_mask = torch.rand(n, generator=generator) < flip
+        x[flip_mask] = x[flip_mask].flip(-1)
+    if contrast:
+        mean = x.mean(dim=(1, 2, 3), keepdim=True)
+        factor = 1 + (torch.rand(n, 1, 1, 1, generator=generator) * 2 - 1) * contrast
+        x = (x - mean) * factor + mean
+    if brightness:
+        x = x + (torch.rand(n, 1, 1, 1, generator=generator) * 2 - 1) * brightness
+    if noise:
+        x = x + torch.randn(x.shape, generator=generator) * noise
+    return x.clamp_(0.0, 1.0)
+
+
+class AugmentingCollate:
+    """
+    collate_fn for RoiDataset batches; picklable so it works with worker processes
+    """
+
+    def __init__(self, augment=True):
+        self.augment = augment
+
+    def __call__(self, batch):
+        images, labels = batch
+        if self.augment:
+            return augment_batch(images), labels
+        return images.float().div_(255.0), labels
+
+
+def make_loader(cache_dir, batch_size=64, shuffle=True, augment=True, num_workers=2, drop_last=False):
+    """
+    DataLoader over the cache, one dataset call per batch
+    :return:
+    """
+    dataset = RoiDataset(cache_dir)
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last), batch_size=None,
+                      num_workers=num_workers, collate_fn=AugmentingCollate(augment),
+                      persistent_workers=num_workers > 0, pin_memory=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the memory-mapped ROI cache and time an epoch')
+    parser.add_argument('-l', '--labels', type=str, default='labels.csv', help='CSV with image_path,temperature')
+    parser.add_argument('-d', '--images', type=str, default='roi_images', help='Folder of the ROI images')
+    parser.add_argument('-c', '--cache', type=str, default='roi_cache', help='Cache directory')
+    parser.add_argument('-s', '--size', type=int, default=INPUT_SIZE, help='Side of the cached ROIs')
+    parser.add_argument('-b', '--batch', type=int, default=64, help='Batch size')
+    parser.add_argument('-w', '--workers', type=int, default=2, help='DataLoader workers')
+    parser.add_argument('--epochs', type=int, default=3, help='Epochs to time')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    decoded, reused = build_cache(args.labels, args.images, args.cache, size=args.size)
+    print("cache built in {:.2f} s: {} decoded, {} reused".format(time.perf_counter() - start, decoded, reused))
+
+    loader = make_loader(args.cache, batch_size=args.batch, num_workers=args.workers)
+    for epoch in range(args.epochs):
+        start = time.perf_counter()
+        seen = sum(images.shape[0] for images, _ in loader)
+        print("epoch {}: {} ROIs in {:.3f} s".format(epoch, seen, time.perf_counter() - start))
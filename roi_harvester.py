@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Harvest forehead ROIs from the thermal pipeline into the training set.
+
+Every forehead box found by lab.py is cropped from the visual image and
+handed to a background writer together with its radiometric median
+temperature (and, when a patch timeline is given, the SteadyTemp reading
+closest in time). The writer skips near-duplicates using a 64-bit
+difference hash index and appends the rest to size-limited shards:
+
+    root/shard-00000/roi-000000.jpg ...
+    root/shard-00000/labels.csv        image_path,temperature,patch_temperature,time,dhash
+
+Each shard's labels.csv has the same layout as the hand-made labels.csv,
+so roi_dataset.build_cache can use a shard directly; the dhash column lets
+a restart rebuild the duplicate index without decoding the images.
+submit() never blocks: when the writer falls behind, ROIs are dropped and
+counted.
+"""
+
+import argparse
+import csv
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+ROI_SIZE = 128
+LABEL_COLUMNS = ['image_path', 'temperature', 'patch_temperature', 'time', 'dhash']
+
+
+def dhash(image, hash_size=8):
+    """
+    Difference hash of an image as a 64-bit integer
+    :return: np.uint64
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return np.packbits(bits).view('>u8')[0].astype(np.uint64)
+
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount(values):
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+class HashIndex:
+    """
+    Growable array of 64-bit perceptual hashes with a vectorized Hamming-distance lookup
+    """
+
+    def __init__(self, capacity=1024):
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.count = 0
+
+    def add(self, h):
+        if self.count == self.hashes.size:
+            self.hashes = np.concatenate((self.hashes, np.zeros_like(self.hashes)))
+        self.hashes[self.count] = h
+        self.count += 1
+
+    def min_distance(self, h):
+        if self.count == 0:
+            return 64
+        return int(_popcount(self.hashes[:self.count] ^ np.uint64(h)).min())
+
+    def contains_near(self, h, max_distance):
+        return self.min_distance(h) <= max_distance
+
+
+class RoiHarvester:
+
+    def __init__(self, root, shard_size=5000, max_distance=4, queue_size=64, timeline=None, patch_id=None,
+                 tolerance='5min', jpeg_quality=95):
+        self.root = root
+        self.shard_size = shard_size
+        self.max_distance = max_distance
+        self.timeline = timeline
+        self.patch_id = patch_id
+        self.tolerance = tolerance
+        self.jpeg_quality = jpeg_quality
+
+        self.index = HashIndex()
+        self.shard = 0
+        self.shard_count = 0
+        self.written = 0
+        self.duplicates = 0
+        self.dropped = 0
+
+        os.makedirs(root, exist_ok=True)
+        self._load_existing()
+
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._loop, name='roi-harvester', daemon=True)
+        self.thread.start()
+
+    def _shard_dir(self, shard):
+        return os.path.join(self.root, 'shard-{:05d}'.format(shard))
+
+    def _load_existing(self):
+        """
+        Rebuild the hash index from the dhash column of the shards already on disk and continue after the last one
+        """
+        shards = sorted(d for d in os.listdir(self.root) if d.startswith('shard-'))
+        for name in shards:
+            labels = os.path.join(self.root, name, 'labels.csv')
+            if not os.path.isfile(labels):
+                continue
+            with open(labels, newline='') as fh:
+                rows = list(csv.DictReader(fh))
+            for row in rows:
+                self.index.add(np.uint64(int(row['dhash'], 16)))
+            self.shard = int(name.split('-')[1])
+            self.shard_count = len(rows)
+
+        if self.shard_count >= self.shard_size:
+            self.shard += 1
+            self.shard_count = 0
+
+    def submit(self, vis_img, box, temperature, timestamp=None):
+        """
+        Queue the forehead crop of one face, never blocking the caller
+        :param box: (x, y, w, h) forehead box in visual image pixels
+        :return: True if queued, False if dropped because the writer is behind
+        """
+        x, y, w, h = [int(v) for v in box]
+        x, y = max(x, 0), max(y, 0)
+        crop = vis_img[y:y + h, x:x + w]
+        if crop.size == 0:
+            return False
+
+        if timestamp is None:
+            timestamp = time.time()
+        try:
+            self.pending.put_nowait((crop.copy(), float(temperature), timestamp))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def submit_stats(self, vis_img, temp_stats, timestamp=None):
+        """
+        Queue every face returned by get_face_temperatures for one frame
+        :return:
+        """
+        for stats in temp_stats:
+            self.submit(vis_img, stats['forehead_roi_image'], stats['median'], timestamp)
+
+    def _loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                print("ROI harvester error: {}".format(e))
+
+    def _patch_temperature(self, timestamp):
+        if self.timeline is None or self.patch_id is None:
+            return ''
+        values, _, _ = self.timeline.lookup(self.patch_id, np.array([int(timestamp * 1e9)], dtype=np.int64),
+                                            tolerance=self.tolerance)
+        return '' if np.isnan(values[0]) else round(float(values[0]), 2)
+
+    def _write(self, crop, temperature, timestamp):
+        roi = cv2.resize(crop, (ROI_SIZE, ROI_SIZE), interpolation=cv2.INTER_AREA)
+        h = dhash(roi)
+        if self.index.contains_near(h, self.max_distance):
+            self.duplicates += 1
+            return
+
+        if self.shard_count >= self.shard_size:
+            self.shard += 1
+            self.shard_count = 0
+
+        shard_dir = self._shard_dir(self.shard)
+        os.makedirs(shard_dir, exist_ok=True)
+        image_name = 'roi-{:06d}.jpg'.format(self.shard_count)
+        cv2.imwrite(os.path.join(shard_dir, image_name), roi, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+
+        labels = os.path.join(shard_dir, 'labels.csv')
+        new_file = not os.path.isfile(labels)
+        with open(labels, 'a', newline='') as fh:
+            writer = csv.writer(fh)
+            if new_file:
+                writer.writerow(LABEL_COLUMNS)
+            writer.writerow([image_name, round(temperature, 2), self._patch_temperature(timestamp),
+                             time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp)), '{:016x}'.format(int(h))])
+
+        self.index.add(h)
+        self.shard_count += 1
+        self.written += 1
+
+    def close(self):
+        """
+        Write what is still queued and stop the writer thread
+        :return:
+        """
+        self.pending.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Harvest forehead ROIs from a recorded visual image')
+    parser.add_argument('-i', '--input', type=str, default='image.jpg', help='Visual image')
+    parser.add_argument('-t', '--thermal', type=str, default='thermal_map.npy', help='Thermal map (.npy)')
+    parser.add_argument('-o', '--output', type=str, default='harvested_rois', help='Dataset root')
+    parser.add_argument('--scale', type=float, default=8, help='Visual pixels per thermal pixel')
+    args = parser.parse_args()
+
+    vis_img = cv2.imread(args.input)
+    thermal = np.load(args.thermal)
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    faces = cascade.detectMultiScale(cv2.cvtColor(vis_img, cv2.COLOR_BGR2GRAY), scaleFactor=1.1, minNeighbors=5)
+
+    with RoiHarvester(args.output) as harvester:
+        for (x, y, w, h) in faces:
+            fx, fy, fw, fh = x + int(w * 0.1), y + int(h * 0.05), int(w * 0.8), int(h * 0.2)
+            s = args.scale
+            region = thermal[int(fy / s):int((fy + fh) / s), int(fx / s):int((fx + fw) / s)]
+            if region.size:
+                harvester.submit(vis_img, (fx, fy, fw, fh), np.median(region))
+
+    print("{} written, {} near-duplicates, {} dropped".format(
+        harvester.written, harvester.duplicates, harvester.dropped))
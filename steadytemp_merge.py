@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Deduplicating merge of overlapping SteadyTemp exports.
+
+Successive exports of the same patch repeat the rows already exported
+(1.csv, 2.csv and the full steadytemp exports share the rows starting at
+2025-04-30T07:16:09), so concatenating them double counts. The merger streams every export in
+chunks, keeps an index of the (patchId, time) keys already written (a
+sorted int64 array of timestamps per patch, looked up with searchsorted)
+and appends only unseen rows to one canonical Parquet file per patch.
+Only the index (8 bytes per unique row) stays in memory, never the rows.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from steadytemp_store import read_export, is_export
+
+
+class ExportMerger:
+
+    def __init__(self, out_dir, chunksize=100000):
+        self.out_dir = out_dir
+        self.chunksize = chunksize
+        os.makedirs(out_dir, exist_ok=True)
+
+        self.seen = {}           # patchId -> sorted int64 array of timestamps (ns)
+        self.last_time = {}      # patchId -> latest timestamp written
+        self.needs_sort = set()  # patches that received rows older than the latest written
+        self.writers = {}
+        self.schema = None
+
+        self.rows_read = 0
+        self.rows_written = 0
+
+    @property
+    def duplicates(self):
+        return self.rows_read - self.rows_written
+
+    def patch_filename(self, patch_id):
+        return os.path.join(self.out_dir, patch_id + '.parquet')
+
+    def add_file(self, csv_filename):
+        """
+        Stream one export into the canonical series
+        :return: number of new rows written
+        """
+        written = 0
+        for chunk in read_export(csv_filename, chunksize=self.chunksize):
+            written += self.add_frame(chunk)
+        return written
+
+    def add_folder(self, folder):
+        """
+        Stream every export of a folder, in name order
+        :return: number of new rows written
+        """
+        written = 0
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if name.endswith('.csv') and os.path.isfile(path) and is_export(path):
+                written += self.add_file(path)
+        return written
+
+    def add_frame(self, df):
+        """
+        Append the rows of df whose (patchId, time) key has not been seen yet
+        :return: number of new rows written
+        """
+        self.rows_read += len(df)
+        if df.empty:
+            return 0
+
+        df = df[~df.duplicated(['patchId', 'time'])]
+        times = df['time'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        patch_ids = df['patchId'].astype(str).to_numpy()
+
+        written = 0
+        for patch_id in np.unique(patch_ids):
+            rows = np.nonzero(patch_ids == patch_id)[0]
+            keys = times[rows]
+
+            seen = self.seen.get(patch_id, np.empty(0, dtype=np.int64))
+            at = np.searchsorted(seen, keys)
+            fresh = seen[np.minimum(at, len(seen) - 1)] != keys if len(seen) else np.ones(len(keys), dtype=bool)
+            if not fresh.any():
+                continue
+
+            rows, keys = rows[fresh], keys[fresh]
+            self.seen[patch_id] = np.union1d(seen, keys)
+
+            last = self.last_time.get(patch_id)
+            if last is not None and keys.min() < last:
+                self.needs_sort.add(patch_id)
+            if last is None or keys.max() > last:
+                self.last_time[patch_id] = int(keys.max())
+
+            self._append(patch_id, df.iloc[rows])
+            written += len(rows)
+
+        self.rows_written += written
+        return written
+
+    def _append(self, patch_id, part):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        part = part.copy()
+        # every export has different categories, store plain strings so chunks share one schema
+        for col in ('patientName', 'patientId', 'organizationId', 'patchId', 'uid'):
+            part[col] = part[col].astype('string')
+        table = pa.Table.from_pandas(part, preserve_index=False)
+
+        if self.schema is None:
+            self.schema = table.schema
+        table = table.cast(self.schema)
+
+        writer = self.writers.get(patch_id)
+        if writer is None:
+            writer = pq.ParquetWriter(self.patch_filename(patch_id), self.schema, compression='zstd')
+            self.writers[patch_id] = writer
+        writer.write_table(table)
+
+    def close(self):
+        """
+        Close the per-patch files and sort the ones that received out of order rows.
+        Sorting loads a single patch series at a time.
+        :return: list of written files
+        """
+        import pyarrow.parquet as pq
+
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+        for patch_id in sorted(self.needs_sort):
+            filename = self.patch_filename(patch_id)
+            table = pq.read_table(filename).sort_by('time')
+            pq.write_table(table, filename, compression='zstd')
+        self.needs_sort = set()
+
+        return [self.patch_filename(p) for p in sorted(self.seen)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def merge_exports(inputs, out_dir, chunksize=100000):
+    """
+    Merge exports and/or folders of exports into one canonical series per patch
+    :return: the merger, closed, with its counters
+    """
+    with ExportMerger(out_dir, chunksize=chunksize) as merger:
+        for path in inputs:
+            if os.path.isdir(path):
+                merger.add_folder(path)
+            elif is_export(path):
+                merger.add_file(path)
+    return merger
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge overlapping SteadyTemp exports, one series per patch')
+    parser.add_argument('inputs', nargs='+', help='CSV exports or folders containing them')
+    parser.add_argument('-o', '--output', type=str, default='steadytemp_merged', help='Output directory')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Rows read at a time')
+    args = parser.parse_args()
+
+    merger = merge_exports(args.inputs, args.output, chunksize=args.chunksize)
+    print("{} rows read, {} written, {} duplicates dropped".format(
+        merger.rows_read, merger.rows_written, merger.duplicates))
+    for patch_id, seen in sorted(merger.seen.items()):
+        print("  {}: {} rows -> {}".format(patch_id, len(seen), merger.patch_filename(patch_id)))
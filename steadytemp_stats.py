@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Incremental statistics over SteadyTemp temperature streams.
+
+Every summary keeps count, mean and M2 (Welford), min, max and a fixed-bin
+histogram for approximate quantiles. Summaries combine exactly (Chan et al.
+parallel update), so a new export or a live BLE sample only touches the
+summaries of its own rows, and the per-patch, per-patient and combined
+statistics are kept up to date without re-reading older exports. A live
+export that keeps growing is read from the offset reached last time.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from steadytemp_store import _utc, read_export
+
+# histogram used for the approximate quantiles, 0.05 °C resolution
+HIST_LOW = 25.0
+HIST_HIGH = 45.0
+HIST_BINS = 400
+
+LEVELS = ('bucket', 'patch', 'patient', 'all')
+
+
+class RunningStats:
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.hist = np.zeros(HIST_BINS, dtype=np.int64)
+
+    @staticmethod
+    def _bin_index(values):
+        idx = np.floor((values - HIST_LOW) * (HIST_BINS / (HIST_HIGH - HIST_LOW))).astype(np.int64)
+        return np.clip(idx, 0, HIST_BINS - 1)
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Build the summary of a batch of values in one vectorized pass
+        :return:
+        """
+        stats = cls()
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return stats
+
+        stats.count = int(values.size)
+        stats.mean = float(values.mean())
+        stats.m2 = float(((values - stats.mean) ** 2).sum())
+        stats.min = float(values.min())
+        stats.max = float(values.max())
+        stats.hist = np.bincount(cls._bin_index(values), minlength=HIST_BINS).astype(np.int64)
+        return stats
+
+    def add(self, value):
+        """
+        Welford update with a single value, for live samples
+        :return:
+        """
+        value = float(value)
+        if not np.isfinite(value):
+            return
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.hist[self._bin_index(np.array([value]))[0]] += 1
+
+    def merge(self, other):
+        """
+        Fold another summary into this one
+        :return: self
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            self.hist = other.hist.copy()
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.hist += other.hist
+        return self
+
+    @property
+    def variance(self):
+        # sample variance, same as pandas .var()
+        if self.count < 2:
+            return float('nan')
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.variance))
+
+    def quantile(self, q):
+        """
+        Approximate quantile, interpolated inside the histogram bin and clamped to [min, max]
+        :return:
+        """
+        if self.count == 0:
+            return float('nan')
+
+        cum = np.cumsum(self.hist)
+        target = q * self.count
+        i = int(np.searchsorted(cum, target, side='left'))
+        i = min(i, HIST_BINS - 1)
+        before = cum[i - 1] if i > 0 else 0
+        width = (HIST_HIGH - HIST_LOW) / HIST_BINS
+        frac = (target - before) / self.hist[i] if self.hist[i] else 0.0
+        value = HIST_LOW + (i + frac) * width
+        return float(min(max(value, self.min), self.max))
+
+    def to_dict(self):
+        nz = np.nonzero(self.hist)[0]
+        return {
+            'count': self.count, 'mean': self.mean, 'm2': self.m2,
+            'min': self.min, 'max': self.max,
+            'hist': [[int(i), int(self.hist[i])] for i in nz],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        stats.count, stats.mean, stats.m2 = d['count'], d['mean'], d['m2']
+        stats.min, stats.max = d['min'], d['max']
+        for i, c in d['hist']:
+            stats.hist[i] = c
+        return stats
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean if self.count else float('nan'),
+            'std': self.std,
+            'min': self.min if self.count else float('nan'),
+            'max': self.max if self.count else float('nan'),
+            'p05': self.quantile(0.05),
+            'median': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+        }
+
+
+def _fingerprint(fh, offset, size=4096):
+    """
+    Hash of the header line and of the bytes just before offset
+    :return: hex digest
+    """
+    fh.seek(0)
+    digest = hashlib.sha1(fh.readline())
+    fh.seek(max(offset - size, 0))
+    digest.update(fh.read(offset - max(offset - size, 0)))
+    return digest.hexdigest()
+
+
+def _last_line_end(fh, header, block=65536, settle=None):
+    """
+    Offset just after the last complete line. A last line without newline is
+    complete at EOF, unless `settle` is given for a file still being written:
+    it then counts only if it has every column and the file has not changed
+    for `settle` seconds (a finished export).
+    :return:
+    """
+    st = os.fstat(fh.fileno())
+    end = st.st_size
+    if settle is None:
+        return end
+    while end > 0:
+        start = max(end - block, 0)
+        fh.seek(start)
+        tail = fh.read(end - start)
+        i = tail.rfind(b'\n')
+        if i >= 0:
+            line_end = start + i + 1
+            if line_end < st.st_size and time.time() - st.st_mtime >= settle:
+                fh.seek(line_end)
+                if fh.read().count(b',') == header.count(b','):
+                    return st.st_size
+            return line_end
+        end = start
+    return 0
+
+
+class StatsEngine:
+
+    def __init__(self, bucket='1h', column='temperatureProcessed', valid_only=True):
+        self.bucket = bucket
+        self.column = column
+        self.valid_only = valid_only
+        self.sources = {}
+        self.levels = {level: {} for level in LEVELS}
+
+    def _fold(self, level, key, stats):
+        current = self.levels[level].get(key)
+        if current is None:
+            self.levels[level][key] = current = RunningStats()
+        current.merge(stats)
+
+    def _fold_all_levels(self, patient_id, patch_id, bucket_key, stats):
+        self._fold('bucket', (patient_id, patch_id, bucket_key), stats)
+        self._fold('patch', (patient_id, patch_id), stats)
+        self._fold('patient', (patient_id,), stats)
+        self._fold('all', (), stats)
+
+    def ingest_frame(self, df):
+        """
+        Update the summaries with the rows of an export DataFrame, in O(len(df))
+        :return: number of rows used
+        """
+        if self.valid_only:
+            df = df[df['valid']]
+        if df.empty:
+            return 0
+
+        buckets = df['time'].dt.floor(self.bucket).dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+        keys = [df['patientId'].astype(str), df['patchId'].astype(str), buckets]
+        values = df[self.column].to_numpy(dtype=np.float64)
+
+        for (patient_id, patch_id, bucket_key), idx in df.groupby(keys, sort=False).indices.items():
+            self._fold_all_levels(patient_id, patch_id, bucket_key, RunningStats.from_values(values[idx]))
+        return len(df)
+
+    def ingest_csv(self, csv_filename, force=False, follow=False):
+        """
+        Update the summaries with the rows of a SteadyTemp export not ingested yet.
+        A growing export is read from the byte offset where the last call stopped;
+        an export rewritten in place, or force=True, rebuilds the summaries from
+        every known export (live samples from add_sample are lost then).
+        :param follow: the export may still be written, wait for its last line to settle
+        :return: number of rows used
+        """
+        path = os.path.abspath(csv_filename)
+        source = self.sources.get(path)
+        if force or (source is not None and not self._appended(path, source)):
+            self.sources[path] = None
+            return self.rebuild(follow)
+        return self._ingest_from(path, source['offset'] if source else 0, follow)
+
+    def _ingest_from(self, path, offset, follow=False):
+        with open(path, 'rb') as fh:
+            header = fh.readline()
+            start = max(offset, len(header))
+            end = _last_line_end(fh, header, settle=1.0 if follow else None)
+            if end <= start:
+                used = 0
+            elif start == len(header) and end == os.fstat(fh.fileno()).st_size:
+                used = sum(self.ingest_frame(chunk) for chunk in read_export(path, chunksize=256 * 1024))
+            else:
+                fh.seek(start)
+                data = io.BytesIO(header + fh.read(end - start))
+                used = sum(self.ingest_frame(chunk) for chunk in read_export(data, chunksize=256 * 1024))
+            end = max(end, len(header))
+            self.sources[path] = {'offset': end, 'fingerprint': _fingerprint(fh, end)}
+        return used
+
+    @staticmethod
+    def _appended(path, source):
+        # same header and same bytes before the offset: the export only grew
+        if not isinstance(source, dict) or not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            return size >= source['offset'] and _fingerprint(fh, source['offset']) == source['fingerprint']
+
+    def rebuild(self, follow=False):
+        """
+        Recompute every summary from the known exports still on disk
+        :return: number of rows used
+        """
+        self.levels = {level: {} for level in LEVELS}
+        paths = [path for path in self.sources if os.path.isfile(path)]
+        self.sources = {}
+        return sum(self._ingest_from(path, 0, follow) for path in paths)
+
+    def add_sample(self, patient_id, patch_id, timestamp, value):
+        """
+        Update the summaries with a single live sample (e.g. a decoded BLE advertisement)
+        :return:
+        """
+        # naive timestamps are UTC, like in the store
+        bucket_key = _utc(timestamp).floor(self.bucket).strftime('%Y-%m-%dT%H:%M:%SZ')
+        for level, key in (('bucket', (patient_id, patch_id, bucket_key)), ('patch', (patient_id, patch_id)),
+                           ('patient', (patient_id,)), ('all', ())):
+            current = self.levels[level].get(key)
+            if current is None:
+                self.levels[level][key] = current = RunningStats()
+            current.add(value)
+
+    def get(self, level='all', key=()):
+        """
+        Return the summary stored for a key, or an empty one
+        :return:
+        """
+        return self.levels[level].get(tuple(key), RunningStats())
+
+    def combined(self, level, keys):
+        """
+        Combine the summaries of several keys of the same level, e.g. a time range of buckets
+        :return:
+        """
+        total = RunningStats()
+        for key in keys:
+            total.merge(self.get(level, key))
+        return total
+
+    def to_frame(self, level='patch'):
+        """
+        Return the summaries of one level as a DataFrame
+        :return:
+        """
+        names = {'bucket': ['patientId', 'patchId', 'bucket'], 'patch': ['patientId', 'patchId'],
+                 'patient': ['patientId'], 'all': []}[level]
+        rows = []
+        for key, stats in sorted(self.levels[level].items()):
+            row = dict(zip(names, key))
+            row.update(stats.summary())
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def save(self, json_filename):
+        state = {
+            'bucket': self.bucket, 'column': self.column, 'valid_only': self.valid_only,
+            'sources': self.sources,
+            'levels': {level: [[list(key), stats.to_dict()] for key, stats in entries.items()]
+                       for level, entries in self.levels.items()},
+        }
+        tmp_filename = json_filename + '.tmp'
+        with open(tmp_filename, 'w') as fh:
+            json.dump(state, fh)
+        os.replace(tmp_filename, json_filename)
+
+    @classmethod
+    def load(cls, json_filename):
+        with open(json_filename) as fh:
+            state = json.load(fh)
+
+        engine = cls(bucket=state['bucket'], column=state['column'], valid_only=state['valid_only'])
+        engine.sources = state['sources']
+        for level, entries in state['levels'].items():
+            engine.levels[level] = {tuple(key): RunningStats.from_dict(d) for key, d in entries}
+        return engine
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incrementally update temperature statistics with SteadyTemp exports')
+    parser.add_argument('inputs', nargs='*', help='CSV exports to ingest')
+    parser.add_argument('-s', '--state', type=str, default='steadytemp_stats.json', help='Statistics state file')
+    parser.add_argument('-b', '--bucket', type=str, default='1h', help='Time bucket of the finest level')
+    parser.add_argument('-l', '--level', type=str, default='patch', choices=LEVELS, help='Level to print')
+    args = parser.parse_args()
+
+    if os.path.isfile(args.state):
+        engine = StatsEngine.load(args.state)
+    else:
+        engine = StatsEngine(bucket=args.bucket)
+
+    for path in args.inputs:
+        print("{}: {} rows ingested".format(path, engine.ingest_csv(path)))
+
+    engine.save(args.state)
+    print(engine.to_frame(args.level).to_string(index=False))
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Columnar loader and store for SteadyTemp CSV exports.
+
+Exports are parsed once with explicit dtypes (categorical ids, float32
+temperatures, UTC timestamps, bool validity) and written to a Parquet (or
+Feather) dataset partitioned by patch and day:
+
+    store/patchId=<patch>/day=<YYYY-MM-DD>/<source hash>.parquet
+
+Queries go through pyarrow.dataset so filters on patch/day prune whole
+partitions and filters on `valid`/`time` are pushed down to the row groups.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+EXPORT_COLUMNS = ['patientName', 'patientId', 'organizationId', 'patchId', 'uid', 'time',
+                  'temperatureRaw', 'temperatureProcessed', 'valid', 'adc']
+
+ID_COLUMNS = ['patientName', 'patientId', 'organizationId', 'patchId', 'uid']
+
+EXPORT_DTYPES = {
+    'patientName': 'category',
+    'patientId': 'category',
+    'organizationId': 'category',
+    'patchId': 'category',
+    'uid': 'category',
+    'temperatureRaw': 'float32',
+    'temperatureProcessed': 'float32',
+    'valid': 'bool',
+    'adc': 'int32',
+}
+
+MANIFEST_NAME = '_sources.json'
+
+
+def is_export(csv_filename):
+    """
+    Check from the header line whether a file is a SteadyTemp export
+    :return:
+    """
+    with open(csv_filename) as fh:
+        header = fh.readline().strip().split(',')
+    return header[:len(EXPORT_COLUMNS)] == EXPORT_COLUMNS
+
+
+def read_export(csv_filename, valid_only=False, chunksize=None):
+    """
+    Read a SteadyTemp export with compact dtypes
+    :param csv_filename: path of the CSV export
+    :param valid_only: drop the rows flagged as not valid by the patch
+    :param chunksize: if given, return an iterator of DataFrames of this size
+    :return: DataFrame (or iterator of DataFrames)
+    """
+    reader = pd.read_csv(csv_filename, usecols=EXPORT_COLUMNS, dtype=EXPORT_DTYPES, chunksize=chunksize)
+
+    if chunksize is None:
+        return _finish_frame(reader, valid_only)
+
+    return (_finish_frame(chunk, valid_only) for chunk in reader)
+
+
+def _finish_frame(df, valid_only):
+    df['time'] = pd.to_datetime(df['time'], utc=True, format='ISO8601')
+    if valid_only:
+        df = df[df['valid']].reset_index(drop=True)
+    return df
+
+
+class SteadyTempStore:
+
+    def __init__(self, root, fmt='parquet'):
+        if fmt not in ('parquet', 'feather'):
+            raise ValueError("Unsupported store format: {}".format(fmt))
+
+        self.root = root
+        self.fmt = fmt
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        os.makedirs(root, exist_ok=True)
+
+    def _load_manifest(self):
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as fh:
+            return json.load(fh)
+
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(manifest, fh, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    @staticmethod
+    def _source_key(csv_filename):
+        st = os.stat(csv_filename)
+        return "{}:{}".format(st.st_size, int(st.st_mtime))
+
+    def is_ingested(self, csv_filename):
+        """
+        Check whether this exact export (same size and mtime) is already in the store
+        :return:
+        """
+        manifest = self._load_manifest()
+        entry = manifest.get(os.path.abspath(csv_filename))
+        return entry is not None and entry['key'] == self._source_key(csv_filename)
+
+    def ingest(self, csv_filename, force=False):
+        """
+        Convert one CSV export into store partitions, skipping exports already converted
+        :return: number of rows written
+        """
+        if not force and self.is_ingested(csv_filename):
+            return 0
+
+        df = read_export(csv_filename)
+        written = self.write_frame(df, tag=os.path.abspath(csv_filename))
+
+        manifest = self._load_manifest()
+        manifest[os.path.abspath(csv_filename)] = {'key': self._source_key(csv_filename), 'rows': written}
+        self._save_manifest(manifest)
+        return written
+
+    def ingest_folder(self, folder, pattern='.csv', force=False):
+        """
+        Convert every SteadyTemp export found in a folder
+        :return: total number of rows written
+        """
+        total = 0
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if not name.endswith(pattern) or not os.path.isfile(path) or not is_export(path):
+                continue
+            total += self.ingest(path, force=force)
+        return total
+
+    def write_frame(self, df, tag):
+        """
+        Write a DataFrame with export columns into the patchId/day partitions
+        :param tag: identifies the source so that re-ingesting it overwrites the same files
+        :return: number of rows written
+        """
+        import pyarrow as pa
+
+        if df.empty:
+            return 0
+
+        prefix = hashlib.sha1(tag.encode()).hexdigest()[:12]
+        day = df['time'].dt.strftime('%Y-%m-%d')
+
+        for (patch_id, day_value), part in df.groupby([df['patchId'].astype(str), day], sort=False, observed=True):
+            part_dir = os.path.join(self.root, 'patchId=' + patch_id, 'day=' + day_value)
+            os.makedirs(part_dir, exist_ok=True)
+
+            # the partition columns live in the path, like hive partitioning expects
+            table = pa.Table.from_pandas(part.drop(columns=['patchId']).sort_values('time'), preserve_index=False)
+            self._write_table(table, os.path.join(part_dir, prefix))
+
+        return len(df)
+
+    def _write_table(self, table, path_prefix):
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(table, path_prefix + '.parquet', row_group_size=64 * 1024, compression='zstd')
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, path_prefix + '.feather', compression='zstd')
+
+    def dataset(self):
+        """
+        Return the store as a pyarrow dataset
+        :return:
+        """
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        partitioning = ds.partitioning(pa.schema([('patchId', pa.string()), ('day', pa.string())]), flavor='hive')
+        return ds.dataset(self.root, format='parquet' if self.fmt == 'parquet' else 'ipc',
+                          partitioning=partitioning, exclude_invalid_files=True,
+                          ignore_prefixes=['_', '.'])
+
+    def query(self, patch_id=None, start=None, end=None, valid_only=True, columns=None):
+        """
+        Load the rows matching the filters; partitions and row groups outside them are not read
+        :param patch_id: a patch id or a list of them
+        :param start: inclusive lower bound on time (anything pd.Timestamp accepts)
+        :param end: exclusive upper bound on time
+        :param valid_only: keep only rows flagged valid
+        :param columns: subset of columns to load
+        :return: DataFrame with categorical ids and float32 temperatures
+        """
+        import pyarrow.dataset as ds
+
+        expr = None
+
+        def _and(e1, e2):
+            return e2 if e1 is None else e1 & e2
+
+        if patch_id is not None:
+            ids = [patch_id] if isinstance(patch_id, str) else list(patch_id)
+            expr = _and(expr, ds.field('patchId').isin(ids))
+        if start is not None:
+            start = _utc(start)
+            expr = _and(expr, ds.field('day') >= start.strftime('%Y-%m-%d'))
+            expr = _and(expr, ds.field('time') >= start.to_pydatetime())
+        if end is not None:
+            end = _utc(end)
+            expr = _and(expr, ds.field('day') <= end.strftime('%Y-%m-%d'))
+            expr = _and(expr, ds.field('time') < end.to_pydatetime())
+        if valid_only:
+            expr = _and(expr, ds.field('valid') == True)  # noqa: E712, builds an arrow expression
+
+        if columns is not None:
+            columns = list(columns)
+
+        table = self.dataset().to_table(columns=columns, filter=expr)
+        df = table.to_pandas()
+
+        for col in ID_COLUMNS:
+            if col in df.columns and df[col].dtype != 'category':
+                df[col] = df[col].astype('category')
+        if 'day' in df.columns:
+            df = df.drop(columns=['day'])
+
+        if 'time' in df.columns:
+            df = df.sort_values('time', kind='stable').reset_index(drop=True)
+        return df
+
+
+def _utc(value):
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        return ts.tz_localize('UTC')
+    return ts.tz_convert('UTC')
+
+
+def benchmark(csv_filenames, store_root, repeat=5):
+    """
+    Compare plain pd.read_csv + valid filter against the typed loader and the store
+    :return: dict of {method: (seconds, bytes)}
+    """
+    def _timed(fn):
+        best = float('inf')
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - start)
+        return best, int(result.memory_usage(deep=True).sum())
+
+    def _raw():
+        df = pd.concat([pd.read_csv(f) for f in csv_filenames], ignore_index=True)
+        return df[df['valid'] == True]  # noqa: E712, mirrors the notebook
+
+    def _typed():
+        return pd.concat([read_export(f, valid_only=True) for f in csv_filenames], ignore_index=True)
+
+    store = SteadyTempStore(store_root)
+    for f in csv_filenames:
+        store.ingest(f)
+
+    return {
+        'raw csv': _timed(_raw),
+        'typed csv': _timed(_typed),
+        'store': _timed(lambda: store.query(valid_only=True)),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert SteadyTemp CSV exports into a partitioned columnar store')
+    parser.add_argument('inputs', nargs='+', help='CSV exports or folders containing them')
+    parser.add_argument('-s', '--store', type=str, default='steadytemp_store', help='Store root directory')
+    parser.add_argument('-f', '--format', type=str, default='parquet', choices=['parquet', 'feather'],
+                        help='File format of the partitions')
+    parser.add_argument('--force', action='store_true', help='Re-convert exports already in the store')
+    parser.add_argument('--benchmark', action='store_true', help='Compare load time and memory against raw CSV')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        files = [f for f in args.inputs if os.path.isfile(f) and is_export(f)]
+        for method, (seconds, nbytes) in benchmark(files, args.store).items():
+            print("{:<10} {:8.2f} ms {:10.1f} KiB".format(method, seconds * 1000, nbytes / 1024))
+    else:
+        store = SteadyTempStore(args.store, fmt=args.format)
+        for path in args.inputs:
+            if os.path.isdir(path):
+                rows = store.ingest_folder(path, force=args.force)
+            else:
+                rows = store.ingest(path, force=args.force)
+            print("{}: {} rows written".format(path, rows))
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Inference for the forehead temperature CNN shipped as temperature_cnn.pth.
+
+The checkpoint is a state dict of a small Sequential network (conv_layers
+0/3/6, fc_layers 1/3) taking 32x32 RGB ROIs in [0, 1]. TemperatureEstimator
+loads it once and runs batches of ROIs through preallocated input tensors
+under torch.inference_mode; MicroBatcher groups ROIs submitted from many
+faces/frames into one forward pass, bounded by a maximum latency.
+"""
+
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+import torch
+from torch import nn
+
+INPUT_SIZE = 32
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temperature_cnn.pth')
+
+
+class TemperatureCNN(nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.conv_layers = nn.Sequential(
+            nn.Conv2d(3, 16, kernel_size=3, padding=1),
+            nn.ReLU(),
+            nn.MaxPool2d(2),
+            nn.Conv2d(16, 32, kernel_size=3, padding=1),
+            nn.ReLU(),
+            nn.MaxPool2d(2),
+            nn.Conv2d(32, 64, kernel_size=3, padding=1),
+            nn.ReLU(),
+            nn.MaxPool2d(2),
+        )
+        self.fc_layers = nn.Sequential(
+            nn.Flatten(),
+            nn.Linear(64 * (INPUT_SIZE // 8) ** 2, 128),
+            nn.ReLU(),
+            nn.Linear(128, 1),
+        )
+
+    def forward(self, x):
+        return self.fc_layers(self.conv_layers(x))
+
+
+def load_model(checkpoint=DEFAULT_CHECKPOINT, device='cpu'):
+    """
+    Build the network and load the checkpoint weights, in eval mode
+    :return:
+    """
+    model = TemperatureCNN()
+    model.load_state_dict(torch.load(checkpoint, map_location=device, weights_only=True))
+    model.to(device)
+    model.eval()
+    return model
+
+
+def preprocess_roi(roi, out, bgr=True):
+    """
+    Resize one uint8 HxWx3 ROI to the network input and write it as CHW float into out
+    :param out: float32 tensor/array view of shape (3, INPUT_SIZE, INPUT_SIZE)
+    :param bgr: the ROI comes from OpenCV (BGR), the network was trained on RGB
+    :return:
+    """
+    if roi.shape[0] != INPUT_SIZE or roi.shape[1] != INPUT_SIZE:
+        roi = cv2.resize(roi, (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_AREA)
+    if roi.ndim == 2:
+        roi = cv2.cvtColor(roi, cv2.COLOR_GRAY2RGB)
+    elif bgr:
+        roi = cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)
+    np.multiply(roi.transpose(2, 0, 1), 1.0 / 255.0, out=out, casting='unsafe')
+
+
+def load_roi_image(image_filename):
+    """
+    Read an ROI image from disk as RGB uint8
+    :return:
+    """
+    img = cv2.imread(image_filename, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not read image: {}".format(image_filename))
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+class TemperatureEstimator:
+
+    def __init__(self, checkpoint=DEFAULT_CHECKPOINT, max_batch=64, num_threads=None, model=None):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+        self.model = model if model is not None else load_model(checkpoint)
+        self.max_batch = max_batch
+        # reused for every call, no allocation per batch
+        self.input_buffer = torch.empty((max_batch, 3, INPUT_SIZE, INPUT_SIZE), dtype=torch.float32)
+        self.input_np = self.input_buffer.numpy()
+
+    def predict(self, rois, bgr=True):
+        """
+        Estimate the temperature of many ROIs, max_batch of them per forward pass
+        :param rois: sequence of uint8 HxWx3 (or HxW) images of any size
+        :return: float32 array of temperatures
+        """
+        out = np.empty(len(rois), dtype=np.float32)
+        with torch.inference_mode():
+            for start in range(0, len(rois), self.max_batch):
+                batch = rois[start:start + self.max_batch]
+                for i, roi in enumerate(batch):
+                    preprocess_roi(roi, self.input_np[i], bgr=bgr)
+                result = self.model(self.input_buffer[:len(batch)])
+                out[start:start + len(batch)] = result[:, 0].numpy()
+        return out
+
+    def predict_one(self, roi, bgr=True):
+        return float(self.predict([roi], bgr=bgr)[0])
+
+
+class MicroBatcher:
+    """
+    Collect ROIs submitted from any thread and run them together through the estimator.
+    A batch is run as soon as it is full or when its oldest ROI has waited max_latency seconds.
+    """
+
+    def __init__(self, estimator, max_batch=None, max_latency=0.01):
+        self.estimator = estimator
+        self.max_batch = max_batch or estimator.max_batch
+        self.max_latency = max_latency
+        self.pending = queue.Queue()
+        self.running = True
+        self.batches = 0
+        self.items = 0
+
+        self.thread = threading.Thread(target=self._loop, name='cnn-microbatcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, roi, bgr=True):
+        """
+        Queue one ROI
+        :return: Future resolving to its temperature
+        """
+        if not self.running:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self.pending.put((roi, bgr, future))
+        return future
+
+    def map(self, rois, bgr=True):
+        futures = [self.submit(roi, bgr) for roi in rois]
+        return np.array([f.result() for f in futures], dtype=np.float32)
+
+    def _loop(self):
+        while self.running or not self.pending.empty():
+            try:
+                first = self.pending.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._run(batch)
+
+    def _run(self, batch):
+        # one forward pass per colour order, in practice all ROIs share the same
+        for bgr in (True, False):
+            items = [item for item in batch if item[1] == bgr]
+            if not items:
+                continue
+            try:
+                temps = self.estimator.predict([roi for roi, _, _ in items], bgr=bgr)
+            except Exception as e:
+                for _, _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), temp in zip(items, temps):
+                future.set_result(float(temp))
+
+        self.batches += 1
+        self.items += len(batch)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def benchmark(rois, estimator, repeat=3):
+    """
+    Throughput in ROIs/s of one-at-a-time, batched and micro-batched inference
+    :return: dict
+    """
+    def _best(fn):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return len(rois) / best
+
+    results = {
+        'single': _best(lambda: [estimator.predict_one(r, bgr=False) for r in rois]),
+        'batched': _best(lambda: estimator.predict(rois, bgr=False)),
+    }
+    with MicroBatcher(estimator) as batcher:
+        results['microbatched'] = _best(lambda: batcher.map(rois, bgr=False))
+    return results
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description='Run the temperature CNN on forehead ROI images')
+    parser.add_argument('-m', '--model', type=str, default=DEFAULT_CHECKPOINT, help='Checkpoint file')
+    parser.add_argument('-l', '--labels', type=str, default='labels.csv', help='CSV with image_path,temperature')
+    parser.add_argument('-d', '--images', type=str, default='roi_images', help='Folder of the ROI images')
+    parser.add_argument('-b', '--batch', type=int, default=64, help='Maximum batch size')
+    parser.add_argument('-t', '--threads', type=int, help='Number of torch threads')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N',
+                        help='Measure throughput over N ROIs (the images repeated)')
+    args = parser.parse_args()
+
+    labels = pd.read_csv(args.labels)
+    images = [load_roi_image(os.path.join(args.images, p)) for p in labels['image_path']]
+    estimator = TemperatureEstimator(args.model, max_batch=args.batch, num_threads=args.threads)
+
+    predicted = estimator.predict(images, bgr=False)
+    for path, expected, temp in zip(labels['image_path'], labels['temperature'], predicted):
+        print("{:<12} {:6.2f} °C (label {:.2f})".format(path, temp, expected))
+
+    if args.benchmark:
+        rois = [images[i % len(images)] for i in range(args.benchmark)]
+        for method, rate in benchmark(rois, estimator).items():
+            print("{:<13} {:10.0f} ROIs/s".format(method, rate))
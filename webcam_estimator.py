@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Webcam forehead temperature estimator (the Haar + luminance cells of the notebook as a module).
+
+LatestFrameGrabber reads the camera in a background thread and always hands
+out the newest frame, dropping the ones the processing could not keep up
+with. Forehead ROIs come from a forehead_roi provider (Haar on a downscaled
+gray frame by default) and the blur is applied only to each ROI. The luminance -> temperature mapping is a
+pluggable model; LinearLuminanceModel defaults to the notebook's
+34 + intensity / 255 * 4 and can be fitted to reference readings.
+
+The benchmark runs over a recorded video so no camera is needed:
+
+    python webcam_estimator.py --video recording.mp4 --benchmark
+"""
+
+import argparse
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from forehead_roi import HaarFractionRoi, make_provider
+
+
+class LinearLuminanceModel:
+    """
+    temperature = offset + intensity / 255 * span
+    """
+
+    def __init__(self, offset=34.0, span=4.0):
+        self.offset = offset
+        self.span = span
+
+    def predict(self, intensity):
+        return self.offset + np.asarray(intensity, dtype=np.float64) / 255.0 * self.span
+
+    def fit(self, intensities, temperatures):
+        """
+        Least squares calibration against reference temperatures (e.g. paired patch readings)
+        :return: self
+        """
+        x = np.asarray(intensities, dtype=np.float64) / 255.0
+        span, offset = np.polyfit(x, np.asarray(temperatures, dtype=np.float64), 1)
+        self.offset, self.span = float(offset), float(span)
+        return self
+
+    def save(self, json_filename):
+        with open(json_filename, 'w') as fh:
+            json.dump({'offset': self.offset, 'span': self.span}, fh)
+
+    @classmethod
+    def load(cls, json_filename):
+        with open(json_filename) as fh:
+            return cls(**json.load(fh))
+
+
+class LatestFrameGrabber:
+    """
+    Read frames in a background thread and keep only the newest one.
+    With realtime=True a video file is paced at its own frame rate, as a camera would be.
+    """
+
+    def __init__(self, source=0, realtime=False):
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise ValueError("Could not open video source: {}".format(source))
+
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1.0 / fps if realtime and fps > 0 else 0.0
+
+        self.cond = threading.Condition()
+        self.frame = None
+        self.frame_time = 0.0
+        self.seq = 0
+        self.read_seq = 0
+        self.dropped = 0
+        self.finished = False
+        self.running = True
+
+        self.thread = threading.Thread(target=self._loop, name='frame-grabber', daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        next_time = time.monotonic()
+        while self.running:
+            ok, frame = self.cap.read()
+            if not ok:
+                break
+            if self.frame_interval:
+                next_time += self.frame_interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            with self.cond:
+                if self.seq > self.read_seq:
+                    self.dropped += 1
+                self.frame = frame
+                self.frame_time = time.monotonic()
+                self.seq += 1
+                self.cond.notify_all()
+
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    def read(self):
+        """
+        Wait for a frame newer than the last one returned; a camera that stalls
+        (warm-up, exposure change) is waited for, only the end of the source stops
+        :return: (frame, capture time) or (None, None) when the source is exhausted
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > self.read_seq or self.finished)
+            if self.seq == self.read_seq:
+                return None, None
+            self.read_seq = self.seq
+            return self.frame, self.frame_time
+
+    def release(self):
+        self.running = False
+        self.thread.join()
+        self.cap.release()
+
+
+class ForeheadTemperatureEstimator:
+
+    def __init__(self, model=None, roi_provider=None, blur_kernel=(5, 5), blur_sigma=0.5):
+        """
+        :param model: luminance -> temperature model with a predict(array) method
+        :param roi_provider: forehead_roi provider, Haar face box fractions by default
+        """
+        self.model = model if model is not None else LinearLuminanceModel()
+        self.roi_provider = roi_provider if roi_provider is not None else HaarFractionRoi()
+        self.blur_kernel = blur_kernel
+        self.blur_sigma = blur_sigma
+
+    def process(self, frame):
+        """
+        Estimate the temperature of every face in a BGR frame
+        :return: list of dicts with face box, forehead box, intensity and temperature
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        results = []
+        intensities = []
+        for located in self.roi_provider.locate(frame, gray):
+            fx, fy, fw, fh = located['forehead_roi']
+            roi = gray[fy:fy + fh, fx:fx + fw]
+            if roi.size == 0:
+                continue
+            if self.blur_kernel:
+                roi = cv2.GaussianBlur(roi, self.blur_kernel, self.blur_sigma)
+            intensities.append(float(roi.mean()))
+            results.append(dict(located))
+
+        if results:
+            temps = self.model.predict(np.array(intensities))
+            for r, intensity, temp in zip(results, intensities, temps):
+                r['intensity'] = intensity
+                r['temperature'] = float(temp)
+        return results
+
+    @staticmethod
+    def draw(frame, results):
+        for r in results:
+            if r['face_roi'] is not None:
+                x, y, w, h = r['face_roi']
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            fx, fy, fw, fh = r['forehead_roi']
+            cv2.rectangle(frame, (fx, fy), (fx + fw, fy + fh), (0, 0, 255), 2)
+            cv2.putText(frame, "{:.1f} C".format(r['temperature']), (fx, fy - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+        return frame
+
+
+def benchmark(video, estimator, realtime=True, max_frames=None):
+    """
+    Run the estimator over a video file through the grabber
+    :return: dict with processed FPS, frames dropped and capture-to-result latency percentiles (ms)
+    """
+    grabber = LatestFrameGrabber(video, realtime=realtime)
+    latencies = []
+    start = time.monotonic()
+    try:
+        while max_frames is None or len(latencies) < max_frames:
+            frame, captured = grabber.read()
+            if frame is None:
+                break
+            estimator.process(frame)
+            latencies.append(time.monotonic() - captured)
+    finally:
+        elapsed = time.monotonic() - start
+        grabber.release()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'frames': len(latencies),
+        'dropped': grabber.dropped,
+        'fps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_ms': float(np.percentile(latencies, 50)) if latencies.size else float('nan'),
+        'latency_p95_ms': float(np.percentile(latencies, 95)) if latencies.size else float('nan'),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Estimate forehead temperature from a webcam or video')
+    parser.add_argument('--camera', type=int, default=0, help='Camera index')
+    parser.add_argument('--video', type=str, help='Video file used instead of the camera')
+    parser.add_argument('--model', type=str, help='Calibrated luminance model (JSON)')
+    parser.add_argument('--detect-width', type=int, default=320, help='Width of the frame used for detection')
+    parser.add_argument('--roi', type=str, default='haar', choices=['haar', 'pose', 'mesh', 'dlib'],
+                        help='Forehead ROI provider')
+    parser.add_argument('--predictor', type=str, help='dlib 68 point shape predictor file')
+    parser.add_argument('--benchmark', action='store_true', help='Report FPS and latency instead of displaying')
+    parser.add_argument('--fast', action='store_true', help='Benchmark: read the video as fast as possible')
+    args = parser.parse_args()
+
+    model = LinearLuminanceModel.load(args.model) if args.model else LinearLuminanceModel()
+    if args.roi == 'haar':
+        provider = HaarFractionRoi(detect_width=args.detect_width)
+    elif args.roi == 'dlib':
+        provider = make_provider('dlib', predictor_path=args.predictor)
+    else:
+        provider = make_provider(args.roi)
+    estimator = ForeheadTemperatureEstimator(model=model, roi_provider=provider)
+    source = args.video if args.video else args.camera
+
+    if args.benchmark:
+        for key, value in benchmark(source, estimator, realtime=not args.fast).items():
+            print("{:<16} {}".format(key, value))
+    else:
+        grabber = LatestFrameGrabber(source, realtime=args.video is not None)
+        try:
+            while True:
+                frame, _ = grabber.read()
+                if frame is None:
+                    break
+                cv2.imshow("Forehead temp", estimator.draw(frame, estimator.process(frame)))
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+        finally:
+            grabber.release()
+            cv2.destroyAllWindows()